@@ -0,0 +1,180 @@
+"""conftest.py
+
+Shared pytest fixtures for WeekendFare tests
+
+"""
+from os import path, environ, remove, makedirs
+from datetime import datetime
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+import subprocess
+import threading
+import shutil
+import platform
+import json
+import time
+
+import pytest
+
+HERE = path.abspath(path.dirname(__file__))
+ROOT = path.dirname(HERE)
+
+DEMO_RESPONSE_PATH = path.join(HERE, 'demo_response.json')
+
+BENCHMARK_RESULTS_PATH = environ.get(
+    'WEEKENDFARE_BENCHMARKS',
+    path.join(HERE, 'benchmarks.jsonl')
+)
+
+def get_git_commit():
+    """short hash of checked-out commit, for tagging benchmark results"""
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=ROOT,
+            stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        return 'unknown'
+
+@pytest.fixture(scope='session')
+def record_benchmark():
+    """append benchmark timings to BENCHMARK_RESULTS_PATH (one JSON line each)
+
+    Returns:
+        (callable): `record_benchmark(name, seconds, **extra)`
+
+    """
+    commit = get_git_commit()
+    def _record(name, seconds, **extra):
+        result = {
+            'name': name,
+            'seconds': seconds,
+            'commit': commit,
+            'python': platform.python_version(),
+            'recorded_at': datetime.utcnow().isoformat()
+        }
+        result.update(extra)
+        with open(BENCHMARK_RESULTS_PATH, 'a') as filehandle:
+            filehandle.write(json.dumps(result, sort_keys=True) + '\n')
+        return result
+    return _record
+
+class LocalQPXHandler(BaseHTTPRequestHandler):
+    """minimal QPX `trips/search` stand-in: answers every POST with the demo response"""
+    protocol_version = 'HTTP/1.1'
+    delay = 0.0
+    requests_seen = []
+    fail_statuses = []      #statuses to reply with first, one per POST
+    with open(DEMO_RESPONSE_PATH, 'rb') as demo_fh:
+        response_body = demo_fh.read()
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers['Content-Length'])
+        LocalQPXHandler.requests_seen.append(json.loads(self.rfile.read(length).decode()))
+        time.sleep(LocalQPXHandler.delay)
+        if LocalQPXHandler.fail_statuses:
+            self.send_response(LocalQPXHandler.fail_statuses.pop(0))
+            self.send_header('Retry-After', '0')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(self.response_body)))
+        self.end_headers()
+        self.wfile.write(self.response_body)
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+LOCAL_CONFIG_TEMPLATE = '''
+[LOGGING]
+    log_level = INFO
+    log_path = {log_path}
+
+[QPX]
+    base_url = {base_url}
+    api_key = TEST
+    query_limit = 10000
+    query_rate = 0
+    quota_state = {quota_path}
+    flight_locks = {flight_path}
+    retries = 0
+
+[WeekendFare]
+    early_time = 06:00
+    late_time = 22:00
+    refund = false
+    solutions = 20
+    qpx_cache = {cache_path}
+    fare_history = {history_path}
+'''
+@pytest.fixture
+def local_weekendfare():
+    """point `weekendfare.WeekendFare` at a local QPX stand-in and a scratch cache
+
+    Yields:
+        (module, :obj:`LocalQPXHandler`): configured WeekendFare module, server handler class
+            (`.config_path` points at the generated config)
+
+    """
+    import weekendfare.WeekendFare as wf
+
+    scratch_dir = path.join(HERE, 'cache')
+    makedirs(scratch_dir, exist_ok=True)
+    config_path = path.join(scratch_dir, 'local_weekendfare.cfg')
+    cache_path = path.join(scratch_dir, 'local_weekendfare.dat')
+    quota_path = path.join(scratch_dir, 'local_weekendfare_quota.json')
+    flight_path = path.join(scratch_dir, 'local_weekendfare_flights')
+    history_path = path.join(scratch_dir, 'local_weekendfare_history.db')
+    for scratch_path in (cache_path, cache_path + '.queries', cache_path + '.refs', history_path):
+        if path.isfile(scratch_path):
+            remove(scratch_path)
+
+    LocalQPXHandler.delay = 0.0
+    LocalQPXHandler.requests_seen = []
+    LocalQPXHandler.fail_statuses = []
+    LocalQPXHandler.config_path = config_path
+    server = ThreadingHTTPServer(('127.0.0.1', 0), LocalQPXHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    with open(config_path, 'w') as filehandle:
+        filehandle.write(LOCAL_CONFIG_TEMPLATE.format(
+            log_path=path.join(HERE, 'logs'),
+            base_url='http://127.0.0.1:{0}/qpxExpress/v1/trips'.format(server.server_address[1]),
+            cache_path=cache_path,
+            quota_path=quota_path,
+            flight_path=flight_path,
+            history_path=history_path
+        ))
+
+    wf.QPX_DB = None
+    wf.QPX_SESSION = None
+    wf.QPX_SCHEDULER = None
+    wf.QPX_FLIGHTS = None
+    wf.QPX_HISTORY = None
+    wf.QPX_ALERTS = None
+    wf.get_config(config_path)
+    yield wf, LocalQPXHandler
+
+    server.shutdown()
+    server.server_close()
+    if wf.QPX_DB is not None:
+        wf.QPX_DB.close()
+    if wf.QPX_HISTORY is not None:
+        wf.QPX_HISTORY.close()
+    wf.config = None
+    wf.QPX_DB = None
+    wf.QPX_SESSION = None
+    wf.QPX_SCHEDULER = None
+    wf.QPX_FLIGHTS = None
+    wf.QPX_HISTORY = None
+    wf.QPX_ALERTS = None
+    remove(config_path)
+    for scratch_path in (cache_path, cache_path + '.queries', cache_path + '.refs', quota_path, quota_path + '.lock', history_path):
+        if path.isfile(scratch_path):
+            remove(scratch_path)
+    shutil.rmtree(flight_path, ignore_errors=True)
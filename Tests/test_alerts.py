@@ -0,0 +1,128 @@
+"""test_alerts.py
+
+Pytest functions for exercising weekendfare.alerts
+
+"""
+from os import path, remove, makedirs
+import json
+
+import weekendfare.alerts as wf_alerts
+import weekendfare.qpx_parser as wf_parser
+
+HERE = path.abspath(path.dirname(__file__))
+
+DEMO_RESPONSE_PATH = path.join(HERE, 'demo_response.json')
+with open(DEMO_RESPONSE_PATH, 'r') as resp_fh:
+    DEMO_RESPONSE = json.load(resp_fh)
+DEMO_ROUTE = ('SEA', 'DEN', '2017-01-13')
+DEMO_CHEAPEST = 20680
+
+STATE_PATH = path.join(HERE, 'cache', 'test_fare_alerts.json')
+makedirs(path.dirname(STATE_PATH), exist_ok=True)
+
+def helper_options(scale=1.0):
+    """demo trip options with every price scaled"""
+    trip_options = list(wf_parser.iter_trip_options(DEMO_RESPONSE))
+    for trip_option in trip_options:
+        trip_option.price_cents = int(round(trip_option.price_cents * scale))
+    return trip_options
+
+def helper_clean_state():
+    """remove saved alert state between tests"""
+    if path.isfile(STATE_PATH):
+        remove(STATE_PATH)
+
+def test_rolling_median():
+    """median of the last `size` values only"""
+    median = wf_alerts.RollingMedian(3)
+    assert median.median() is None
+    for value in (10, 30, 20):
+        median.push(value)
+    assert median.median() == 20
+    median.push(1)      #drops 10
+    assert median.values() == [30, 20, 1]
+    assert median.median() == 20
+    assert wf_alerts.RollingMedian(4, [1, 2, 3, 4]).median() == 2.5
+
+def test_route_state_and_top_k():
+    """one observation per route/date: minimum and k cheapest, stable on ties"""
+    engine = wf_alerts.AlertEngine(top_k=3)
+    trip_options = helper_options()
+    assert engine.observe(list(reversed(trip_options)), observed_at=1000) == []
+
+    state = engine.route(*DEMO_ROUTE)
+    assert len(engine) == 1
+    assert state.minimum == DEMO_CHEAPEST
+    assert [price for price, _, _ in state.top] == [DEMO_CHEAPEST] * 3
+    assert state.top[0][2] == 'UA294,UA2014'    #first cheapest seen (reversed input)
+    assert state.median.values() == [DEMO_CHEAPEST]
+
+def test_drop_alert():
+    """a drop fires once, then only after the fare rebounds"""
+    engine = wf_alerts.AlertEngine(drop_pct=0.2)
+    for _ in range(wf_alerts.MIN_SAMPLES - 1):
+        engine.observe(helper_options())
+    assert engine.observe(helper_options(0.7)) == []    #not enough history yet
+
+    engine = wf_alerts.AlertEngine(drop_pct=0.2)
+    for _ in range(wf_alerts.MIN_SAMPLES):
+        engine.observe(helper_options())
+    alerts = engine.observe(helper_options(0.7), observed_at=1000)
+    assert len(alerts) == 1
+    alert = alerts[0]
+    assert alert.kind == 'drop'
+    assert alert.route == DEMO_ROUTE + ('',)
+    assert alert.price_cents == int(round(DEMO_CHEAPEST * 0.7))
+    assert alert.previous_cents == DEMO_CHEAPEST
+    assert round(alert.drop_pct, 2) == 0.3
+    assert alert.to_dict()['flights'] == 'UA294,UA223'
+    assert 'DROP SEA->DEN 2017-01-13' in str(alert)
+
+    assert engine.observe(helper_options(0.7)) == []    #same deal: no repeat
+    assert engine.observe(helper_options(0.69)) != []   #cheaper still
+    engine.observe(helper_options())                    #rebound re-arms
+    assert engine.observe(helper_options(0.69))[0].kind == 'drop'
+
+def test_routes_kept_apart():
+    """round trips and other query scopes never feed a one-way's median"""
+    engine = wf_alerts.AlertEngine(drop_pct=0.2)
+    for _ in range(wf_alerts.MIN_SAMPLES):
+        engine.observe(helper_options())
+    round_trips = helper_options(0.5)
+    for trip_option in round_trips:
+        trip_option.slices = trip_option.slices * 2
+
+    assert engine.observe(round_trips) == []
+    assert engine.observe(helper_options(0.5), scope='2 adults') == []
+    assert len(engine) == 3
+    assert engine.route(*DEMO_ROUTE).median.values() == [DEMO_CHEAPEST] * wf_alerts.MIN_SAMPLES
+    assert engine.route('SEA', 'DEN', '2017-01-13/2017-01-13').minimum == DEMO_CHEAPEST // 2
+    assert engine.route(*DEMO_ROUTE, scope='2 adults').minimum == DEMO_CHEAPEST // 2
+
+def test_threshold_alert():
+    """at/under `max_price` fires without any history"""
+    engine = wf_alerts.AlertEngine(max_price=DEMO_CHEAPEST, drop_pct=0)
+    alerts = engine.observe(helper_options())
+    assert [alert.kind for alert in alerts] == ['threshold']
+    assert engine.observe(helper_options()) == []
+    assert wf_alerts.AlertEngine(max_price=DEMO_CHEAPEST - 1).observe(helper_options()) == []
+
+def test_state_persists():
+    """saved state reloads: median, top-k and alert arming survive a restart"""
+    helper_clean_state()
+    engine = wf_alerts.AlertEngine(STATE_PATH, drop_pct=0.2, save_interval=3600)
+    for _ in range(wf_alerts.MIN_SAMPLES):
+        engine.observe(helper_options())
+    assert engine.observe(helper_options(0.7))
+    assert engine.save()
+    assert not engine.save()    #nothing changed since
+
+    reloaded = wf_alerts.AlertEngine(STATE_PATH, drop_pct=0.2)
+    state = reloaded.route(*DEMO_ROUTE)
+    assert state.median.values() == engine.route(*DEMO_ROUTE).median.values()
+    assert state.top == engine.route(*DEMO_ROUTE).top
+    assert reloaded.observe(helper_options(0.7)) == []  #already alerted before the restart
+
+    assert reloaded.expire('2017-01-14') == 1
+    assert len(reloaded) == 0
+    helper_clean_state()
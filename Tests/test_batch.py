@@ -0,0 +1,124 @@
+"""test_batch.py
+
+Pytest functions for exercising weekendfare.batch
+
+"""
+from os import path, remove, makedirs
+import threading
+import json
+import io
+
+import pytest
+
+import weekendfare.batch as wf_batch
+
+HERE = path.abspath(path.dirname(__file__))
+CHECKPOINT_PATH = path.join(HERE, 'cache', 'test_batch.checkpoint')
+makedirs(path.dirname(CHECKPOINT_PATH), exist_ok=True)
+
+class Crash(BaseException):
+    """stands in for the process dying mid-batch"""
+
+def helper_input(count, bad_lines=()):
+    """JSONL bytes: `{"n": i}` per line, junk on `bad_lines` (1-based)"""
+    lines = []
+    for number in range(1, count + 1):
+        lines.append(b'not json' if number in bad_lines else json.dumps({'n': number}).encode())
+    return b'\n'.join(lines) + b'\n'
+
+def helper_clean_checkpoint():
+    """remove checkpoint between tests"""
+    for checkpoint_path in (CHECKPOINT_PATH, CHECKPOINT_PATH + '.tmp'):
+        if path.isfile(checkpoint_path):
+            remove(checkpoint_path)
+
+def helper_query(item):
+    """multiples of 7 are invalid"""
+    if item['n'] % 7 == 0:
+        raise ValueError('multiple of 7')
+    return item['n']
+
+def helper_resolve(number):
+    """multiples of 5 fail upstream"""
+    if number % 5 == 0:
+        raise RuntimeError('upstream failed')
+    return {'square': number * number}
+
+def test_batch_order_and_errors():
+    """results come out in input order; bad lines and failures get their own result"""
+    output = io.StringIO()
+    runner = wf_batch.BatchRunner(helper_query, helper_resolve, max_workers=4)
+    stats = runner.run(io.BytesIO(helper_input(30, bad_lines=(3,)) + b'\n\n'), output)
+
+    results = [json.loads(line) for line in output.getvalue().splitlines()]
+    assert [result['line'] for result in results] == list(range(1, 31))
+    assert results[0] == {'line': 1, 'ok': True, 'square': 1}
+    assert results[2]['ok'] is False and 'Expecting value' in results[2]['error']
+    assert results[6] == {'line': 7, 'ok': False, 'error': 'multiple of 7'}
+    assert results[4] == {'line': 5, 'ok': False, 'error': 'upstream failed'}
+    assert stats == {'lines': 30, 'ok': 19, 'invalid': 5, 'failed': 6}
+
+def test_batch_window_is_bounded():
+    """a slow head of line stops reading ahead at `window` requests"""
+    lines_read = []
+    class CountingInput(object):
+        def __iter__(self):
+            for raw_line in io.BytesIO(helper_input(200)):
+                lines_read.append(raw_line)
+                yield raw_line
+
+    unblock = threading.Event()
+    read_while_blocked = []
+    def resolve(number):
+        if number == 1:
+            unblock.wait(5)
+        return {}
+    def watchdog():
+        threading.Event().wait(0.3)
+        read_while_blocked.append(len(lines_read))
+        unblock.set()
+    threading.Thread(target=watchdog, daemon=True).start()
+
+    output = io.StringIO()
+    wf_batch.BatchRunner(helper_query, resolve, max_workers=2, window=8).run(CountingInput(), output)
+    assert read_while_blocked[0] <= 8
+    assert len(output.getvalue().splitlines()) == 200
+
+def test_batch_resume():
+    """a crashed batch resumes after its last checkpoint, a finished one is done"""
+    helper_clean_checkpoint()
+    input_bytes = helper_input(2 * wf_batch.CHECKPOINT_EVERY + 50)
+    def crashing_query(item):
+        if item['n'] == 2 * wf_batch.CHECKPOINT_EVERY + 20:
+            raise Crash()
+        return helper_query(item)
+
+    first_output = io.StringIO()
+    runner = wf_batch.BatchRunner(
+        crashing_query,
+        helper_resolve,
+        checkpoint=wf_batch.Checkpoint(CHECKPOINT_PATH, 'input.jsonl')
+    )
+    with pytest.raises(Crash):
+        runner.run(io.BytesIO(input_bytes), first_output)
+    saved = wf_batch.Checkpoint(CHECKPOINT_PATH, 'input.jsonl').load()
+    assert 0 < saved.line < 2 * wf_batch.CHECKPOINT_EVERY + 20
+    assert saved.offset == len(b''.join(io.BytesIO(input_bytes).readlines()[:saved.line]))
+
+    resumed_output = io.StringIO()
+    runner = wf_batch.BatchRunner(
+        helper_query,
+        helper_resolve,
+        checkpoint=wf_batch.Checkpoint(CHECKPOINT_PATH, 'input.jsonl')
+    )
+    runner.run(io.BytesIO(input_bytes), resumed_output, resume=True)
+    lines = [json.loads(line)['line'] for line in resumed_output.getvalue().splitlines()]
+    assert lines == list(range(saved.line + 1, 2 * wf_batch.CHECKPOINT_EVERY + 51))
+
+    done_output = io.StringIO()
+    runner.run(io.BytesIO(input_bytes), done_output, resume=True)
+    assert done_output.getvalue() == ''
+
+    with pytest.raises(ValueError):
+        wf_batch.Checkpoint(CHECKPOINT_PATH, 'other.jsonl').load()
+    helper_clean_checkpoint()
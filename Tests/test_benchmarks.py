@@ -0,0 +1,273 @@
+"""test_benchmarks.py
+
+Performance benchmarks for WeekendFare hot paths
+
+-- Recorded with the `record_benchmark` fixture (one JSON line per result)
+-- Compare `Tests/benchmarks.jsonl` across commits to spot regressions
+
+"""
+from os import path, remove, cpu_count
+import subprocess
+import statistics
+import json
+import time
+import sys
+
+import pytest
+
+import weekendfare.fare_cache as wf_cache
+import weekendfare.qpx_request as wf_request
+import weekendfare.stub_server as wf_stub
+import weekendfare.cache_codec as wf_codec
+import weekendfare.parse_pool as wf_parse_pool
+
+HERE = path.abspath(path.dirname(__file__))
+ROOT = path.dirname(HERE)
+
+DEMO_RESPONSE_PATH = path.join(HERE, 'demo_response.json')
+with open(DEMO_RESPONSE_PATH, 'r') as resp_fh:
+    DEMO_RESPONSE = json.load(resp_fh)
+
+CACHE_SIZES = (100, 1000, 4000)
+SOLUTION_COUNTS = (20, 100, 500)
+LOOKUPS = 500
+VALIDATIONS = 500
+SWEEP_DESTINATIONS = ('DEN', 'LAX', 'SFO', 'PDX')
+SWEEP_DATES = 8
+SWEEP_LATENCY = 0.02        #seconds per stub answer
+SWEEP_WORKERS = 8
+SWEEP_MISSES = 64           #distinct route/dates: every one a cache miss
+PARSE_RESPONSES = 1000
+PARSE_PROCESSES = sorted({1, 2, 4, cpu_count() or 1})
+
+def helper_query(destination, date, solutions=20):
+    """one-way SEA query like the CLI builds"""
+    return {
+        'request': {
+            'slice': [{'origin': 'SEA', 'destination': destination, 'date': date}],
+            'passengers': {'adultCount': 1},
+            'solutions': solutions,
+            'refundable': False
+        }
+    }
+
+def helper_date(index):
+    """distinct YYYY-MM-DD per index"""
+    return time.strftime('%Y-%m-%d', time.gmtime(1484265600 + index * 86400))
+
+@pytest.mark.parametrize('cache_size', CACHE_SIZES)
+def test_try_cache_latency(local_weekendfare, record_benchmark, cache_size):
+    """`try_cache()` hit latency should not grow with cache size"""
+    wf, _ = local_weekendfare
+    record = dict(DEMO_RESPONSE)
+    record['trips'] = dict(DEMO_RESPONSE['trips'], tripOption=DEMO_RESPONSE['trips']['tripOption'][:1])
+    cache = wf.get_cache()
+    cache.max_entries = cache_size + 1
+    now = time.time()
+    qpx_queries = []
+    for index in range(cache_size):
+        qpx_query = wf_request.canonicalize(helper_query('DEN', helper_date(index)))
+        qpx_slices, qpx_filters = wf_cache.split_query(qpx_query)
+        cache.put(wf_cache.cache_key(qpx_slices[0], qpx_filters), record, now=now)
+        qpx_queries.append((qpx_slices[0], qpx_filters))
+
+    timings = []
+    for index in range(LOOKUPS):
+        qpx_slice, qpx_filters = qpx_queries[(index * 7919) % cache_size]
+        start = time.perf_counter()
+        found = wf.try_cache(qpx_slice, qpx_filters)
+        timings.append(time.perf_counter() - start)
+        assert found is not None
+
+    record_benchmark(
+        'try_cache_hit',
+        statistics.median(timings),
+        cache_size=cache_size,
+        p95_seconds=sorted(timings)[int(LOOKUPS * 0.95)]
+    )
+
+@pytest.mark.parametrize('solutions', SOLUTION_COUNTS)
+def test_parse_response_throughput(record_benchmark, solutions):
+    """`parse_response()` over raw bytes, as fetched"""
+    import weekendfare.WeekendFare as wf
+    response = wf_stub.synthesize_response(
+        helper_query('DEN', '2017-01-13', solutions=solutions), DEMO_RESPONSE
+    )
+    raw_response = json.dumps(response).encode('utf-8')
+
+    timings = []
+    for _ in range(5):
+        start = time.perf_counter()
+        trip_options = wf.parse_response(raw_response)
+        timings.append(time.perf_counter() - start)
+    seconds = min(timings)
+
+    assert len(trip_options) == solutions
+    record_benchmark(
+        'parse_response',
+        seconds,
+        solutions=solutions,
+        response_bytes=len(raw_response),
+        options_per_second=round(solutions / seconds)
+    )
+
+def test_build_request_cost(record_benchmark):
+    """`build_request()` per query: first of a shape vs the rest of a sweep"""
+    import weekendfare.WeekendFare as wf
+    qpx_queries = [helper_query('DEN', helper_date(index)) for index in range(VALIDATIONS)]
+    with wf_request.VALIDATED_LOCK:
+        wf_request.VALIDATED_SHAPES.clear()
+    wf_request.get_validator()  #compile outside the timings
+
+    start = time.perf_counter()
+    wf.build_request(qpx_queries[0])
+    cold_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for qpx_query in qpx_queries[1:]:
+        wf.build_request(qpx_query)
+    warm_seconds = (time.perf_counter() - start) / (VALIDATIONS - 1)
+
+    record_benchmark('build_request', warm_seconds, cold_seconds=cold_seconds)
+    assert warm_seconds < cold_seconds
+
+def test_sweep_throughput(local_weekendfare, record_benchmark):
+    """end-to-end `fetch_batch()` + parse against the stub QPX server"""
+    wf, _ = local_weekendfare
+    server = wf_stub.start_server(latency=SWEEP_LATENCY)
+    wf.get_config().set('QPX', 'base_url', server.base_url)
+    qpx_queries = [
+        helper_query(destination, helper_date(index * 7))
+        for destination in SWEEP_DESTINATIONS
+        for index in range(SWEEP_DATES)
+    ]
+
+    start = time.perf_counter()
+    fares = 0
+    for _, qpx_response in wf.fetch_batch(qpx_queries, max_workers=SWEEP_WORKERS):
+        fares += len(wf.parse_response(qpx_response or {}))
+    seconds = time.perf_counter() - start
+    server.shutdown()
+    server.server_close()
+
+    assert server.get_stats()['ok'] == len(qpx_queries)
+    assert fares == len(qpx_queries) * 20
+    record_benchmark(
+        'sweep_fetch_batch',
+        seconds,
+        queries=len(qpx_queries),
+        workers=SWEEP_WORKERS,
+        stub_latency=SWEEP_LATENCY,
+        queries_per_second=round(len(qpx_queries) / seconds, 1)
+    )
+
+def helper_stub_process(latency):
+    """stub QPX server in its own process: its CPU stays out of the caller's timings
+
+    Returns:
+        (:obj:`subprocess.Popen`, str): server process, `[QPX] base_url` to use
+
+    """
+    stub = subprocess.Popen(
+        [sys.executable, '-u', '-m', 'weekendfare.stub_server', '-p', '0', '--latency', str(latency)],
+        cwd=ROOT,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL
+    )
+    base_url = stub.stdout.readline().decode().split()[-1]   #`stub QPX at http://...`
+    return stub, base_url
+
+def test_sweep_miss_parent_cpu(local_weekendfare, record_benchmark):
+    """cache-miss sweep: parent CPU per response, in-process parsing vs `fetch_parsed()`
+
+    Note:
+        the stub runs in another process, so `time.process_time()` is the
+        sweep's own cost.  With a parse pool the parent only sends, receives
+        and writes out what the worker hands back for each miss
+
+    """
+    import weekendfare.parse_pool as wf_parse_pool
+    wf, _ = local_weekendfare
+    stub, base_url = helper_stub_process(SWEEP_LATENCY)
+    wf.get_config().set('QPX', 'base_url', base_url)
+
+    parent_cpu = {}
+    try:
+        for mode_index, mode in enumerate(('fetch_batch', 'fetch_parsed')):
+            qpx_queries = [
+                helper_query(
+                    SWEEP_DESTINATIONS[index % len(SWEEP_DESTINATIONS)],
+                    helper_date(mode_index * SWEEP_MISSES + index)
+                )
+                for index in range(SWEEP_MISSES)
+            ]
+            with wf_parse_pool.ParsePool(1) as parse_pool:
+                start, start_cpu = time.perf_counter(), time.process_time()
+                fares = 0
+                if mode == 'fetch_batch':
+                    for _, qpx_response in wf.fetch_batch(qpx_queries, max_workers=SWEEP_WORKERS):
+                        fares += len(wf.parse_response(qpx_response or {}))
+                else:
+                    for _, table in wf.fetch_parsed(qpx_queries, SWEEP_WORKERS, parse_pool):
+                        fares += len(table or ())
+                seconds = time.perf_counter() - start
+                parent_cpu[mode] = (time.process_time() - start_cpu) / SWEEP_MISSES
+
+            assert fares == SWEEP_MISSES * 20
+            record_benchmark(
+                'sweep_misses',
+                seconds,
+                mode=mode,
+                queries=SWEEP_MISSES,
+                workers=SWEEP_WORKERS,
+                stub_latency=SWEEP_LATENCY,
+                parent_cpu_ms_per_response=round(parent_cpu[mode] * 1000, 2)
+            )
+    finally:
+        stub.terminate()
+        stub.wait()
+
+    assert len(wf.get_history()) == 2 * SWEEP_MISSES * 20   #both modes record every miss
+    assert parent_cpu['fetch_parsed'] < parent_cpu['fetch_batch']
+
+def test_parse_pool_scaling(record_benchmark):
+    """1000 cached responses through `ParsePool`: throughput per worker count
+
+    Note:
+        scaling is only asserted where there are cores to scale onto
+
+    """
+    refs_path = path.join(HERE, 'cache', 'benchmark_parse_pool.refs')
+    if path.isfile(refs_path):
+        remove(refs_path)
+    references = wf_codec.ReferenceTable(refs_path)
+    payloads = [
+        wf_codec.encode(
+            wf_stub.synthesize_response(helper_query('DEN', helper_date(index)), DEMO_RESPONSE),
+            references
+        )
+        for index in range(50)
+    ] * (PARSE_RESPONSES // 50)
+    references.close()
+    remove(refs_path)
+
+    throughput = {}
+    for processes in [0] + [count for count in PARSE_PROCESSES if count <= (cpu_count() or 1)]:
+        with wf_parse_pool.ParsePool(processes) as parse_pool:
+            start = time.perf_counter()
+            futures = [parse_pool.submit(payload) for payload in payloads]
+            rows = sum(len(parse_pool.table(future)) for future in futures)
+            seconds = time.perf_counter() - start
+        assert rows == PARSE_RESPONSES * 20
+        throughput[processes] = PARSE_RESPONSES / seconds
+        record_benchmark(
+            'parse_pool',
+            seconds,
+            responses=PARSE_RESPONSES,
+            processes=processes,
+            cores=cpu_count(),
+            responses_per_second=round(throughput[processes], 1)
+        )
+
+    if 2 in throughput:
+        assert throughput[2] > throughput[1] * 1.5
@@ -0,0 +1,241 @@
+"""test_fare_cache.py
+
+Pytest functions for exercising weekendfare.fare_cache
+
+"""
+from os import path, remove, makedirs
+import json
+
+import pytest
+
+import weekendfare.fare_cache as wf_cache
+import weekendfare.cache_codec as wf_codec
+
+HERE = path.abspath(path.dirname(__file__))
+
+DEMO_REQUEST_PATH = path.join(HERE, 'demo_request.json')
+DEMO_RESPONSE_PATH = path.join(HERE, 'demo_response.json')
+with open(DEMO_REQUEST_PATH, 'r') as req_fh:
+    DEMO_REQUEST = json.load(req_fh)
+with open(DEMO_RESPONSE_PATH, 'r') as resp_fh:
+    DEMO_RESPONSE = json.load(resp_fh)
+
+CACHE_PATH = path.join(HERE, 'cache', 'test_cachefile.dat')
+makedirs(path.dirname(CACHE_PATH), exist_ok=True)
+def helper_clean_cache():
+    """remove cache file (and query registry) between tests"""
+    for cache_path in (
+            CACHE_PATH,
+            CACHE_PATH + wf_cache.QUERY_STORE_SUFFIX,
+            CACHE_PATH + wf_cache.REFERENCE_STORE_SUFFIX
+    ):
+        if path.isfile(cache_path):
+            remove(cache_path)
+
+def test_cache_key_filters():
+    """cache keys split on filters, ignore zero-count passengers"""
+    slices, filters = wf_cache.split_query(DEMO_REQUEST)
+    base_key = wf_cache.cache_key(slices[0], filters)
+
+    padded_filters = dict(filters)
+    padded_filters['passengers'] = {'adultCount': 1, 'childCount': 0}
+    assert wf_cache.cache_key(slices[0], padded_filters) == base_key
+
+    refund_filters = dict(filters)
+    refund_filters['refundable'] = True
+    assert wf_cache.cache_key(slices[0], refund_filters) != base_key
+
+    lower_slice = dict(slices[0])
+    lower_slice['origin'] = 'sea'
+    assert wf_cache.cache_key(lower_slice, filters) == base_key
+
+def test_cache_hit_miss():
+    """put/get round trip and ttl expiry"""
+    helper_clean_cache()
+    cache = wf_cache.FareCache(CACHE_PATH, ttl=60)
+    slices, filters = wf_cache.split_query(DEMO_REQUEST)
+    key = wf_cache.cache_key(slices[0], filters)
+
+    assert cache.get(key) is None
+    cache.put(key, DEMO_RESPONSE, now=1000)
+    assert cache.get(key, now=1030) == DEMO_RESPONSE
+    assert cache.get(key, now=1061) is None
+    assert len(cache) == 0
+
+    cache.close()
+    helper_clean_cache()
+
+def test_cache_lru_eviction():
+    """oldest untouched entries are dropped past max_entries"""
+    helper_clean_cache()
+    cache = wf_cache.FareCache(CACHE_PATH, ttl=0, max_entries=2)
+
+    cache.put('a', {'val': 1}, now=1)
+    cache.put('b', {'val': 2}, now=2)
+    cache.get('a', now=3)             #refresh `a`
+    cache.put('c', {'val': 3}, now=4)
+
+    assert len(cache) == 2
+    assert cache.get('b') is None
+    assert cache.get('a') == {'val': 1}
+
+    cache.close()
+    helper_clean_cache()
+
+def test_cache_persistence():
+    """entries survive reopening the backing file"""
+    helper_clean_cache()
+    cache = wf_cache.FareCache(CACHE_PATH, ttl=0)
+    cache.put('a', DEMO_RESPONSE)
+    cache.close()
+
+    reopened = wf_cache.FareCache(CACHE_PATH, ttl=0)
+    assert reopened.get('a') == DEMO_RESPONSE
+
+    reopened.close()
+    helper_clean_cache()
+
+def test_cache_open_stream():
+    """cached records can be streamed straight into the parser"""
+    import weekendfare.qpx_parser as wf_parser
+    helper_clean_cache()
+    cache = wf_cache.FareCache(CACHE_PATH, ttl=0)
+    cache.put('a', DEMO_RESPONSE)
+
+    assert cache.open('missing') is None
+    with cache.open('a') as record_reader:
+        trip_options = list(wf_parser.iter_trip_options(record_reader, chunk_size=1024))
+    assert len(trip_options) == 20
+
+    cache.close()
+    helper_clean_cache()
+
+def test_adaptive_ttl():
+    """fares go stale sooner the closer the departure"""
+    now = 1484006400    #2017-01-10 00:00 UTC
+    two_days = wf_cache.adaptive_ttl('2017-01-12', now=now)
+    six_weeks = wf_cache.adaptive_ttl('2017-02-21', now=now)
+
+    assert wf_cache.DEFAULT_MIN_TTL < two_days < 60 * 60
+    assert six_weeks == wf_cache.DEFAULT_TTL
+    assert wf_cache.adaptive_ttl('2017-01-01', now=now) == wf_cache.DEFAULT_MIN_TTL
+    assert wf_cache.adaptive_ttl(None) == wf_cache.DEFAULT_TTL
+
+def test_cache_lookup_ttl():
+    """per-lookup ttl is stricter than, never looser than, the cache ttl"""
+    helper_clean_cache()
+    cache = wf_cache.FareCache(CACHE_PATH, ttl=600)
+    cache.put('a', {'val': 1}, now=1000)
+
+    assert cache.get('a', now=1200, ttl=900) == {'val': 1}
+    assert cache.get('a', now=1700, ttl=900) is None
+    cache.put('b', {'val': 2}, now=1000)
+    assert cache.get('b', now=1100, ttl=60) is None
+
+    cache.close()
+    helper_clean_cache()
+
+def test_cache_query_registry():
+    """queries outlive expired responses, not LRU eviction"""
+    helper_clean_cache()
+    cache = wf_cache.FareCache(CACHE_PATH, ttl=60, max_entries=2)
+    cache.put('a', {'val': 1}, now=1000, query=DEMO_REQUEST)
+    cache.put('b', {'val': 2}, now=1001, query={'request': {'slice': []}})
+
+    assert cache.get('a', now=2000) is None     #expired
+    assert cache.stored_at('a') is None
+    assert dict(cache.queries())['a'] == DEMO_REQUEST
+    cache.close()
+
+    reopened = wf_cache.FareCache(CACHE_PATH, ttl=0, max_entries=1)
+    reopened.put('c', {'val': 3}, now=1002, query=DEMO_REQUEST)     #evicts `b`
+    assert sorted(key for key, _ in reopened.queries()) == ['a', 'c']
+    reopened.forget_query('a')
+    assert [key for key, _ in reopened.queries()] == ['c']
+
+    reopened.close()
+    helper_clean_cache()
+
+def test_cache_compression(record_benchmark):
+    """reference data is stored once, payloads compressed, records unchanged"""
+    import weekendfare.stub_server as wf_stub
+    helper_clean_cache()
+    plain_path = CACHE_PATH + '.plain'
+    cache = wf_cache.FareCache(CACHE_PATH, ttl=0)
+    plain_cache = wf_cache.FareCache(plain_path, ttl=0, compression=0)
+    responses = {}
+    for destination in ('DEN', 'LAX', 'SFO', 'PDX', 'BOS'):
+        for day in range(10, 20):
+            qpx_query = {'request': {'slice': [
+                {'origin': 'SEA', 'destination': destination, 'date': '2017-01-{0}'.format(day)}
+            ]}}
+            key = wf_cache.cache_key(qpx_query['request']['slice'][0])
+            responses[key] = wf_stub.synthesize_response(qpx_query, DEMO_RESPONSE)
+            cache.put(key, responses[key])
+            plain_cache.put(key, responses[key])
+
+    for key, response in responses.items():
+        assert cache.get(key) == response
+    assert len(cache.references) < 50   #shared by all 50 responses
+    ratio = plain_cache.store.size / (cache.store.size + cache.references.store.size)
+    assert ratio > 8
+
+    cache.close()
+    reopened = wf_cache.FareCache(CACHE_PATH, ttl=0)
+    key = next(iter(responses))
+    assert reopened.get(key) == responses[key]
+    with reopened.open(key) as record_reader:     #streamed: references left as stand-ins
+        assert json.loads(record_reader.read().decode('utf-8')) == \
+            wf_codec.decode(reopened.get_payload(key))
+
+    record_benchmark(
+        'cache_compression',
+        0.0,
+        plain_bytes=plain_cache.store.size,
+        compressed_bytes=reopened.store.size + reopened.references.store.size,
+        ratio=round(ratio, 1)
+    )
+    reopened.close()
+    plain_cache.close()
+    helper_clean_cache()
+    for plain_file in (plain_path, plain_path + wf_cache.REFERENCE_STORE_SUFFIX):
+        remove(plain_file)
+
+def test_cache_reads_plain_entries():
+    """entries written before compression (plain JSON) still read and stream"""
+    helper_clean_cache()
+    cache = wf_cache.FareCache(CACHE_PATH, ttl=0, compression=0)
+    cache.put('a', DEMO_RESPONSE)
+    cache.close()
+
+    reopened = wf_cache.FareCache(CACHE_PATH, ttl=0)
+    assert reopened.get('a') == DEMO_RESPONSE
+    with reopened.open('a') as record_reader:
+        assert json.loads(record_reader.read().decode('utf-8')) == DEMO_RESPONSE
+
+    reopened.close()
+    helper_clean_cache()
+
+def test_cache_shared_between_instances():
+    """two caches on one file (two processes) keep and see each other's entries"""
+    helper_clean_cache()
+    first = wf_cache.FareCache(CACHE_PATH, ttl=0)
+    second = wf_cache.FareCache(CACHE_PATH, ttl=0)
+    first.put('k1', DEMO_RESPONSE)
+    second.put('k2', {'kind': 'second'})
+
+    assert first.get('k2') == {'kind': 'second'}
+    assert second.get('k1') == DEMO_RESPONSE    #references interned by `first`
+    assert len(first) == len(second) == 2
+
+    reopened = wf_cache.FareCache(CACHE_PATH, ttl=0)
+    assert reopened.get('k1') == DEMO_RESPONSE
+    assert reopened.get('k2') == {'kind': 'second'}
+
+    second.compact()
+    first.put('k3', {'kind': 'third'})
+    assert second.get('k3') == {'kind': 'third'}
+    assert first.get('k1') == DEMO_RESPONSE
+    for cache in (first, second, reopened):
+        cache.close()
+    helper_clean_cache()
@@ -0,0 +1,95 @@
+"""test_fare_history.py
+
+Pytest functions for exercising weekendfare.fare_history
+
+"""
+from os import path, remove, makedirs
+import json
+
+import pytest
+
+import weekendfare.fare_history as wf_history
+import weekendfare.qpx_parser as wf_parser
+
+HERE = path.abspath(path.dirname(__file__))
+
+DEMO_RESPONSE_PATH = path.join(HERE, 'demo_response.json')
+with open(DEMO_RESPONSE_PATH, 'r') as resp_fh:
+    DEMO_RESPONSE = json.load(resp_fh)
+DEMO_OPTIONS = list(wf_parser.iter_trip_options(DEMO_RESPONSE))
+
+DB_PATH = path.join(HERE, 'cache', 'test_fare_history.db')
+makedirs(path.dirname(DB_PATH), exist_ok=True)
+def helper_clean_db():
+    """remove history database between tests"""
+    if path.isfile(DB_PATH):
+        remove(DB_PATH)
+
+def test_history_rows():
+    """rows carry route, local departure and flight numbers"""
+    rows = wf_history.history_rows(DEMO_OPTIONS, 1000, query_fingerprint='abc')
+
+    assert len(rows) == len(DEMO_OPTIONS)
+    assert rows[0]['origin'] == 'SEA'
+    assert rows[0]['destination'] == 'DEN'
+    assert rows[0]['departure_date'] == '2017-01-13'
+    assert rows[0]['departure_weekday'] == 4    #Friday
+    assert rows[0]['price_cents'] == DEMO_OPTIONS[0].price_cents
+    assert rows[0]['flights'] == ','.join(DEMO_OPTIONS[0].slices[0].flights)
+
+def test_history_indexes():
+    """bulk insert creates the route and flight indexes"""
+    helper_clean_db()
+    history = wf_history.FareHistory(DB_PATH)
+    assert len(history) == 0
+    assert history.cheapest('SEA', 'DEN') == []
+
+    assert history.record(DEMO_OPTIONS, observed_at=1000) == len(DEMO_OPTIONS)
+    assert len(history) == len(DEMO_OPTIONS)
+    index_names = [
+        row['name'] for row in history.db.query(
+            "SELECT name FROM sqlite_master WHERE type = 'index'"
+        )
+    ]
+    for name, _ in wf_history.INDEXES:
+        assert name in index_names
+
+    plan = ' '.join(
+        str(row['detail']) for row in history.db.query(
+            'EXPLAIN QUERY PLAN SELECT * FROM fares '
+            "WHERE origin = 'SEA' AND destination = 'DEN' AND observed_at >= 0"
+        )
+    )
+    assert 'ix_fares_route' in plan
+
+    history.close()
+    helper_clean_db()
+
+def test_history_queries():
+    """cheapest-on-route and price trend over several observations"""
+    helper_clean_db()
+    history = wf_history.FareHistory(DB_PATH)
+    history.record(DEMO_OPTIONS, observed_at=1000)
+    cheaper_rows = wf_history.history_rows(DEMO_OPTIONS[:1], 2000)
+    cheaper_rows[0]['price_cents'] -= 5000
+    history.insert(cheaper_rows)
+
+    cheapest = history.cheapest('sea', 'den', weekdays=(4, 5, 6))
+    assert len(cheapest) == 1
+    assert cheapest[0]['price_cents'] == DEMO_OPTIONS[0].price_cents - 5000
+    assert cheapest[0]['observed_at'] == 2000
+    assert history.cheapest('SEA', 'DEN', since=1500, limit=5)[0]['observed_at'] == 2000
+    assert history.cheapest('SEA', 'DEN', weekdays=(0,)) == []
+    assert history.cheapest('SEA', 'DEN', departs_from='2017-01-14') == []
+    assert history.cheapest('SEA', 'DEN', slices=2) == []
+    assert history.cheapest('SEA', 'DEN', shape='abc') == []    #no shapes recorded yet
+
+    trend = history.price_trend(cheaper_rows[0]['flights'], departure_date='2017-01-13')
+    assert [row['observed_at'] for row in trend][-1] == 2000
+    assert trend[-1]['sale_total'] == cheapest[0]['sale_total']
+
+    history.record(DEMO_OPTIONS, observed_at=3000, query_shape='abc')
+    assert history.cheapest('SEA', 'DEN', slices=1, shape='abc')[0]['observed_at'] == 3000
+
+    history.close()
+    helper_clean_db()
@@ -0,0 +1,93 @@
+"""test_fare_table.py
+
+Pytest functions for exercising weekendfare.fare_table
+
+"""
+from os import path
+import json
+import time
+
+import pytest
+
+import weekendfare.qpx_parser as wf_parser
+from weekendfare.fare_table import FareTable
+from weekendfare.models import local_minutes
+
+HERE = path.abspath(path.dirname(__file__))
+
+DEMO_RESPONSE_PATH = path.join(HERE, 'demo_response.json')
+with open(DEMO_RESPONSE_PATH, 'r') as resp_fh:
+    DEMO_RESPONSE = json.load(resp_fh)
+DEMO_TRIP_OPTIONS = list(wf_parser.iter_trip_options(DEMO_RESPONSE))
+
+def test_table_columns():
+    """rows line up with source trip options"""
+    table = FareTable.from_trip_options(DEMO_TRIP_OPTIONS)
+
+    assert len(table) == 20
+    assert list(table.price_cents) == [option.price_cents for option in DEMO_TRIP_OPTIONS]
+    assert table.row(0)['sale_total'] == 'USD206.80'
+    assert table.row(0)['origin'] == 'SEA'
+    assert table.row(0)['date'] == '2017-01-13'
+    assert table.trip_option(3) is DEMO_TRIP_OPTIONS[3]
+
+def test_where_matches_object_filter():
+    """batch filters agree with filtering trip options one at a time"""
+    table = FareTable.from_trip_options(DEMO_TRIP_OPTIONS)
+    criteria = dict(max_price=400, depart_after='07:00', depart_before='20:00', max_layover=90)
+
+    expected = [
+        index for index, option in enumerate(DEMO_TRIP_OPTIONS)
+        if option.price_cents <= 40000
+        and 7 * 60 <= local_minutes(
+            option.slices[0].departure, option.slices[0].first_leg.departure_offset
+        ) <= 20 * 60
+        and option.slices[0].max_connection <= 90
+    ]
+    assert table.where(**criteria) == expected
+    assert table.where(nonstop=True) == [
+        index for index, option in enumerate(DEMO_TRIP_OPTIONS) if option.stops == 0
+    ]
+    assert table.where(refundable=True) == [14, 15, 18, 19]
+    assert table.where(destination='LAX') == []
+    assert len(table.filter(**criteria)) == len(expected)
+
+def test_top():
+    """top-N ranks cheapest then shortest"""
+    table = FareTable.from_trip_options(reversed(DEMO_TRIP_OPTIONS))
+    top_rows = table.top(3)
+
+    assert [table.price_cents[index] for index in top_rows] == [20680, 20680, 20680]
+    assert table.top(2, table.where(nonstop=True))[0] == table.top(1, table.where(nonstop=True))[0]
+
+def test_sweep_scale():
+    """filter + rank over a 100k-option sweep stays fast"""
+    table = FareTable(keep_options=False)
+    for _ in range(5000):
+        table.extend(DEMO_TRIP_OPTIONS)
+
+    start = time.perf_counter()
+    top_rows = table.top(10, table.where(max_price=300, depart_after='06:00', max_layover=120))
+    elapsed = time.perf_counter() - start
+
+    assert len(table) == 100000
+    assert len(top_rows) == 10
+    assert elapsed < 1.0
+
+def test_pack_and_merge():
+    """packed tables round-trip; merged tables re-intern codes"""
+    table = FareTable.from_trip_options(DEMO_TRIP_OPTIONS, keep_options=False)
+    unpacked = FareTable.unpack(table.pack())
+    assert [unpacked.row(index) for index in range(len(unpacked))] == \
+        [table.row(index) for index in range(len(table))]
+
+    merged = FareTable(keep_options=False)
+    merged.code_id('ZZZ')   #shift every code id
+    merged.merge(unpacked)
+    merged.merge(table)
+    assert len(merged) == 40
+    assert merged.row(25) == table.row(5)
+    assert merged.where(origin='SEA') == list(range(40))
+
+    with pytest.raises(ValueError):
+        FareTable().merge(unpacked)
@@ -0,0 +1,122 @@
+"""test_log_store.py
+
+Pytest functions for exercising weekendfare.log_store
+
+"""
+from os import path, remove, makedirs
+
+import pytest
+
+from weekendfare.log_store import LogStore
+
+HERE = path.abspath(path.dirname(__file__))
+
+STORE_PATH = path.join(HERE, 'cache', 'test_logstore.dat')
+makedirs(path.dirname(STORE_PATH), exist_ok=True)
+def helper_clean_store():
+    """remove store file between tests"""
+    if path.isfile(STORE_PATH):
+        remove(STORE_PATH)
+
+def test_append_and_reopen():
+    """index is rebuilt from the log on open"""
+    helper_clean_store()
+    store = LogStore(STORE_PATH)
+    store.put('SEA|DEN', b'{"a": 1}', 100)
+    store.put('SEA|LAX', b'{"b": 2}', 101)
+    store.put('SEA|DEN', b'{"a": 3}', 102)    #overwrite
+    store.delete('SEA|LAX', 103)
+    assert store.read('SEA|DEN') == b'{"a": 3}'
+    assert store.read('SEA|LAX') is None
+    assert store.dead_bytes > 0
+    store.close()
+
+    reopened = LogStore(STORE_PATH)
+    assert len(reopened) == 1
+    assert reopened.read('SEA|DEN') == b'{"a": 3}'
+    assert reopened.index['SEA|DEN'][0] == 102
+    assert reopened.dead_bytes == store.dead_bytes
+
+    reopened.close()
+    helper_clean_store()
+
+def test_appends_do_not_rewrite():
+    """writes only grow the file by the size of the new record"""
+    helper_clean_store()
+    store = LogStore(STORE_PATH)
+    store.put('a', b'x' * 1000, 1)
+    size_before = path.getsize(STORE_PATH)
+    store.put('b', b'y' * 10, 2)
+
+    assert path.getsize(STORE_PATH) - size_before < 50
+    assert store.read('a') == b'x' * 1000
+
+    store.close()
+    helper_clean_store()
+
+def test_torn_record_truncated():
+    """crash mid-write leaves a readable log"""
+    helper_clean_store()
+    store = LogStore(STORE_PATH)
+    store.put('good', b'payload', 1)
+    good_size = store.size
+    store.close()
+
+    with open(STORE_PATH, 'ab') as filehandle:
+        filehandle.write(b'PUT 2.0 500 torn\n{"partial":')
+
+    reopened = LogStore(STORE_PATH)
+    assert reopened.read('good') == b'payload'
+    assert 'torn' not in reopened
+    assert path.getsize(STORE_PATH) == good_size
+
+    reopened.close()
+    helper_clean_store()
+
+def test_compaction():
+    """dead records are dropped once the dead ratio is crossed"""
+    helper_clean_store()
+    store = LogStore(STORE_PATH, compact_min_bytes=1024, compact_dead_ratio=0.5)
+    for stamp in range(50):
+        store.put('same_key', b'z' * 100, stamp)
+    store.put('other_key', b'keep', 50)
+
+    assert store.size < 50 * 100
+    assert store.read('same_key') == b'z' * 100
+    assert store.read('other_key') == b'keep'
+
+    store.compact()
+    assert store.dead_bytes == 0
+    assert len(store) == 2
+
+    store.close()
+    helper_clean_store()
+
+def test_two_writers_one_file():
+    """stores sharing a file append after each other, and see each other's records"""
+    helper_clean_store()
+    first = LogStore(STORE_PATH)
+    second = LogStore(STORE_PATH)
+    first.put('k1', b'one', 1)
+    second.put('k2', b'two', 2)     #must not land on top of k1
+    first.put('k3', b'three', 3)
+
+    assert first.read('k2') == b'two'  #writes catch up on the log first
+    second.delete('k1', 4)
+    assert 'k1' in first            #reads use the index as of the last refresh
+    first.refresh()
+    assert 'k1' not in first
+    assert second.read('k3') == b'three'
+
+    reopened = LogStore(STORE_PATH)
+    assert sorted(reopened.index) == ['k2', 'k3']
+    assert reopened.read('k2') == b'two'
+    assert reopened.size == first.size == second.size == path.getsize(STORE_PATH)
+
+    second.compact()                #replaces the file under `first`
+    first.refresh()
+    assert sorted(first.index) == ['k2', 'k3']
+    assert first.read('k3') == b'three'
+    for store in (first, second, reopened):
+        store.close()
+    helper_clean_store()
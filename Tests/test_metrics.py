@@ -0,0 +1,95 @@
+"""test_metrics.py
+
+Pytest functions for exercising weekendfare.metrics
+
+"""
+from os import path, remove, makedirs
+import json
+import time
+
+import pytest
+
+import weekendfare.metrics as wf_metrics
+
+HERE = path.abspath(path.dirname(__file__))
+SCRATCH_DIR = path.join(HERE, 'cache')
+makedirs(SCRATCH_DIR, exist_ok=True)
+
+SPAN_CALLS = 100000
+SPAN_BUDGET = 20e-6     #seconds per span, generous for slow CI
+
+def test_counters_and_spans():
+    """counters add up per label set, spans keep count/sum/max"""
+    metrics = wf_metrics.Metrics()
+    metrics.incr('cache_lookups', result='hit')
+    metrics.incr('cache_lookups', result='hit')
+    metrics.incr('cache_lookups', result='miss')
+    metrics.incr('http_bytes_received', 512, method='POST')
+    metrics.observe('parse_response', 0.25)
+    metrics.observe('parse_response', 0.75)
+    with pytest.raises(KeyError):
+        with metrics.span('parse_response'):
+            raise KeyError('boom')
+
+    snapshot = metrics.to_dict()
+    counters = {
+        (counter['name'], tuple(counter['labels'].items())): counter['value']
+        for counter in snapshot['counters']
+    }
+    assert counters[('cache_lookups', (('result', 'hit'),))] == 2
+    assert counters[('cache_lookups', (('result', 'miss'),))] == 1
+    assert counters[('http_bytes_received', (('method', 'POST'),))] == 512
+
+    spans = {tuple(span['labels'].items()): span for span in snapshot['spans']}
+    assert spans[()]['count'] == 2
+    assert spans[()]['seconds'] == 1.0
+    assert spans[()]['max_seconds'] == 0.75
+    assert spans[(('error', 'true'),)]['count'] == 1
+
+def test_disabled_is_noop():
+    """disabled metrics record nothing"""
+    metrics = wf_metrics.Metrics(enabled=False)
+    metrics.incr('cache_lookups')
+    with metrics.span('parse_response'):
+        pass
+    assert metrics.to_dict()['counters'] == []
+    assert metrics.to_dict()['spans'] == []
+
+def test_export_formats():
+    """`.prom` is Prometheus text, anything else JSON"""
+    metrics = wf_metrics.Metrics()
+    metrics.incr('http_requests', method='POST', status=200)
+    metrics.incr('http_requests', method='POST', status='error')
+    metrics.set_gauge('qpx_quota_remaining', 42)
+    metrics.observe('http_request', 0.5, method='POST')
+
+    prom_path = path.join(SCRATCH_DIR, 'test_metrics.prom')
+    json_path = path.join(SCRATCH_DIR, 'test_metrics.json')
+    metrics.export(prom_path)
+    metrics.export(json_path)
+    with open(prom_path, 'r') as prom_fh:
+        prom_lines = prom_fh.read().splitlines()
+    with open(json_path, 'r') as json_fh:
+        snapshot = json.load(json_fh)
+    remove(prom_path)
+    remove(json_path)
+
+    assert '# TYPE weekendfare_http_requests_total counter' in prom_lines
+    assert 'weekendfare_http_requests_total{method="POST",status="200"} 1' in prom_lines
+    assert 'weekendfare_qpx_quota_remaining 42' in prom_lines
+    assert 'weekendfare_http_request_seconds_sum{method="POST"} 0.5' in prom_lines
+    assert prom_lines.count('# TYPE weekendfare_http_requests_total counter') == 1
+    assert len(snapshot['counters']) == 2
+    assert snapshot['gauges'][0]['value'] == 42
+
+def test_span_overhead(record_benchmark):
+    """a span costs microseconds: fine to leave on around every hot path"""
+    metrics = wf_metrics.Metrics()
+    start = time.perf_counter()
+    for _ in range(SPAN_CALLS):
+        with metrics.span('cache_lookup'):
+            pass
+    seconds = (time.perf_counter() - start) / SPAN_CALLS
+
+    record_benchmark('metrics_span', seconds)
+    assert seconds < SPAN_BUDGET
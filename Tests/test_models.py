@@ -0,0 +1,84 @@
+"""test_models.py
+
+Pytest functions for exercising weekendfare.models
+
+"""
+from os import path
+import tracemalloc
+import json
+
+import pytest
+
+import weekendfare.models as wf_models
+
+HERE = path.abspath(path.dirname(__file__))
+
+DEMO_RESPONSE_PATH = path.join(HERE, 'demo_response.json')
+with open(DEMO_RESPONSE_PATH, 'r') as resp_fh:
+    DEMO_RESPONSE = json.load(resp_fh)
+DEMO_OPTIONS = DEMO_RESPONSE['trips']['tripOption']
+
+def test_price_to_cents():
+    """QPX price strings become integer cents without float rounding"""
+    assert wf_models.price_to_cents('USD206.80') == (20680, 'USD')
+    assert wf_models.price_to_cents('USD0.1') == (10, 'USD')
+    assert wf_models.price_to_cents('EUR99') == (9900, 'EUR')
+    assert wf_models.cents_to_price(20680, 'USD') == 'USD206.80'
+    with pytest.raises(ValueError):
+        wf_models.price_to_cents('206.80')
+
+def test_parse_qpx_time():
+    """local QPX timestamps become UTC epoch + offset"""
+    epoch, offset = wf_models.parse_qpx_time('2017-01-13T07:30-08:00')
+
+    assert epoch == 1484321400
+    assert offset == -480
+    assert wf_models.local_minutes(epoch, offset) == 7 * 60 + 30
+    assert wf_models.format_qpx_time(epoch, offset) == '2017-01-13T07:30-08:00'
+
+def test_trip_option_from_qpx():
+    """slotted model keeps what WeekendFare needs"""
+    trip_option = wf_models.TripOption.from_qpx(DEMO_OPTIONS[0])
+    first_slice = trip_option.slices[0]
+
+    assert trip_option.price_cents == 20680
+    assert trip_option.currency == 'USD'
+    assert trip_option.refundable is False
+    assert first_slice.origin == 'SEA'
+    assert first_slice.destination == 'DEN'
+    assert first_slice.stops == 1
+    assert first_slice.arrival - first_slice.departure == first_slice.duration * 60
+    assert wf_models.TripOption.from_qpx(DEMO_OPTIONS[14]).refundable is True
+    with pytest.raises(AttributeError):
+        trip_option.extra = 'no __dict__'
+
+def test_codes_interned():
+    """repeated airport/carrier codes share one string object"""
+    trip_options = [wf_models.TripOption.from_qpx(option) for option in DEMO_OPTIONS]
+
+    assert trip_options[0].slices[0].origin is trip_options[5].slices[0].origin
+    assert trip_options[0].slices[0].segments[0].carrier is trip_options[1].slices[0].segments[0].carrier
+
+def test_sorting():
+    """options sort cheapest-then-shortest"""
+    trip_options = [wf_models.TripOption.from_qpx(option) for option in reversed(DEMO_OPTIONS)]
+
+    prices = [trip_option.price_cents for trip_option in sorted(trip_options)]
+    assert prices == sorted(prices)
+
+def test_model_memory():
+    """parsed models take a fraction of the memory of raw QPX dicts"""
+    raw_json = json.dumps(DEMO_OPTIONS * 50)
+
+    tracemalloc.start()
+    raw_options = json.loads(raw_json)
+    raw_size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    tracemalloc.start()
+    trip_options = [wf_models.TripOption.from_qpx(option) for option in raw_options]
+    model_size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    assert len(trip_options) == 1000
+    assert model_size < raw_size / 3
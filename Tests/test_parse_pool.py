@@ -0,0 +1,79 @@
+"""test_parse_pool.py
+
+Pytest functions for exercising weekendfare.parse_pool
+
+"""
+from os import path, remove, makedirs
+import pickle
+import json
+
+import weekendfare.parse_pool as wf_parse_pool
+import weekendfare.cache_codec as wf_codec
+import weekendfare.qpx_parser as wf_parser
+from weekendfare.fare_table import FareTable
+
+HERE = path.abspath(path.dirname(__file__))
+
+DEMO_RESPONSE_PATH = path.join(HERE, 'demo_response.json')
+with open(DEMO_RESPONSE_PATH, 'rb') as resp_fh:
+    DEMO_BYTES = resp_fh.read()
+DEMO_RESPONSE = json.loads(DEMO_BYTES.decode('utf-8'))
+REFS_PATH = path.join(HERE, 'cache', 'test_parse_pool.refs')
+makedirs(path.dirname(REFS_PATH), exist_ok=True)
+
+def helper_rows(table):
+    return [table.row(index) for index in range(len(table))]
+
+def test_parse_payload_matches_parse():
+    """plain and compressed (interned) payloads parse like the in-process table"""
+    expected = helper_rows(FareTable.from_trip_options(wf_parser.iter_trip_options(DEMO_BYTES)))
+    if path.isfile(REFS_PATH):
+        remove(REFS_PATH)
+    references = wf_codec.ReferenceTable(REFS_PATH)
+    compressed = wf_codec.encode(DEMO_RESPONSE, references)
+    references.close()
+    remove(REFS_PATH)
+
+    for payload in (DEMO_BYTES, compressed):
+        packed = wf_parse_pool.parse_payload(payload)
+        assert helper_rows(FareTable.unpack(packed)) == expected
+    assert len(FareTable.unpack(wf_parse_pool.parse_payload(DEMO_BYTES, price_filter=210))) == 5
+
+def test_packed_result_is_compact():
+    """what crosses the process boundary is far smaller than pickled options"""
+    packed = wf_parse_pool.parse_payload(DEMO_BYTES)
+    trip_options = list(wf_parser.iter_trip_options(DEMO_BYTES))
+    assert len(pickle.dumps(packed)) * 4 < len(pickle.dumps(trip_options))
+
+def test_pool_and_inline_agree():
+    """worker processes and `processes=0` give the same tables"""
+    expected = helper_rows(FareTable.unpack(wf_parse_pool.parse_payload(DEMO_BYTES)))
+    for processes in (0, 2):
+        with wf_parse_pool.ParsePool(processes) as parse_pool:
+            futures = [parse_pool.submit(DEMO_BYTES) for _ in range(4)]
+            futures.append(parse_pool.submit(b'{"trips": {"tripOption": [{"id"'))
+            tables = [parse_pool.table(future) for future in futures[:4]]
+            assert futures[4].exception() is not None
+        assert all(helper_rows(table) == expected for table in tables)
+
+def test_digest_fresh_response():
+    """one worker parse gives the table, a cache payload, history rows and alert fares"""
+    import weekendfare.fare_history as wf_history
+    import weekendfare.alerts as wf_alerts
+    trip_options = list(wf_parser.iter_trip_options(DEMO_RESPONSE))
+    with wf_parse_pool.ParsePool(1) as parse_pool:
+        digest = parse_pool.submit_fresh(
+            DEMO_BYTES, 1000, level=6, query_fingerprint='abc', query_shape='shape'
+        ).result()
+
+    assert helper_rows(FareTable.unpack(digest['table'])) == \
+        helper_rows(FareTable.from_trip_options(trip_options))
+    assert digest['history'] == wf_history.history_rows(trip_options, 1000, 'abc', 'shape')
+    assert digest['fares'] == wf_alerts.fare_entries(trip_options, 'shape')
+
+    assert digest['payload'] == wf_codec.compress(DEMO_BYTES, 6)    #as received, nothing interned
+    assert digest['references'] == {}
+    assert wf_codec.decode(digest['payload']) == DEMO_RESPONSE
+
+    no_extras = wf_parse_pool.digest_response(DEMO_BYTES, 1000, history=False, alerts=False)
+    assert no_extras['payload'] is None and no_extras['history'] == no_extras['fares'] == []
@@ -0,0 +1,99 @@
+"""test_qpx_parser.py
+
+Pytest functions for exercising weekendfare.qpx_parser
+
+"""
+from os import path, remove, makedirs
+import tracemalloc
+import json
+import io
+
+import pytest
+
+import weekendfare.qpx_parser as wf_parser
+
+HERE = path.abspath(path.dirname(__file__))
+
+DEMO_RESPONSE_PATH = path.join(HERE, 'demo_response.json')
+with open(DEMO_RESPONSE_PATH, 'r') as resp_fh:
+    DEMO_RESPONSE = json.load(resp_fh)
+
+SCRATCH_PATH = path.join(HERE, 'cache', 'test_big_response.json')
+makedirs(path.dirname(SCRATCH_PATH), exist_ok=True)
+def helper_big_response(option_count):
+    """demo response padded out to `option_count` trip options (price ascending)"""
+    options = DEMO_RESPONSE['trips']['tripOption']
+    big_response = json.loads(json.dumps(DEMO_RESPONSE))
+    big_response['trips']['tripOption'] = []
+    for index in range(option_count):
+        option = dict(options[index % len(options)])
+        option['saleTotal'] = 'USD{0}.00'.format(100 + index)
+        big_response['trips']['tripOption'].append(option)
+    return big_response
+
+class CountingReader(object):
+    """file-like wrapper counting bytes handed out"""
+    def __init__(self, raw):
+        self._stream = io.BytesIO(raw)
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        data = self._stream.read(size)
+        self.bytes_read += len(data)
+        return data
+
+def test_stream_matches_loaded():
+    """streaming any chunking gives the same records as the loaded dict"""
+    expected = list(wf_parser.iter_trip_options(DEMO_RESPONSE))
+    raw = json.dumps(DEMO_RESPONSE, indent=1)
+
+    assert len(expected) == 20
+    for chunk_size in (7, 1000, 1024 * 1024):
+        assert list(wf_parser.iter_trip_options(raw, chunk_size=chunk_size)) == expected
+    assert list(wf_parser.iter_trip_options(io.BytesIO(raw.encode()), chunk_size=13)) == expected
+
+    first = expected[0]
+    assert first.sale_total == 'USD206.80'
+    assert first.slices[0].origin == 'SEA'
+    assert first.slices[0].destination == 'DEN'
+    assert first.slices[0].stops == 1
+    assert first.slices[0].flights == ['UA294', 'UA223']
+    assert first.slices[0].max_connection == 62
+
+def test_price_filter_stops_early():
+    """parsing stops reading the stream once options pass the price filter"""
+    raw = json.dumps(helper_big_response(2000)).encode()
+    reader = CountingReader(raw)
+
+    trip_options = list(wf_parser.iter_trip_options(reader, price_filter=149, chunk_size=4096))
+
+    assert len(trip_options) == 50
+    assert reader.bytes_read < len(raw) / 10
+
+def test_truncated_response():
+    """cut-off responses raise instead of silently dropping options"""
+    raw = json.dumps(DEMO_RESPONSE)
+    with pytest.raises(ValueError):
+        list(wf_parser.iter_trip_options(raw[:len(raw) // 2], chunk_size=512))
+
+def helper_peak_memory(option_count):
+    """peak traced memory streaming a response of `option_count` options from disk"""
+    with open(SCRATCH_PATH, 'w') as filehandle:
+        json.dump(helper_big_response(option_count), filehandle)
+
+    tracemalloc.start()
+    with open(SCRATCH_PATH, 'rb') as filehandle:
+        for _ in wf_parser.iter_raw_trip_options(filehandle):
+            pass
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    remove(SCRATCH_PATH)
+    return peak
+
+def test_stream_memory_flat():
+    """peak memory does not grow with solution count"""
+    small_peak = helper_peak_memory(100)
+    large_peak = helper_peak_memory(2000)
+
+    assert large_peak < small_peak * 1.5
@@ -0,0 +1,137 @@
+"""test_qpx_request.py
+
+Pytest functions for exercising weekendfare.qpx_request
+
+"""
+from os import path
+import json
+import time
+
+import pytest
+
+import weekendfare.qpx_request as wf_request
+
+HERE = path.abspath(path.dirname(__file__))
+
+DEMO_REQUEST_PATH = path.join(HERE, 'demo_request.json')
+with open(DEMO_REQUEST_PATH, 'r') as req_fh:
+    DEMO_REQUEST = json.load(req_fh)
+
+MAIN_STYLE_REQUEST = {     #how `WeekendFare.main` used to build queries
+    'request': {
+        'solutions': '20',
+        'refundable': 'false',
+        'pasengers': {
+            'adultCount': 1,
+            'incantInSeatCount': 0,
+            'childCount': 0
+        },
+        'slice': [{'date': '2017-01-13', 'destination': 'den', 'origin': ' sea'}]
+    }
+}
+
+def test_canonicalize_defaults():
+    """template defaults and `kind` markers are filled in"""
+    canonical = wf_request.canonicalize({'slice': DEMO_REQUEST['request']['slice']})
+    request = canonical['request']
+
+    assert request['passengers'] == {
+        'kind': 'qpxexpress#passengerCounts',
+        'adultCount': 1,
+        'childCount': 0,
+        'infantInLapCount': 0,
+        'infantInSeatCount': 0,
+        'seniorCount': 0
+    }
+    assert request['refundable'] is False
+    assert request['slice'][0]['kind'] == 'qpxexpress#sliceInput'
+    assert 'solutions' not in request
+
+def test_canonicalize_aliases():
+    """misspelled keys, case and config strings normalize away"""
+    canonical = wf_request.canonicalize(MAIN_STYLE_REQUEST)
+
+    assert canonical == wf_request.canonicalize(DEMO_REQUEST)
+    assert canonical == wf_request.canonicalize(canonical)     #idempotent
+
+def test_fingerprint():
+    """identical queries share a fingerprint, different ones do not"""
+    base = wf_request.fingerprint(DEMO_REQUEST)
+
+    assert wf_request.fingerprint(MAIN_STYLE_REQUEST) == base
+    assert wf_request.fingerprint(
+        wf_request.canonicalize(DEMO_REQUEST), canonical=True
+    ) == base
+
+    child_request = json.loads(json.dumps(DEMO_REQUEST))
+    child_request['request']['passengers']['childCount'] = 1
+    assert wf_request.fingerprint(child_request) != base
+
+    carrier_request = json.loads(json.dumps(DEMO_REQUEST))
+    carrier_request['request']['slice'][0]['permittedCarrier'] = ['ua', 'AS']
+    reordered_request = json.loads(json.dumps(carrier_request))
+    reordered_request['request']['slice'][0]['permittedCarrier'] = ['AS', 'UA']
+    assert wf_request.fingerprint(carrier_request) == wf_request.fingerprint(reordered_request)
+    assert wf_request.fingerprint(carrier_request) != base
+
+def test_validate_all_errors():
+    """every schema error is reported at once"""
+    bad_request = {
+        'request': {
+            'slice': [{'origin': 'SEA', 'date': '17-01-13'}],
+            'passengers': {'adultCount': 'two'},
+            'solutions': 1000
+        }
+    }
+    with pytest.raises(wf_request.InvalidQuery) as error_info:
+        wf_request.validate(bad_request)
+
+    assert len(error_info.value.errors) == 4
+    assert isinstance(error_info.value, ValueError)
+
+def test_validate_fast_path(monkeypatch):
+    """same-shape queries skip the validator but still check dates"""
+    wf_request.VALIDATED_SHAPES.clear()
+    validator = wf_request.get_validator()
+    validator_calls = []
+    def counting_validator():
+        validator_calls.append(1)
+        return validator
+    monkeypatch.setattr(wf_request, 'get_validator', counting_validator)
+
+    for day in range(13, 16):
+        sweep_request = json.loads(json.dumps(DEMO_REQUEST))
+        sweep_request['request']['slice'][0]['date'] = '2017-01-{0}'.format(day)
+        wf_request.validate(sweep_request)
+    assert len(validator_calls) == 1
+
+    bad_date = json.loads(json.dumps(DEMO_REQUEST))
+    bad_date['request']['slice'][0]['date'] = 'tomorrow'
+    with pytest.raises(wf_request.InvalidQuery):
+        wf_request.validate(bad_date)
+    assert len(validator_calls) == 2
+
+def test_validate_benchmark(record_benchmark):
+    """compiled + fast-path validation of a sweep's worth of queries"""
+    import jsonschema
+    schema = wf_request.get_template()
+    sweep_requests = []
+    for index in range(1000):
+        sweep_request = json.loads(json.dumps(DEMO_REQUEST))
+        sweep_request['request']['slice'][0]['date'] = '2017-{0:02d}-{1:02d}'.format(
+            index % 12 + 1, index % 28 + 1
+        )
+        sweep_requests.append(wf_request.canonicalize(sweep_request))
+
+    start = time.perf_counter()
+    for sweep_request in sweep_requests[:100]:
+        jsonschema.validate(sweep_request, schema)
+    naive_seconds = (time.perf_counter() - start) * 10     #scaled to 1000
+    wf_request.VALIDATED_SHAPES.clear()
+    start = time.perf_counter()
+    for sweep_request in sweep_requests:
+        wf_request.validate(sweep_request, canonical=True)
+    seconds = time.perf_counter() - start
+
+    record_benchmark('validate_1000', seconds, naive_seconds=naive_seconds)
+    assert seconds < naive_seconds
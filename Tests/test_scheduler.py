@@ -0,0 +1,118 @@
+"""test_scheduler.py
+
+Pytest functions for exercising weekendfare.scheduler
+
+"""
+from os import path, remove, makedirs
+import threading
+import time
+
+import pytest
+
+import weekendfare.scheduler as wf_scheduler
+
+HERE = path.abspath(path.dirname(__file__))
+
+STATE_PATH = path.join(HERE, 'cache', 'test_quota.json')
+makedirs(path.dirname(STATE_PATH), exist_ok=True)
+def helper_clean_state():
+    """remove quota state between tests"""
+    for state_path in (STATE_PATH, STATE_PATH + '.lock'):
+        if path.isfile(state_path):
+            remove(state_path)
+
+def test_daily_limit():
+    """budget is shared through the state file and enforced per day"""
+    helper_clean_state()
+    scheduler = wf_scheduler.QuotaScheduler(STATE_PATH, 3, rate=0, interactive_reserve=0)
+    other_process = wf_scheduler.QuotaScheduler(STATE_PATH, 3, rate=0, interactive_reserve=0)
+
+    scheduler.acquire()
+    scheduler.acquire()
+    other_process.acquire()
+    assert scheduler.usage()['used'] == 3
+    assert scheduler.usage()['remaining'] == 0
+
+    with pytest.raises(wf_scheduler.QuotaExceeded):
+        other_process.acquire(timeout=0.1)
+
+    helper_clean_state()
+
+def test_interactive_reserve():
+    """background jobs leave the reserve for interactive queries"""
+    helper_clean_state()
+    scheduler = wf_scheduler.QuotaScheduler(STATE_PATH, 2, rate=0, interactive_reserve=1)
+
+    scheduler.acquire(wf_scheduler.PRIORITY_BACKGROUND)
+    with pytest.raises(wf_scheduler.QuotaExceeded):
+        scheduler.acquire(wf_scheduler.PRIORITY_BACKGROUND, timeout=0.1)
+    scheduler.acquire(wf_scheduler.PRIORITY_INTERACTIVE, timeout=0.1)
+
+    helper_clean_state()
+
+def test_token_bucket_rate():
+    """after the burst, queries are spaced out by the refill rate"""
+    helper_clean_state()
+    scheduler = wf_scheduler.QuotaScheduler(
+        STATE_PATH, 0, rate=20, burst=2, poll_interval=0.01
+    )
+
+    start = time.perf_counter()
+    for _ in range(6):
+        scheduler.acquire()
+    elapsed = time.perf_counter() - start
+
+    assert elapsed >= 4 / 20 * 0.9
+    assert elapsed < 2.0
+
+    helper_clean_state()
+
+def test_priority_order():
+    """queued interactive callers go ahead of queued background callers"""
+    helper_clean_state()
+    scheduler = wf_scheduler.QuotaScheduler(
+        STATE_PATH, 0, rate=5, burst=1, poll_interval=0.01
+    )
+    scheduler.acquire()     #drain the bucket so everyone queues
+
+    order = []
+    def worker(name, priority):
+        scheduler.acquire(priority)
+        order.append(name)
+
+    threads = [
+        threading.Thread(target=worker, args=('background', wf_scheduler.PRIORITY_BACKGROUND)),
+        threading.Thread(target=worker, args=('interactive', wf_scheduler.PRIORITY_INTERACTIVE))
+    ]
+    with scheduler._cond:       #hold the queue until both are waiting
+        for thread in threads:
+            thread.start()
+        time.sleep(0.05)
+    for thread in threads:
+        thread.join()
+
+    assert order == ['interactive', 'background']
+
+    helper_clean_state()
+
+def test_spent_budget_polling():
+    """waiting on a spent budget neither rewrites the state file nor polls at a fixed rate"""
+    helper_clean_state()
+    scheduler = wf_scheduler.QuotaScheduler(
+        STATE_PATH, 1, rate=0, interactive_reserve=0, poll_interval=0.01
+    )
+    scheduler.acquire()
+    saves = []
+    polls = []
+    save_state = scheduler._save_state
+    try_consume = scheduler._try_consume
+    scheduler._save_state = lambda state: (saves.append(state), save_state(state))
+    scheduler._try_consume = lambda *args: (polls.append(args), try_consume(*args))[1]
+
+    with pytest.raises(wf_scheduler.QuotaExceeded):
+        scheduler.acquire(timeout=0.3)
+
+    assert not saves
+    assert len(polls) < 10      #backed off: 0.01s, 0.02s, 0.04s...
+
+    helper_clean_state()
@@ -0,0 +1,123 @@
+"""test_singleflight.py
+
+Pytest functions for exercising weekendfare.singleflight
+
+"""
+from os import path
+import shutil
+import threading
+import time
+
+import pytest
+
+import weekendfare.singleflight as wf_singleflight
+import weekendfare.utilities as wf_utils
+
+HERE = path.abspath(path.dirname(__file__))
+
+LOCK_DIR = path.join(HERE, 'cache', 'test_flights')
+def helper_clean_locks():
+    """remove lock directory between tests"""
+    if path.isdir(LOCK_DIR):
+        shutil.rmtree(LOCK_DIR)
+
+def helper_run_threads(count, target):
+    """start `count` threads on `target`, wait for all"""
+    threads = [threading.Thread(target=target) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+def test_coalesce_threads():
+    """concurrent callers with one key share one call"""
+    flights = wf_singleflight.SingleFlight()
+    calls = []
+    results = []
+    def slow_call():
+        calls.append(1)
+        time.sleep(0.2)
+        return {'trips': 'demo'}
+
+    helper_run_threads(5, lambda: results.append(flights.do('SEA-DEN', slow_call)))
+
+    assert len(calls) == 1
+    assert len(results) == 5
+    assert all(result is results[0] for result in results)
+    assert flights.stats == {'led': 1, 'coalesced': 4, 'rechecked': 0}
+
+    flights.do('SEA-DEN', slow_call)    #finished calls are not reused
+    assert len(calls) == 2
+
+def test_coalesce_errors():
+    """waiters see the leader's exception"""
+    flights = wf_singleflight.SingleFlight()
+    errors = []
+    def failing_call():
+        time.sleep(0.2)
+        raise IOError('QPX down')
+    def caller():
+        try:
+            flights.do('SEA-DEN', failing_call)
+        except IOError as error:
+            errors.append(error)
+
+    helper_run_threads(3, caller)
+
+    assert len(errors) == 3
+
+def test_cross_process_recheck():
+    """a leader blocked on another process's lock re-checks before working"""
+    helper_clean_locks()
+    flights = wf_singleflight.SingleFlight(LOCK_DIR)
+    other_process = wf_utils.FileLock(flights.lock_path('SEA-DEN'))
+    shared_cache = {}
+    calls = []
+    results = []
+
+    other_process.acquire()
+    thread = threading.Thread(target=lambda: results.append(flights.do(
+        'SEA-DEN',
+        lambda: calls.append(1),
+        recheck=lambda: shared_cache.get('SEA-DEN')
+    )))
+    thread.start()
+    time.sleep(0.1)
+    shared_cache['SEA-DEN'] = {'trips': 'demo'}     #other process finished its POST
+    other_process.release()
+    thread.join()
+
+    assert results == [{'trips': 'demo'}]
+    assert not calls
+    assert flights.stats['rechecked'] == 1
+
+    helper_clean_locks()
+
+def test_unlocked_wait():
+    """a leader waiting inside `func()` lets the stripe go, then re-checks"""
+    helper_clean_locks()
+    flights = wf_singleflight.SingleFlight(LOCK_DIR, lock_stripes=1)   #every key shares a stripe
+    shared_cache = {}
+    waiting = threading.Event()
+    release = threading.Event()
+    results = []
+
+    def slow_call():
+        flights.unlocked(lambda: (waiting.set(), release.wait()))
+        return {'trips': 'fetched'}
+    thread = threading.Thread(target=lambda: results.append(flights.do(
+        'SEA-DEN', slow_call, recheck=lambda: shared_cache.get('SEA-DEN')
+    )))
+    thread.start()
+    waiting.wait()
+    other_key = flights.do('SEA-LAX', lambda: 'other', recheck=lambda: None)
+    shared_cache['SEA-DEN'] = {'trips': 'demo'}     #filled while the leader waited
+    release.set()
+    thread.join()
+
+    assert other_key == 'other'
+    assert results == [{'trips': 'demo'}]
+    assert flights.stats['rechecked'] == 1
+    assert flights.unlocked(lambda: 'plain') == 'plain'    #no lock held: just runs
+
+    helper_clean_locks()
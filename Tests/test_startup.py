@@ -0,0 +1,120 @@
+"""test_startup.py
+
+Startup benchmarks for the WeekendFare CLI (cron runs it thousands of times a day)
+
+"""
+from os import path, remove, makedirs
+import subprocess
+import json
+import sys
+import time
+
+import pytest
+
+import weekendfare.fare_cache as wf_cache
+
+HERE = path.abspath(path.dirname(__file__))
+ROOT = path.dirname(HERE)
+
+DEMO_REQUEST_PATH = path.join(HERE, 'demo_request.json')
+DEMO_RESPONSE_PATH = path.join(HERE, 'demo_response.json')
+
+RUNS = 3
+STARTUP_LIMIT = 5.0     #seconds: generous, the recorded numbers are what matter
+HEAVY_MODULES = ['dataset', 'sqlalchemy', 'jsonschema', 'requests']
+
+BENCH_DIR = path.join(HERE, 'cache')
+BENCH_CONFIG_PATH = path.join(BENCH_DIR, 'bench_startup.cfg')
+BENCH_CACHE_PATH = path.join(BENCH_DIR, 'bench_startup_cache.dat')
+BENCH_CONFIG = '''
+[LOGGING]
+    log_level = INFO
+    log_path = {log_path}
+
+[QPX]
+    base_url = http://localhost:1/qpxExpress/v1/trips
+    api_key = BENCHMARK
+
+[WeekendFare]
+    early_time = 06:00
+    late_time = 22:00
+    refund = false
+    solutions = 20
+    qpx_cache = {cache_path}
+'''
+def helper_time_cli(argv, script_tail=''):
+    """run `WeekendFare.run()` in a fresh interpreter, best of RUNS
+
+    Returns:
+        (float, str): fastest wall-clock seconds, stdout of last run
+
+    """
+    script = (
+        'import sys\n'
+        'from weekendfare.WeekendFare import WeekendFare\n'
+        'WeekendFare.run({0}, exit=False)\n'.format(repr(argv)) +
+        script_tail
+    )
+    timings = []
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        output = subprocess.check_output([sys.executable, '-c', script], cwd=ROOT)
+        timings.append(time.perf_counter() - start)
+
+    return min(timings), output.decode()
+
+def test_help_startup(record_benchmark):
+    """`--help` does not load config, cache, or heavy libraries"""
+    seconds, output = helper_time_cli(
+        ['WeekendFare', '--help'],
+        'import weekendfare.WeekendFare as wf\n'
+        'print(wf.config is None, wf.QPX_DB is None)\n'
+        'print(sorted(set(sys.modules) & set({0})))\n'.format(repr(HEAVY_MODULES))
+    )
+    record_benchmark('startup_help', seconds)
+
+    lines = output.strip().splitlines()
+    assert lines[-2] == 'True True'
+    assert lines[-1] == '[]'
+    assert seconds < STARTUP_LIMIT
+
+def test_cached_query_startup(record_benchmark):
+    """cached query answers without touching the network"""
+    makedirs(BENCH_DIR, exist_ok=True)
+    if path.isfile(BENCH_CACHE_PATH):
+        remove(BENCH_CACHE_PATH)
+    with open(BENCH_CONFIG_PATH, 'w') as filehandle:
+        filehandle.write(BENCH_CONFIG.format(
+            log_path=path.join(HERE, 'logs'),
+            cache_path=BENCH_CACHE_PATH
+        ))
+
+    with open(DEMO_REQUEST_PATH, 'r') as filehandle:
+        demo_request = json.load(filehandle)
+    with open(DEMO_RESPONSE_PATH, 'r') as filehandle:
+        demo_response = json.load(filehandle)
+    demo_slice = demo_request['request']['slice'][0]
+    cache = wf_cache.FareCache(BENCH_CACHE_PATH)
+    cache.put(
+        wf_cache.cache_key(demo_slice, {'solutions': 20, 'refundable': False}),
+        demo_response
+    )
+    cache.close()
+
+    seconds, output = helper_time_cli(
+        [
+            'WeekendFare', '--config', BENCH_CONFIG_PATH,
+            '-o', demo_slice['origin'], '-t', demo_slice['destination'],
+            '-D', demo_slice['date']
+        ],
+        'import weekendfare.WeekendFare as wf\n'
+        'print(len(wf.get_cache()), "requests" in sys.modules)\n'
+    )
+    record_benchmark('startup_cached_query', seconds)
+
+    assert output.strip().splitlines()[-1] == '1 False'
+    assert seconds < STARTUP_LIMIT
+
+    remove(BENCH_CACHE_PATH)
+    remove(BENCH_CACHE_PATH + '.refs')
+    remove(BENCH_CONFIG_PATH)
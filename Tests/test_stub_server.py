@@ -0,0 +1,143 @@
+"""test_stub_server.py
+
+Pytest functions for exercising weekendfare.stub_server
+
+"""
+from os import path
+import subprocess
+import tempfile
+import shutil
+import json
+import sys
+
+import pytest
+import requests
+
+import weekendfare.stub_server as wf_stub
+import weekendfare.qpx_parser as wf_parser
+import weekendfare.utilities as wf_utils
+
+HERE = path.abspath(path.dirname(__file__))
+ROOT = path.dirname(HERE)
+
+DEMO_RESPONSE_PATH = path.join(HERE, 'demo_response.json')
+with open(DEMO_RESPONSE_PATH, 'r') as resp_fh:
+    DEMO_RESPONSE = json.load(resp_fh)
+
+def helper_query(origin='PDX', destination='LAX', date='2017-02-03', solutions=20, slices=None):
+    """QPX query for one slice (or `slices`)"""
+    return {
+        'request': {
+            'slice': slices or [{'origin': origin, 'destination': destination, 'date': date}],
+            'passengers': {'adultCount': 1},
+            'solutions': solutions
+        }
+    }
+
+@pytest.fixture
+def stub_server():
+    """factory for running stub servers, shut down after the test"""
+    servers = []
+    def _start(**settings):
+        server = wf_stub.start_server(**settings)
+        servers.append(server)
+        return server
+    yield _start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+def test_synthesize_route_and_date():
+    """responses follow the requested route/date and parse like QPX"""
+    response = wf_stub.synthesize_response(helper_query(solutions=45), DEMO_RESPONSE)
+    trip_options = list(wf_parser.iter_trip_options(response))
+
+    assert len(trip_options) == 45
+    prices = [trip_option.price_cents for trip_option in trip_options]
+    assert prices == sorted(prices)
+    assert len(set(trip_option.id for trip_option in trip_options)) == 45
+    for trip_option in trip_options:
+        assert trip_option.slices[0].origin == 'PDX'
+        assert trip_option.slices[0].destination == 'LAX'
+
+    raw_times = [
+        option['slice'][0]['segment'][0]['leg'][0]['departureTime']
+        for option in response['trips']['tripOption']
+    ]
+    assert all(raw_time.startswith('2017-02-03') for raw_time in raw_times)
+
+def test_synthesize_stable_prices():
+    """same route/date prices the same; multi-slice answers have every slice"""
+    first = wf_stub.synthesize_response(helper_query(), DEMO_RESPONSE)
+    again = wf_stub.synthesize_response(helper_query(), DEMO_RESPONSE)
+    assert [option['saleTotal'] for option in first['trips']['tripOption']] == \
+        [option['saleTotal'] for option in again['trips']['tripOption']]
+
+    round_trip = wf_stub.synthesize_response(helper_query(solutions=5, slices=[
+        {'origin': 'SEA', 'destination': 'DEN', 'date': '2017-01-13'},
+        {'origin': 'DEN', 'destination': 'SEA', 'date': '2017-01-15'}
+    ]), DEMO_RESPONSE)
+    trip_options = list(wf_parser.iter_trip_options(round_trip))
+    assert len(trip_options) == 5
+    assert [qpx_slice.origin for qpx_slice in trip_options[0].slices] == ['SEA', 'DEN']
+
+def test_server_search(stub_server):
+    """`fetch_POST_request` works against the stub; padding grows responses"""
+    server = stub_server(pad_bytes=50000, max_solutions=10)
+    session = wf_utils.build_session(retries=0)
+    request = wf_utils.fetch_POST_request(
+        server.base_url + '/search', helper_query(solutions=30), session=session
+    )
+
+    assert len(request.content) > 50000
+    assert len(request.json()['trips']['tripOption']) == 10
+    assert server.get_stats()['ok'] == 1
+
+    stats = requests.get(server.base_url.split('/qpxExpress')[0] + '/stats').json()
+    assert stats['requests'] == 1
+
+def test_server_errors_and_throttling(stub_server):
+    """error rate answers 503, an empty token bucket answers 429"""
+    failing = stub_server(error_rate=1.0, seed=1)
+    reply = requests.post(failing.base_url + '/search', json=helper_query())
+    assert reply.status_code == 503
+    assert reply.json()['error']['code'] == 503
+
+    throttled = stub_server(rate_limit=0.01, burst=2)
+    codes = [
+        requests.post(throttled.base_url + '/search', json=helper_query()).status_code
+        for _ in range(4)
+    ]
+    assert codes == [200, 200, 429, 429]
+    assert throttled.get_stats()['throttled'] == 2
+
+    bad = requests.post(throttled.base_url.replace('trips', 'nope'), data='{}')
+    assert bad.status_code == 404
+
+def test_server_without_tests_checkout():
+    """an installed copy (package files only, no `Tests/`) serves its own template"""
+    with open(wf_stub.TEMPLATE_PATH, 'r') as template_fh:
+        assert json.load(template_fh) == DEMO_RESPONSE
+    install_dir = tempfile.mkdtemp()
+    try:
+        shutil.copytree(
+            path.join(ROOT, 'weekendfare'),
+            path.join(install_dir, 'weekendfare'),
+            ignore=shutil.ignore_patterns('__pycache__', 'logs', '*.dat*', '*.db', 'qpx_quota.json*')
+        )
+        stub = subprocess.Popen(
+            [sys.executable, '-u', '-m', 'weekendfare.stub_server', '-p', '0'],
+            cwd=install_dir,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE
+        )
+        try:
+            base_url = stub.stdout.readline().decode().split()[-1]   #`stub QPX at http://...`
+            reply = requests.post(base_url + '/search', json=helper_query(solutions=3))
+            assert reply.status_code == 200
+            assert len(reply.json()['trips']['tripOption']) == 3
+        finally:
+            stub.terminate()
+            stub.communicate()
+    finally:
+        shutil.rmtree(install_dir)
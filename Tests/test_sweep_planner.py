@@ -0,0 +1,78 @@
+"""test_sweep_planner.py
+
+Pytest functions for exercising weekendfare.sweep_planner
+
+"""
+import pytest
+
+import weekendfare.sweep_planner as wf_sweep
+
+PRICES = {      #what QPX would answer, cents
+    'DEN': 20000,
+    'LAX': 15000,
+    'SFO': 30000,
+    'PDX': 9000,
+    'BOS': 45000
+}
+BOUNDS = {      #history-based lower bounds, cents
+    'DEN': 18000,
+    'LAX': 12000,
+    'SFO': 27000,
+    'PDX': 0,       #never seen
+    'BOS': 40000
+}
+def helper_candidates():
+    """one candidate per destination"""
+    return [
+        wf_sweep.Candidate(('SEA', dest, '2017-01-13'), {'dest': dest}, bound=BOUNDS[dest])
+        for dest in sorted(PRICES)
+    ]
+
+def helper_fetcher(calls):
+    """fake QPX: look up PRICES, record every call"""
+    def fetch_prices(batch):
+        for candidate in batch:
+            calls.append(candidate.key[1])
+            yield candidate, PRICES[candidate.key[1]]
+    return fetch_prices
+
+def test_estimate_bound():
+    """lowest estimate, discounted; nothing known is 0"""
+    assert wf_sweep.estimate_bound([20000, None, 25000], margin=0.1) == 18000
+    assert wf_sweep.estimate_bound([None]) == 0
+
+def test_prune_by_best():
+    """stops once no bound can beat the best price found"""
+    calls = []
+    result = wf_sweep.branch_and_bound(helper_candidates(), helper_fetcher(calls))
+
+    assert [candidate.key[1] for candidate in result.best] == ['PDX']
+    assert calls == ['PDX']             #every other bound is above 90.00
+    assert result.fetched == 1
+    assert result.pruned == 4
+
+def test_prune_by_cap_and_count():
+    """best N and the price cap both bound the search"""
+    calls = []
+    result = wf_sweep.branch_and_bound(
+        helper_candidates(), helper_fetcher(calls), best_count=3, price_cap=25000
+    )
+
+    assert [candidate.key[1] for candidate in result.best] == ['PDX', 'LAX', 'DEN']
+    assert calls == ['PDX', 'LAX', 'DEN']
+    assert result.pruned == 2           #SFO/BOS bounds are over the cap
+
+def test_known_prices_and_batches():
+    """cached prices cost nothing; batches fetch several at once"""
+    candidates = helper_candidates()
+    candidates[3].price = PRICES['PDX']     #fresh in cache
+    candidates[3].bound = PRICES['PDX']
+    calls = []
+    result = wf_sweep.branch_and_bound(
+        candidates, helper_fetcher(calls), best_count=2, batch_size=2
+    )
+
+    assert result.known == 1
+    assert [candidate.key[1] for candidate in result.best] == ['PDX', 'LAX']
+    assert calls == ['LAX', 'DEN']      #one batch of the two lowest bounds
+    assert result.pruned == 2
@@ -0,0 +1,77 @@
+"""test_trip_planner.py
+
+Pytest functions for exercising weekendfare.trip_planner
+
+"""
+from os import path
+import json
+
+import pytest
+
+import weekendfare.trip_planner as wf_planner
+import weekendfare.qpx_parser as wf_parser
+import weekendfare.models as wf_models
+
+HERE = path.abspath(path.dirname(__file__))
+
+DEMO_RESPONSE_PATH = path.join(HERE, 'demo_response.json')
+with open(DEMO_RESPONSE_PATH, 'r') as resp_fh:
+    DEMO_RESPONSE = json.load(resp_fh)
+DEMO_OPTIONS = list(wf_parser.iter_trip_options(DEMO_RESPONSE))
+
+ROUND_TRIP_QUERY = {
+    'request': {
+        'slice': [
+            {'origin': 'SEA', 'destination': 'DEN', 'date': '2017-01-13'},
+            {'origin': 'DEN', 'destination': 'SEA', 'date': '2017-01-15'}
+        ],
+        'passengers': {'adultCount': 2},
+        'solutions': 20
+    }
+}
+
+def helper_shifted_response(days, currency=None):
+    """demo response with every flight moved `days` later (optionally repriced)"""
+    shifted = json.loads(json.dumps(DEMO_RESPONSE))
+    for option in shifted['trips']['tripOption']:
+        if currency:
+            option['saleTotal'] = currency + option['saleTotal'][3:]
+        for qpx_slice in option['slice']:
+            for segment in qpx_slice['segment']:
+                for leg in segment['leg']:
+                    for field in ('departureTime', 'arrivalTime'):
+                        epoch, offset = wf_models.parse_qpx_time(leg[field])
+                        leg[field] = wf_models.format_qpx_time(epoch + days * 86400, offset)
+    return shifted
+
+def test_slice_queries():
+    """one query per slice, every other field shared"""
+    slice_queries = wf_planner.slice_queries(ROUND_TRIP_QUERY)
+
+    assert len(slice_queries) == 2
+    assert slice_queries[1]['request']['slice'] == [ROUND_TRIP_QUERY['request']['slice'][1]]
+    assert slice_queries[1]['request']['passengers'] == {'adultCount': 2}
+    assert len(ROUND_TRIP_QUERY['request']['slice']) == 2  #input untouched
+
+def test_compose_round_trip():
+    """cheapest combinations come first and are flagged composed"""
+    return_options = list(wf_parser.iter_trip_options(helper_shifted_response(2)))
+    composed = wf_planner.compose_trip_options([DEMO_OPTIONS, return_options], limit=3)
+
+    assert len(composed) == 3
+    assert composed[0].composed
+    assert composed[0].price_cents == DEMO_OPTIONS[0].price_cents + return_options[0].price_cents
+    assert len(composed[0].slices) == 2
+    assert [option.price_cents for option in composed] == sorted(option.price_cents for option in composed)
+    assert composed[0].to_dict()['composed'] is True
+
+def test_compose_constraints():
+    """overlapping tickets and mixed currencies never combine"""
+    same_day = wf_planner.compose_trip_options([DEMO_OPTIONS, DEMO_OPTIONS])
+    for trip_option in same_day:
+        first, second = trip_option.slices
+        assert second.departure >= first.arrival + wf_planner.MIN_CONNECTION * 60
+
+    euro_options = list(wf_parser.iter_trip_options(helper_shifted_response(2, currency='EUR')))
+    assert wf_planner.compose_trip_options([DEMO_OPTIONS, euro_options]) == []
+    assert wf_planner.compose_trip_options([DEMO_OPTIONS, []]) == []
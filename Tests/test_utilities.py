@@ -4,8 +4,15 @@ Pytest funcitons for exercising weekendfare.utilities
 
 """
 from os import path, listdir, remove, makedirs
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
 import configparser
+import threading
 import logging
+from logging.handlers import QueueListener
+import queue
+import json
+import time
 from datetime import datetime
 
 import pytest
@@ -136,6 +143,124 @@ def test_debug_logger(config=TEST_CONFIG):
 
     test_cleanup_log_directory(logger)
 
+QUEUE_THREADS = 8
+QUEUE_MESSAGES = 500    #per thread
+class SlowFileHandler(logging.FileHandler):
+    """file handler with slow disk: every write costs a little"""
+    def emit(self, record):
+        time.sleep(0.0001)
+        logging.FileHandler.emit(self, record)
+
+class BlockedHandler(logging.Handler):
+    """handler stuck in `emit()` until `unblock` is set (a disk that never answers)"""
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.unblock = threading.Event()
+        self.messages = []
+
+    def emit(self, record):
+        self.unblock.wait()
+        self.messages.append(record.getMessage())
+
+def helper_threaded_logging(logger):
+    """seconds for QUEUE_THREADS threads to each log QUEUE_MESSAGES lines"""
+    def work(worker):
+        for index in range(QUEUE_MESSAGES):
+            logger.info('worker %s message %s', worker, index)
+    threads = [threading.Thread(target=work, args=(worker,)) for worker in range(QUEUE_THREADS)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start
+
+def test_queue_logger(config=TEST_CONFIG):
+    """queue logger writes from a background thread, messages frozen at call time"""
+    log_name = 'queued'
+    logger = wf_utils.create_logger(
+        log_name,
+        config=config,
+        log_path=LOG_PATH,
+        log_queue=True
+    )
+    queue_handlers = [
+        handler for handler in logger.handlers
+        if isinstance(handler, wf_utils.DeferredQueueHandler)
+    ]
+    assert len(queue_handlers) == 1
+    assert not any(isinstance(handler, logging.FileHandler) for handler in logger.handlers)
+
+    log_capture = helper_log_messages(logger)
+    log_capture.check(
+        (log_name, 'INFO',     LOG_MESSAGE + ' --INFO--'),
+        (log_name, 'WARNING',  LOG_MESSAGE + ' --WARNING--'),
+        (log_name, 'ERROR',    LOG_MESSAGE + ' --ERROR--'),
+        (log_name, 'CRITICAL', LOG_MESSAGE + ' --CRITICAL--'),
+    )
+    seats = ['12A']
+    logger.warning('seats=%s', seats)
+    seats.append('12B')     #after the call: must not show up
+    try:
+        raise ValueError('boom')
+    except ValueError:
+        logger.error('EXCEPTION: %s', 'formatted on the listener', exc_info=True)
+
+    queue_handlers[0].close()   #stops listener, flushing the queue
+    with open(path.join(LOG_PATH, log_name + '.log'), 'r') as log_fh:
+        log_text = log_fh.read()
+    assert LOG_MESSAGE + ' --CRITICAL--' in log_text
+    assert "seats=['12A']\n" in log_text
+    assert 'ValueError: boom' in log_text
+
+    test_cleanup_log_directory(logger)
+
+def test_queue_logger_unblocks_workers(record_benchmark):
+    """with a stuck disk, queued logging does not hold up logging threads"""
+    logger = logging.getLogger('queue_blocked')
+    logger.setLevel(logging.INFO)
+    blocked_handler = BlockedHandler()
+    record_queue = queue.Queue(-1)
+    listener = QueueListener(record_queue, blocked_handler)
+    queue_handler = wf_utils.DeferredQueueHandler(record_queue, listener)
+    listener.start()
+    logger.addHandler(queue_handler)
+
+    caller = threading.Thread(target=lambda: logger.info('worker %s message %s', 0, 0))
+    caller.start()
+    caller.join(timeout=5)
+    assert not caller.is_alive()    #returned while the handler is still stuck
+    assert not blocked_handler.messages
+
+    blocked_handler.unblock.set()
+    queue_handler.close()   #stops listener, flushing the queue
+    logger.removeHandler(queue_handler)
+    assert blocked_handler.messages == ['worker 0 message 0']
+
+    timings = {}    #slow disk, recorded only: too noisy to assert on
+    for queued in (False, True):
+        logger = logging.getLogger('queue_bench_{0}'.format(queued))
+        logger.setLevel(logging.INFO)
+        file_handler = SlowFileHandler(path.join(LOG_PATH, 'queue_bench.log'))
+        if queued:
+            record_queue = queue.Queue(-1)
+            listener = QueueListener(record_queue, file_handler)
+            queue_handler = wf_utils.DeferredQueueHandler(record_queue, listener)
+            listener.start()
+            logger.addHandler(queue_handler)
+        else:
+            logger.addHandler(file_handler)
+        timings[queued] = helper_threaded_logging(logger)
+        test_cleanup_log_directory(logger)
+
+    record_benchmark(
+        'threaded_logging',
+        timings[True],
+        direct_seconds=timings[False],
+        threads=QUEUE_THREADS,
+        messages=QUEUE_THREADS * QUEUE_MESSAGES
+    )
+
 GET_ECHO_ENDPOINT = 'https://echo.getpostman.com/get'
 def test_GET_fetcher():
     """ECHO test for GET utility
@@ -209,3 +334,96 @@ def test_POST_fetcher_fail():
         resp = wf_utils.fetch_GET_request(bad_url)
 
     #TODO: bad status code tests?
+
+class LocalEchoHandler(BaseHTTPRequestHandler):
+    """keep-alive echo server: tracks client connections, can fail on demand"""
+    protocol_version = 'HTTP/1.1'
+    connections = set()
+    fail_statuses = []
+
+    def log_message(self, *args):
+        pass
+
+    def _respond(self, body):
+        LocalEchoHandler.connections.add(self.client_address)
+        status = 200
+        if LocalEchoHandler.fail_statuses:
+            status = LocalEchoHandler.fail_statuses.pop(0)
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        self._respond({'path': self.path})
+
+    def do_POST(self):
+        length = int(self.headers['Content-Length'])
+        self._respond({'data': json.loads(self.rfile.read(length).decode())})
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+def helper_local_server():
+    """start echo server on a free port
+
+    Returns:
+        (:obj:`HTTPServer`, str): server, base url
+
+    """
+    LocalEchoHandler.connections = set()
+    LocalEchoHandler.fail_statuses = []
+    server = ThreadingHTTPServer(('127.0.0.1', 0), LocalEchoHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, 'http://127.0.0.1:{0}'.format(server.server_address[1])
+
+def test_build_session():
+    """session carries pool size and retry policy"""
+    session = wf_utils.build_session(pool_size=4, retries=2, backoff=0.1)
+    adapter = session.get_adapter('https://www.googleapis.com')
+
+    assert adapter._pool_maxsize == 4
+    assert adapter.max_retries.total == 2
+    assert 429 in adapter.max_retries.status_forcelist
+    assert session.headers['User-Agent'] == wf_utils.USER_AGENT
+
+    retry = wf_utils.build_session(retry_methods=('GET',)).get_adapter('https://x').max_retries
+    assert 'POST' not in (getattr(retry, 'allowed_methods', None) or retry.method_whitelist)
+
+def test_session_reuses_connections():
+    """many requests through one session share a keep-alive connection"""
+    server, base_url = helper_local_server()
+    session = wf_utils.build_session(pool_size=2)
+
+    for index in range(20):
+        resp = wf_utils.fetch_POST_request(
+            base_url + '/post',
+            {'index': index},
+            session=session
+        )
+        assert resp.json()['data'] == {'index': index}
+
+    assert len(LocalEchoHandler.connections) == 1
+
+    session.close()
+    server.shutdown()
+    server.server_close()
+
+def test_session_retries_bad_status():
+    """5xx/429 responses are retried before giving up"""
+    server, base_url = helper_local_server()
+    session = wf_utils.build_session(retries=2, backoff=0)
+
+    LocalEchoHandler.fail_statuses = [503, 429]
+    resp = wf_utils.fetch_GET_request(base_url + '/get', session=session)
+    assert resp.json()['path'] == '/get'
+
+    LocalEchoHandler.fail_statuses = [500, 500, 500]
+    with pytest.raises(Exception):
+        wf_utils.fetch_GET_request(base_url + '/get', session=session)
+
+    session.close()
+    server.shutdown()
+    server.server_close()
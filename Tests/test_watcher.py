@@ -0,0 +1,99 @@
+"""test_watcher.py
+
+Pytest functions for exercising weekendfare.watcher
+
+"""
+from os import path, remove, makedirs
+import threading
+import json
+import time
+
+import pytest
+
+import weekendfare.watcher as wf_watcher
+
+HERE = path.abspath(path.dirname(__file__))
+WATCHLIST_PATH = path.join(HERE, 'cache', 'test_watchlist.json')
+makedirs(path.dirname(WATCHLIST_PATH), exist_ok=True)
+
+def helper_watchlist(items):
+    """write a watchlist file, return its path"""
+    with open(WATCHLIST_PATH, 'w') as watchlist_fh:
+        json.dump(items, watchlist_fh)
+    return WATCHLIST_PATH
+
+def test_timer_wheel():
+    """items come due at their tick, including past a full revolution"""
+    wheel = wf_watcher.TimerWheel(tick=1.0, slots=8, now=1000)
+    wheel.schedule(3, 'soon', now=1000)
+    wheel.schedule(1, 'first', now=1000)
+    wheel.schedule(20, 'later', now=1000)    #2.5 revolutions out
+    wheel.schedule(0, 'now', now=1000)       #next tick at the soonest
+
+    assert len(wheel) == 4
+    assert wheel.advance(now=1000.5) == []
+    assert wheel.advance(now=1001) == ['first', 'now']  #same tick: scheduling order
+    assert wheel.advance(now=1010) == ['soon']
+    assert wheel.advance(now=1019.9) == []
+    assert wheel.advance(now=1020) == ['later']
+    assert len(wheel) == 0
+
+def test_timer_wheel_catch_up():
+    """a stalled wheel hands back everything overdue, in order"""
+    wheel = wf_watcher.TimerWheel(tick=1.0, slots=4, now=0)
+    for delay in (9, 2, 5, 30):
+        wheel.schedule(delay, delay, now=0)
+
+    assert wheel.advance(now=12) == [2, 5, 9]
+    assert wheel.advance(now=40) == [30]
+
+def test_load_watchlist():
+    """weeks or from/until windows; malformed entries name themselves"""
+    entries = wf_watcher.load_watchlist(helper_watchlist([
+        {'origin': 'sea', 'to': ['den', 'LAX'], 'weeks': 2},
+        {'origin': 'SEA', 'to': 'SFO,PDX', 'from': '2017-01-13', 'until': '2017-01-15', 'every': 600}
+    ]))
+    assert entries[0].destinations == ['DEN', 'LAX']
+    assert entries[1].destinations == ['SFO', 'PDX']
+    assert entries[1].every == 600
+
+    helper_watchlist([{'origin': 'SEA', 'to': 'DEN', 'weeks': 1}, {'origin': 'SEA', 'to': 'DEN'}])
+    with pytest.raises(ValueError) as err:
+        wf_watcher.load_watchlist(WATCHLIST_PATH)
+    assert 'watchlist[1]' in str(err.value)
+    remove(WATCHLIST_PATH)
+
+def test_daemon_socket_and_refresh():
+    """daemon refreshes due entries and answers socket queries meanwhile"""
+    refreshed = []
+    def refresh(entry):
+        refreshed.append(entry)
+        return 600
+    def answer(request):
+        if request.get('date') == 'bad':
+            raise ValueError('bad date')
+        return {'fares': [request['origin']]}
+
+    daemon = wf_watcher.WatchDaemon(refresh, answer, address=('127.0.0.1', 0), tick=0.05)
+    daemon.watch('SEA->DEN')
+    address = daemon.start()
+    runner = threading.Thread(target=daemon.run, daemon=True)
+    runner.start()
+    deadline = time.time() + 5
+    while not refreshed and time.time() < deadline:
+        time.sleep(0.01)
+
+    assert wf_watcher.ask_daemon(address, {'origin': 'SEA'}) == {'fares': ['SEA'], 'ok': True}
+    failed = wf_watcher.ask_daemon(address, {'origin': 'SEA', 'date': 'bad'})
+    assert failed == {'ok': False, 'error': 'bad date'}
+    status = wf_watcher.ask_daemon(address, {'cmd': 'status'})
+    assert status['queries'] == 2
+    assert status['query_errors'] == 1
+    assert status['scheduled'] == 1
+    assert status['refreshes'] == 1
+
+    assert wf_watcher.ask_daemon(address, {'cmd': 'stop'}) == {'ok': True}
+    runner.join(timeout=5)
+    daemon.close()
+    assert not runner.is_alive()
+    assert refreshed == ['SEA->DEN']
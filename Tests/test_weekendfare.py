@@ -0,0 +1,578 @@
+"""test_weekendfare.py
+
+Pytest functions for exercising weekendfare.WeekendFare
+
+"""
+from os import path, remove
+from datetime import date, timedelta
+import json
+import threading
+import time
+
+import pytest
+
+import weekendfare.qpx_request as wf_request
+
+HERE = path.abspath(path.dirname(__file__))
+DEMO_RESPONSE_PATH = path.join(HERE, 'demo_response.json')
+
+def helper_queries(wf, destinations, dates):
+    """single-slice SEA queries for each destination/date"""
+    return [
+        wf.build_query(
+            [{'origin': 'SEA', 'destination': dest, 'date': day}],
+            solutions=20
+        )
+        for dest in destinations
+        for day in dates
+    ]
+
+def test_weekend_dates():
+    """only Fri/Sat/Sun, in order"""
+    import weekendfare.WeekendFare as wf
+    dates = wf.weekend_dates(2, start_date=date(2017, 1, 9))    #a Monday
+
+    assert dates == [
+        '2017-01-13', '2017-01-14', '2017-01-15',
+        '2017-01-20', '2017-01-21', '2017-01-22'
+    ]
+
+def test_fetch_batch_cache_first(local_weekendfare):
+    """cached queries are answered without a POST"""
+    wf, qpx_server = local_weekendfare
+    qpx_queries = helper_queries(wf, ['DEN', 'LAX'], ['2017-01-13'])
+    wf.fetch_query(qpx_queries[0])
+    assert len(qpx_server.requests_seen) == 1
+
+    results = list(wf.fetch_batch(qpx_queries, max_workers=2))
+
+    assert len(results) == 2
+    assert results[0][0] is qpx_queries[0]      #cache hit comes back first
+    assert all(qpx_response['trips'] for _, qpx_response in results)
+    assert len(qpx_server.requests_seen) == 2
+
+def test_fetch_batch_concurrent(local_weekendfare):
+    """wall time scales with max_workers, not query count"""
+    wf, qpx_server = local_weekendfare
+    qpx_server.delay = 0.2
+    qpx_queries = helper_queries(wf, ['DEN', 'LAX', 'SFO', 'PDX'], ['2017-01-13', '2017-01-14'])
+
+    start = time.perf_counter()
+    results = list(wf.fetch_batch(qpx_queries, max_workers=8))
+    elapsed = time.perf_counter() - start
+
+    assert len(results) == 8
+    assert len(qpx_server.requests_seen) == 8
+    assert elapsed < 8 * qpx_server.delay / 2
+
+def test_sweep_cli(local_weekendfare, capsys):
+    """`sweep` subcommand fetches every weekend day per destination"""
+    wf, qpx_server = local_weekendfare
+
+    _, retcode = wf.WeekendFare.run(
+        [
+            'WeekendFare', '--config', qpx_server.config_path,
+            'sweep', 'SEA', '-t', 'DEN,LAX', '-w', '1', '-j', '4'
+        ],
+        exit=False
+    )
+    output = capsys.readouterr().out.strip().splitlines()
+
+    assert retcode == 0
+    assert len(output) == 6
+    assert len(qpx_server.requests_seen) == 6
+    assert all(line.endswith('USD206.80') for line in output)
+
+def test_sweep_cli_best(local_weekendfare, capsys):
+    """`sweep --best` ranks across every route/date of the sweep"""
+    wf, qpx_server = local_weekendfare
+
+    _, retcode = wf.WeekendFare.run(
+        [
+            'WeekendFare', '--config', qpx_server.config_path, '--nonstop',
+            'sweep', 'SEA', '-t', 'DEN', '-w', '1', '-b', '2'
+        ],
+        exit=False
+    )
+    output = capsys.readouterr().out.strip().splitlines()
+
+    assert retcode == 0
+    assert output[3] == '-- best 2 of 60 fares --'
+    assert len(output) == 6
+    assert all('0 stop(s)' in line for line in output[4:])
+
+def test_fetch_batch_dedup(local_weekendfare):
+    """logically identical queries are fetched once, answered for each"""
+    wf, qpx_server = local_weekendfare
+    qpx_queries = helper_queries(wf, ['DEN', 'den'], ['2017-01-13'])
+    qpx_queries[1]['request']['passengers'] = {'adultCount': 1, 'childCount': 0}
+
+    results = list(wf.fetch_batch(qpx_queries, max_workers=2))
+
+    assert len(results) == 2
+    assert len(qpx_server.requests_seen) == 1
+    assert results[0][1] == results[1][1]
+
+def test_fetch_query_single_flight(local_weekendfare):
+    """overlapping identical fetches make one API call"""
+    wf, qpx_server = local_weekendfare
+    qpx_server.delay = 0.2
+    qpx_query = helper_queries(wf, ['DEN'], ['2017-01-13'])[0]
+    results = []
+
+    threads = [
+        threading.Thread(target=lambda: results.append(wf.fetch_query(qpx_query)))
+        for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(results) == 4
+    assert all(qpx_response['trips'] for qpx_response in results)
+    assert len(qpx_server.requests_seen) == 1
+
+def test_fetch_metrics(local_weekendfare):
+    """cache misses/hits, HTTP bytes and quota use land in `weekendfare.metrics`"""
+    import weekendfare.metrics as wf_metrics
+    wf, _ = local_weekendfare
+    wf_metrics.METRICS.reset()
+    qpx_query = helper_queries(wf, ['DEN'], ['2017-01-13'])[0]
+
+    wf.parse_response(wf.fetch_query(qpx_query))
+    wf.fetch_query(qpx_query)
+
+    counters = {
+        (counter['name'],) + tuple(counter['labels'].values()): counter['value']
+        for counter in wf_metrics.METRICS.to_dict()['counters']
+    }
+    assert counters[('cache_lookups', 'miss')] == 2   #before fetching, and the in-flight recheck
+    assert counters[('cache_lookups', 'hit')] == 1
+    assert counters[('http_requests', 'POST', '200')] == 1
+    assert counters[('http_bytes_received', 'POST')] > 60000
+    assert counters[('qpx_queries', str(wf.wf_scheduler.PRIORITY_INTERACTIVE))] == 1
+    assert counters[('trip_options_parsed',)] == 40    #fare history parses each response too
+    assert 'weekendfare_http_request_seconds_count{method="POST"} 1' in \
+        wf_metrics.METRICS.to_prometheus().splitlines()
+
+def test_fetch_retries_through_quota(local_weekendfare):
+    """every retried POST is paid for: the session never resends a POST itself"""
+    import weekendfare.metrics as wf_metrics
+    wf, qpx_server = local_weekendfare
+    wf.get_config().set('QPX', 'retries', '2')
+    wf_metrics.METRICS.reset()
+    adapter = wf.get_session().get_adapter(wf.get_config().get('QPX', 'base_url'))
+    assert 'POST' not in (
+        getattr(adapter.max_retries, 'allowed_methods', None) or
+        adapter.max_retries.method_whitelist
+    )
+
+    qpx_server.fail_statuses = [429, 503]
+    qpx_query = helper_queries(wf, ['DEN'], ['2017-01-13'])[0]
+    assert wf.fetch_query(qpx_query)['trips']
+    assert len(qpx_server.requests_seen) == 3
+    counters = {
+        (counter['name'],) + tuple(counter['labels'].values()): counter['value']
+        for counter in wf_metrics.METRICS.to_dict()['counters']
+    }
+    assert counters[('qpx_queries', str(wf.wf_scheduler.PRIORITY_INTERACTIVE))] == 3
+    assert counters[('qpx_retries', '429')] == 1
+
+    qpx_server.fail_statuses = [503, 503, 503]
+    with pytest.raises(wf.wf_utils.BadStatusCode):
+        wf.fetch_query(helper_queries(wf, ['LAX'], ['2017-01-13'])[0])
+    assert len(qpx_server.requests_seen) == 6   #first try + 2 retries
+
+def test_quota_wait_leaves_stripe(local_weekendfare):
+    """a background leader waiting on quota does not hold up interactive queries on its stripe"""
+    wf, qpx_server = local_weekendfare
+    wf.QPX_FLIGHTS = wf.wf_singleflight.SingleFlight(
+        wf.get_flights().lock_dir, lock_stripes=1     #every query shares one stripe
+    )
+    scheduler = wf.QPX_SCHEDULER = wf.wf_scheduler.QuotaScheduler(
+        wf.get_scheduler().state_path,
+        daily_limit=1,
+        rate=0,
+        interactive_reserve=1,  #background budget: none today
+        poll_interval=0.05
+    )
+    background_query, interactive_query = helper_queries(wf, ['DEN', 'LAX'], ['2017-01-13'])
+    results = []
+    background = threading.Thread(target=lambda: results.append(
+        wf.fetch_query(background_query, priority=wf.wf_scheduler.PRIORITY_BACKGROUND)
+    ))
+    background.start()
+    time.sleep(0.2)     #leader is in its quota wait
+
+    assert wf.fetch_query(interactive_query)['trips']
+    assert background.is_alive()
+    assert len(qpx_server.requests_seen) == 1
+
+    scheduler.daily_limit = 0   #budget back: the background query goes through
+    background.join()
+    assert results[0]['trips']
+    assert len(qpx_server.requests_seen) == 2
+
+def test_output_paths_follow_cwd(local_weekendfare, monkeypatch):
+    """relative output paths resolve against the working directory, like `log_path`"""
+    wf, _ = local_weekendfare
+    scratch_dir = path.dirname(wf.get_config().get('WeekendFare', 'qpx_cache'))
+    monkeypatch.chdir(scratch_dir)
+    monkeypatch.setattr(wf, 'METRICS_PATH', 'unset')    #no exit hook from this test
+    wf.get_config().set('LOGGING', 'metrics_path', 'metrics_cwd.json')
+
+    wf.setup_metrics()
+    assert wf.METRICS_PATH == path.join(scratch_dir, 'metrics_cwd.json')
+    wf.export_metrics()
+    assert path.isfile(wf.METRICS_PATH)
+    remove(wf.METRICS_PATH)
+
+    monkeypatch.setattr(wf.atexit, 'register', lambda func: func)     #no state save at exit
+    monkeypatch.setattr(wf, 'ALERT_LOG_PATH', None)
+    wf.get_config().add_section('Alerts')
+    wf.get_config().set('Alerts', 'alert_state', path.join(scratch_dir, 'alerts_cwd.json'))
+    wf.get_config().set('Alerts', 'alert_log', 'alerts_cwd.jsonl')
+    assert wf.get_alerts() is not None
+    assert wf.ALERT_LOG_PATH == path.join(scratch_dir, 'alerts_cwd.jsonl')
+
+def test_build_request():
+    """`build_request` returns validated canonical JSON"""
+    import weekendfare.WeekendFare as wf
+    qpx_query = wf.build_query([{'origin': 'sea', 'destination': 'den', 'date': '2017-01-13'}])
+
+    request_json = wf.build_request(qpx_query)
+    assert json.loads(request_json) == wf_request.canonicalize(qpx_query)
+
+    qpx_query['request']['slice'][0]['date'] = '01/13/2017'
+    with pytest.raises(wf_request.InvalidQuery):
+        wf.build_request(qpx_query)
+
+def test_fetch_records_history(local_weekendfare, capsys):
+    """fresh responses land in the fare history, cache hits do not"""
+    wf, qpx_server = local_weekendfare
+    qpx_query = helper_queries(wf, ['DEN'], ['2017-01-13'])[0]
+    wf.fetch_query(qpx_query)
+    wf.fetch_query(qpx_query)
+
+    assert len(wf.get_history()) == 20
+
+    _, retcode = wf.WeekendFare.run(
+        [
+            'WeekendFare', '--config', qpx_server.config_path,
+            'history', 'SEA', '-t', 'DEN', '-b', '2', '--days', '100000'
+        ],
+        exit=False
+    )
+    output = capsys.readouterr().out.strip().splitlines()
+
+    assert retcode == 0
+    assert len(output) == 2
+    assert output[0].startswith('USD206.80 SEA->DEN 2017-01-13')
+
+def test_refresh_stale_only(local_weekendfare, capsys):
+    """`refresh` re-fetches expired entries only, soonest departure first"""
+    wf, qpx_server = local_weekendfare
+    today = date.today()
+    near, far, departed = [
+        (today + timedelta(days=offset)).strftime('%Y-%m-%d') for offset in (1, 40, -3)
+    ]
+    qpx_queries = helper_queries(wf, ['DEN'], [far, near, departed])
+    for qpx_query in qpx_queries:
+        wf.fetch_query(qpx_query)
+    cache = wf.get_cache()
+    an_hour_ago = time.time() - 3600
+    for qpx_query in qpx_queries:   #age every entry by an hour
+        canonical = wf_request.canonicalize(qpx_query)
+        key = wf_request.fingerprint(canonical, canonical=True)
+        cache.put(key, cache.get(key), now=an_hour_ago, query=canonical)
+
+    stale = wf.stale_queries()
+    assert [qpx_query['request']['slice'][0]['date'] for qpx_query in stale] == [near]
+    assert len(cache.queries()) == 2    #departed query dropped
+
+    qpx_server.requests_seen = []
+    _, retcode = wf.WeekendFare.run(
+        ['WeekendFare', '--config', qpx_server.config_path, 'refresh'],
+        exit=False
+    )
+    output = capsys.readouterr().out.strip().splitlines()
+
+    assert retcode == 0
+    assert output[0] == '1 stale, refreshing 1'
+    assert [qpx_query['request']['slice'][0]['date'] for qpx_query in qpx_server.requests_seen] == [near]
+    assert wf.stale_queries() == []
+
+def test_watch_daemon(local_weekendfare):
+    """`watch` refreshes its watchlist, then answers socket queries from the warm cache"""
+    import socket
+    import weekendfare.watcher as wf_watcher
+    wf, qpx_server = local_weekendfare
+    watchlist_path = path.join(HERE, 'cache', 'test_watch_daemon.json')
+    with open(watchlist_path, 'w') as watchlist_fh:
+        json.dump([{'origin': 'SEA', 'to': ['DEN', 'LAX'], 'weeks': 1}], watchlist_fh)
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        address = probe.getsockname()
+    runner = threading.Thread(target=wf.WeekendFare.run, args=([
+        'WeekendFare', '--config', qpx_server.config_path,
+        'watch', '-w', watchlist_path, '-p', str(address[1])
+    ],), kwargs={'exit': False}, daemon=True)
+    runner.start()
+
+    status = {}
+    deadline = time.time() + 10
+    while not status.get('refreshes') and time.time() < deadline:
+        try:
+            status = wf_watcher.ask_daemon(address, {'cmd': 'status'})
+        except OSError:     #not listening yet
+            pass
+        time.sleep(0.05)
+    assert status['refreshes'] == 1
+    assert len(qpx_server.requests_seen) == 6   #3 weekend days x 2 routes
+
+    day = wf.weekend_dates(1)[0]
+    answer = wf_watcher.ask_daemon(
+        address, {'origin': 'sea', 'destination': 'den', 'date': day, 'top': 3}
+    )
+    assert answer['ok']
+    assert len(answer['fares']) == 3
+    assert len(qpx_server.requests_seen) == 6   #answered from cache
+
+    wf_watcher.ask_daemon(address, {'cmd': 'stop'})
+    runner.join(timeout=5)
+    assert not runner.is_alive()
+
+def test_fetch_trip_composed(local_weekendfare, capsys):
+    """round trips reuse cached one-ways and fetch only missing slices"""
+    wf, qpx_server = local_weekendfare
+    outbound, inbound = helper_queries(wf, ['DEN'], ['2017-01-13'])[0], wf.build_query(
+        [{'origin': 'DEN', 'destination': 'SEA', 'date': '2017-01-13'}],
+        solutions=20
+    )
+    wf.fetch_query(outbound)
+    round_trip = wf.build_query(
+        outbound['request']['slice'] + inbound['request']['slice'],
+        solutions=20
+    )
+
+    qpx_server.requests_seen = []
+    trip_options = wf.fetch_trip(round_trip)
+    assert [qpx_query['request']['slice'][0]['origin'] for qpx_query in qpx_server.requests_seen] == ['DEN']
+    assert trip_options and all(trip_option.composed for trip_option in trip_options)
+    assert all(len(trip_option.slices) == 2 for trip_option in trip_options)
+
+    qpx_server.requests_seen = []
+    assert wf.fetch_trip(round_trip)    #both one-ways cached now
+    assert qpx_server.requests_seen == []
+
+    wf.fetch_trip(round_trip, priced=True)
+    assert len(qpx_server.requests_seen[0]['request']['slice']) == 2
+
+    _, retcode = wf.WeekendFare.run(
+        [
+            'WeekendFare', '--config', qpx_server.config_path,
+            '-o', 'SEA', '-t', 'DEN', '-D', '2017-01-13', '-R', '2017-01-13', '--top', '1'
+        ],
+        exit=False
+    )
+    output = capsys.readouterr().out.strip().splitlines()
+    assert retcode == 0
+    assert output[-1].endswith('(separate one-way tickets)')
+    assert output[-1].count(' | ') == 1    #return slice listed (stub server answers SEA->DEN)
+
+def test_getaway_prunes(local_weekendfare, capsys):
+    """`getaway` skips routes whose past fares cannot get under the cap"""
+    wf, qpx_server = local_weekendfare
+    with open(path.join(HERE, 'demo_response.json'), 'r') as filehandle:
+        demo_response = json.load(filehandle)
+    den_shape = wf_request.shape_fingerprint(
+        wf_request.canonicalize(helper_queries(wf, ['DEN'], ['2017-01-13'])[0])
+    )
+    wf.get_history().record(wf.parse_response(demo_response), query_shape=den_shape)   #from USD206.80
+
+    _, retcode = wf.WeekendFare.run(
+        [
+            'WeekendFare', '--config', qpx_server.config_path,
+            'getaway', 'SEA', '-t', 'DEN,LAX', '-w', '1', '-m', '150'
+        ],
+        exit=False
+    )
+    output = capsys.readouterr().out.strip().splitlines()
+
+    assert retcode == 0
+    assert output == [
+        'no fares under the cap',
+        '-- 6 candidates: 3 queried, 0 from cache, 3 pruned --'
+    ]
+    assert all(
+        qpx_query['request']['slice'][0]['destination'] == 'LAX'
+        for qpx_query in qpx_server.requests_seen
+    )
+
+def test_sweep_bounds_match_query_shape(local_weekendfare):
+    """history bounds ignore fares quoted for other passengers or more slices"""
+    import weekendfare.fare_history as wf_history
+    wf, _ = local_weekendfare
+    with open(DEMO_RESPONSE_PATH, 'r') as filehandle:
+        trip_options = wf.parse_response(json.load(filehandle))
+    qpx_query = helper_queries(wf, ['DEN'], ['2017-01-13'])[0]
+    family_query = wf.build_query(
+        [{'origin': 'SEA', 'destination': 'DEN', 'date': '2017-01-13'}],
+        passengers={'adultCount': 2},
+        solutions=20
+    )
+    history = wf.get_history()
+    history.record(
+        trip_options,
+        query_shape=wf_request.shape_fingerprint(wf_request.canonicalize(family_query))
+    )
+    assert wf.sweep_candidates([qpx_query])[0].bound == 0   #nothing known
+
+    shape = wf_request.shape_fingerprint(wf_request.canonicalize(qpx_query))
+    round_trip_rows = wf_history.history_rows(trip_options[:1], 1000, query_shape=shape)
+    round_trip_rows[0].update(slices=2, price_cents=100)     #a round trip can't bound a one-way
+    history.insert(round_trip_rows)
+    history.record(trip_options, query_shape=shape)
+    candidate = wf.sweep_candidates([qpx_query])[0]
+    assert candidate.bound == wf.wf_sweep.estimate_bound([20680, 20680])
+
+def test_fetch_feeds_alerts(local_weekendfare):
+    """fresh responses (not cache hits) reach the alert engine"""
+    import weekendfare.alerts as wf_alerts
+    wf, _ = local_weekendfare
+    wf.QPX_ALERTS = wf_alerts.AlertEngine(max_price=21000)
+    qpx_query = helper_queries(wf, ['DEN'], ['2017-01-13'])[0]
+
+    wf.fetch_query(qpx_query)
+    wf.fetch_query(qpx_query)
+
+    shape = wf_request.shape_fingerprint(wf_request.canonicalize(qpx_query))
+    assert wf.QPX_ALERTS.route('SEA', 'DEN', '2017-01-13') is None     #kept under the query shape
+    state = wf.QPX_ALERTS.route('SEA', 'DEN', '2017-01-13', shape)
+    assert state.minimum == 20680
+    assert len(state.median) == 1
+    assert state.alerted == 20680
+
+def test_batch_lines(local_weekendfare):
+    """shorthand and full QPX lines validate, resolve cache-first, stream out in order"""
+    import io
+    import weekendfare.batch as wf_batch
+    wf, qpx_server = local_weekendfare
+    full_query = helper_queries(wf, ['DEN'], ['2017-01-13'])[0]
+    input_lines = [
+        {'id': 'a', 'origin': 'sea', 'destination': 'den', 'date': '2017-01-13'},
+        {'origin': 'SEA', 'destination': 'DENVER', 'date': '2017-01-13'},
+        {'origin': 'SEA', 'date': '2017-01-13'},
+        full_query,
+        {'origin': 123, 'destination': 'DEN', 'date': '2017-01-13'},
+        {'request': [1]}
+    ]
+    input_fh = io.BytesIO(b''.join(json.dumps(line).encode() + b'\n' for line in input_lines))
+
+    output = io.StringIO()
+    runner = wf_batch.BatchRunner(
+        wf.batch_query,
+        lambda qpx_query: wf.batch_resolve(qpx_query, top=2),
+        max_workers=2
+    )
+    stats = runner.run(input_fh, output)
+
+    results = [json.loads(line) for line in output.getvalue().splitlines()]
+    assert stats['ok'] == 2 and stats['invalid'] == 4
+    assert results[0]['id'] == 'a'
+    assert results[0]['destination'] == 'DEN'
+    assert len(results[0]['fares']) == 2
+    assert 'airport code' in results[1]['error']
+    assert results[2]['error'] == 'missing destination'
+    assert results[3]['fares'] == results[0]['fares']
+    assert results[4]['error'] == '"origin" must be str'   #bad types don't stop the run
+    assert results[5]['error'] == '"request" must be an object'
+    assert len(qpx_server.requests_seen) == 1   #same query: second one is a cache hit
+
+def test_fetch_parsed_pipeline(local_weekendfare):
+    """pipelined fetch + worker parsing matches fetch_batch + parse_response"""
+    import weekendfare.parse_pool as wf_parse_pool
+    wf, qpx_server = local_weekendfare
+    qpx_queries = helper_queries(wf, ['DEN', 'LAX'], ['2017-01-13', '2017-01-14'])
+    with open(DEMO_RESPONSE_PATH, 'rb') as demo_fh:
+        expected = wf.parse_response(demo_fh.read(), columnar=True)
+
+    wf.QPX_ALERTS = wf.wf_alerts.AlertEngine()
+    with wf_parse_pool.ParsePool(2) as parse_pool:
+        fresh = list(wf.fetch_parsed(qpx_queries, max_workers=4, parse_pool=parse_pool))
+        cached = list(wf.fetch_parsed(qpx_queries, max_workers=4, parse_pool=parse_pool))
+
+    assert len(qpx_server.requests_seen) == len(qpx_queries)    #second pass: all cache hits
+    assert len(wf.get_history()) == 20 * len(qpx_queries)      #misses recorded once, from workers
+    assert len(wf.QPX_ALERTS) == 2      #SEA->DEN 2017-01-13 answers, one per query shape
+    qpx_slices, qpx_filters = wf.wf_cache.split_query(qpx_queries[0])
+    with open(DEMO_RESPONSE_PATH, 'r') as demo_fh:
+        assert wf.try_cache(qpx_slices[0], qpx_filters) == json.load(demo_fh)
+    for results in (fresh, cached):
+        assert sorted(id(qpx_query) for qpx_query, _ in results) == \
+            sorted(id(qpx_query) for qpx_query in qpx_queries)
+        for _, table in results:
+            assert list(table.price_cents) == list(expected.price_cents)
+            assert table.row(0) == expected.row(0)
+
+def test_fetch_parsed_streams(local_weekendfare, monkeypatch):
+    """`fetch_table()` misses and hits are parsed by the streaming scanner, never decoded whole"""
+    import weekendfare.parse_pool as wf_parse_pool
+    import weekendfare.qpx_parser as wf_parser
+    wf, qpx_server = local_weekendfare
+    qpx_queries = helper_queries(wf, ['DEN'], ['2017-01-13', '2017-01-14'])
+    sources = []
+    iter_raw_trip_options = wf_parser.iter_raw_trip_options
+    def helper_iter_raw(source, *args, **kwargs):
+        sources.append(source)
+        return iter_raw_trip_options(source, *args, **kwargs)
+    def helper_decode(*args, **kwargs):
+        raise AssertionError('cache payload decoded whole')
+    monkeypatch.setattr(wf_parser, 'iter_raw_trip_options', helper_iter_raw)
+    monkeypatch.setattr(wf.wf_codec, 'decode', helper_decode)
+
+    parse_pool = wf_parse_pool.ParsePool(0)     #parse in this process, where the patches are
+    fresh = list(wf.fetch_parsed(qpx_queries, max_workers=2, parse_pool=parse_pool))
+    assert len(sources) == len(qpx_queries)
+    assert all(isinstance(source, bytes) for source in sources)    #raw reply bodies
+
+    del sources[:]
+    cached = list(wf.fetch_parsed(qpx_queries, max_workers=2, parse_pool=parse_pool))
+    assert len(qpx_server.requests_seen) == len(qpx_queries)
+    assert len(sources) == len(qpx_queries)
+    assert all(isinstance(source, wf.wf_codec.PayloadReader) for source in sources)   #off disk
+    for results in (fresh, cached):
+        for _, table in results:
+            assert len(table) == 20
+            assert table.row(0)['sale_total'] == 'USD206.80'
+
+def test_fetch_coalesced_across_processes(local_weekendfare):
+    """another process's identical in-flight query is waited on, then read from the shared cache"""
+    import subprocess
+    import sys
+    wf, qpx_server = local_weekendfare
+    qpx_server.delay = 0.5
+    qpx_query = helper_queries(wf, ['DEN'], ['2017-01-13'])[0]
+    script = (
+        'import json, sys\n'
+        'import weekendfare.WeekendFare as wf\n'
+        'wf.get_config(sys.argv[1])\n'
+        'print(len(wf.fetch_query(json.loads(sys.argv[2]))["trips"]["tripOption"]))\n'
+    )
+    other_process = subprocess.Popen(
+        [sys.executable, '-c', script, qpx_server.config_path, json.dumps(qpx_query)],
+        cwd=path.dirname(HERE),
+        stdout=subprocess.PIPE
+    )
+    deadline = time.time() + 10
+    while not qpx_server.requests_seen and time.time() < deadline:
+        time.sleep(0.01)     #other process holds the flight lock, its POST is out
+
+    qpx_response = wf.fetch_query(qpx_query)
+    output, _ = other_process.communicate(timeout=30)
+
+    assert output.strip() == b'20'
+    assert len(qpx_response['trips']['tripOption']) == 20
+    assert len(qpx_server.requests_seen) == 1
+    assert wf.get_flights().stats['rechecked'] == 1
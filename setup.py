@@ -79,12 +79,13 @@ setup(
     package_data={
         'weekendfare':[
             'weekendfare.cfg',
-            'qpx_query_template.json'   #TODO: move templates to data_files?
+            'qpx_query_template.json',  #TODO: move templates to data_files?
+            'watchlist.json',
+            'stub_template.json'
         ]
     },
     install_requires=[
         'requests==2.12.1',
-        'tinydb==3.2.1',
         'dataset==0.7.1',
         'plumbum==1.6.2',
         'jsonschema==2.5.1'
@@ -5,32 +5,78 @@ A CLI utility for checking last-minute prices on flights.
 """
 
 from datetime import datetime, timedelta
-from os import path
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from os import path, makedirs
 import logging
+import atexit
+import sys
 import json
+import time
 
 from plumbum import cli
-from tinydb import TinyDB, Query
-import dataset
-from jsonschema import validate
 
 import weekendfare.utilities as wf_utils
+import weekendfare.fare_cache as wf_cache
+import weekendfare.cache_codec as wf_codec
+import weekendfare.scheduler as wf_scheduler
+import weekendfare.qpx_parser as wf_parser
+import weekendfare.qpx_request as wf_request
+import weekendfare.singleflight as wf_singleflight
+import weekendfare.trip_planner as wf_planner
+import weekendfare.sweep_planner as wf_sweep
+import weekendfare.watcher as wf_watcher
+import weekendfare.alerts as wf_alerts
+import weekendfare.batch as wf_batch
+import weekendfare.parse_pool as wf_parse_pool
+import weekendfare.metrics as wf_metrics
+from weekendfare.fare_table import FareTable
+from weekendfare.models import format_qpx_time, cents_to_price
 
 HERE = path.abspath(path.dirname(__file__))
-ME = __file__.replace('.py', '')
+ME = path.basename(__file__).replace('.py', '')
 CONFIG_ABSPATH = path.join(HERE, 'weekendfare.cfg')
-config = wf_utils.get_config(CONFIG_ABSPATH)
 
 ## Null logger because `cli.Application` will trigger log setup
 ## Leaving NullHandler will make testing easier later "trust me" (tm)
-logger = logging.getLogger(ME).addHandler(logging.NullHandler())
+logger = logging.getLogger(ME)
+logger.addHandler(logging.NullHandler())
 
 DEBUG = False
-## script globals ##
-EARLY_TIME = config.get('WeekendFare', 'early_time')
-LATE_TIME = config.get('WeekendFare', 'late_time')
-REFUND = config.get('WeekendFare', 'refund')
-SOLUTIONS = config.get('WeekendFare','solutions')
+DEFAULT_WORKERS = 8
+WEEKEND_DAYS = (4, 5, 6)    #Fri/Sat/Sun, see `date.weekday()`
+DEFAULT_MIN_REFRESH = 300   #seconds, see `watch_refresh()`
+BATCH_FIELD_TYPES = (        #shorthand `batch` fields, see `batch_query()`
+    ('origin', str), ('destination', str), ('date', str), ('return', str),
+    ('passengers', dict), ('solutions', int), ('refundable', bool)
+)
+## script globals: loaded on first use, see `get_config()`/`get_cache()` ##
+config = None
+QPX_DB = None
+QPX_SESSION = None
+QPX_SCHEDULER = None
+QPX_FLIGHTS = None
+QPX_HISTORY = None
+QPX_ALERTS = None
+ALERT_LOG_PATH = None
+METRICS_PATH = None    #exported at exit, see `setup_metrics()`
+
+def get_config(config_abspath=None):
+    """load config on first use
+
+    Note:
+        startup cost matters under cron; `--help` should never parse config
+
+    Args:
+        config_abspath (str, optional): override path to config (reloads)
+
+    Returns:
+        (:obj:`configparser.ConfigParser`): global config object
+
+    """
+    global config
+    if config is None or config_abspath:
+        config = wf_utils.get_config(config_abspath or CONFIG_ABSPATH)
+    return config
 
 
 def build_logger(verbose=False):
@@ -46,116 +92,1167 @@ def build_logger(verbose=False):
     global logger
     logger = wf_utils.create_logger(
         ME,
-        config=config,
+        config=get_config(),
         log_to_stdout=verbose
         #TODO: log_level_override?
     )
     return logger
 
+def export_metrics(export_path=None):
+    """write `weekendfare.metrics` to `export_path`, with quota usage if QPX was used"""
+    export_path = export_path or METRICS_PATH
+    try:
+        if QPX_SCHEDULER is not None:
+            usage = QPX_SCHEDULER.usage()
+            wf_metrics.set_gauge('qpx_quota_used', usage['used'])
+            if usage['remaining'] is not None:
+                wf_metrics.set_gauge('qpx_quota_remaining', usage['remaining'])
+        wf_metrics.METRICS.export(export_path)
+    except Exception:
+        logger.error(
+            'EXCEPTION: unable to export metrics' +
+            '\r\texport_path=%s',
+            export_path,
+            exc_info=True
+        )
+
+def setup_metrics():
+    """apply `[LOGGING] metrics`/`metrics_path` config, export at exit
+
+    Note:
+        `metrics_path` ending in `.prom` is written as Prometheus text,
+        anything else as JSON; blank/missing skips the export.  A relative
+        `metrics_path` is taken from the working directory, like `log_path`
+
+    """
+    local_config = get_config()
+    wf_metrics.METRICS.enabled = local_config.getboolean('LOGGING', 'metrics', fallback=True)
+    metrics_path = local_config.get('LOGGING', 'metrics_path', fallback='').strip()
+    if not wf_metrics.METRICS.enabled or not metrics_path:
+        return
+    global METRICS_PATH
+    if METRICS_PATH is None:
+        atexit.register(export_metrics)
+    METRICS_PATH = path.abspath(metrics_path)   #pinned now: a later chdir must not move it
+
 def validate_airport(airport_abrev):
-    pass
+    """check airport/city code is a 3-letter IATA designator
+
+    Args:
+        airport_abrev (str): user-supplied airport code
+
+    Returns:
+        (str): cleaned-up (upper case) airport code
+
+    """
+    airport_abrev = airport_abrev.strip().upper()
+    if len(airport_abrev) != 3 or not airport_abrev.isalpha():
+        raise ValueError("Incorrect airport code, should be 3-letter IATA code")
 
-    #if valid:
-    #   return airport_abrev
-    #else:
-    #   raise TypeError('message')
+    return airport_abrev
 
 def validate_datetime(datetime_str):
+    """check date string is YYYY-MM-DD
+
+    Args:
+        datetime_str (str): user-supplied date
+
+    Returns:
+        (str): cleaned-up date string
+
+    """
+    datetime_str = datetime_str.strip()
     try:
         datetime.strptime(datetime_str, '%Y-%m-%d')
     except ValueError:
         raise ValueError("Incorrect data format, should be YYYY-MM-DD")
-    pass
-    """if datetime_str == datetime.strptime():
-        return self.date
-    else:
-        return "Bad date" """
-    #from datetime import datetime, timedelta
-    #look for strp/strftime.  Parse into datetime object, validate, return processed string
+
+    return datetime_str
+
+def weekend_dates(
+        weeks,
+        start_date=None,
+        weekdays=WEEKEND_DAYS
+):
+    """every weekend departure date for the next few weeks
+
+    Args:
+        weeks (int): number of weeks to look ahead
+        start_date (:obj:`datetime.date`, optional): first day to consider (default today)
+        weekdays (:obj:`tuple`, optional): `date.weekday()` values to keep
+
+    Returns:
+        (:obj:`list` str): YYYY-MM-DD dates in order
+
+    """
+    start_date = start_date or datetime.now().date()
+    return [
+        (start_date + timedelta(days=offset)).strftime('%Y-%m-%d')
+        for offset in range(weeks * 7)
+        if (start_date + timedelta(days=offset)).weekday() in weekdays
+    ]
+
+def build_query(
+        slices,
+        passengers=None,
+        solutions=None,
+        refundable=False
+):
+    """assemble QPX query dict from slices and filters
+
+    Args:
+        slices (:obj:`list` :obj:`dict`): origin/destination/date for each slice
+        passengers (:obj:`dict`, optional): QPX passenger counts (default 1 adult)
+        solutions (int, optional): number of solutions to ask for
+        refundable (bool, optional): refundable fares only
+
+    Returns:
+        (:obj:`dict`): QPX query (`{'request': {...}}`)
+
+    """
+    qpx_query = {'request': {}}
+    qpx_query['request']['slice'] = [dict(qpx_slice) for qpx_slice in slices]
+    qpx_query['request']['passengers'] = passengers or {'adultCount': 1}
+    if solutions:
+        qpx_query['request']['solutions'] = solutions
+    qpx_query['request']['refundable'] = refundable
+
+    return qpx_query
 
 def build_request(request_parameters):
     """function to build QPX request
 
+    Note:
+        validated against `qpx_query_template.json` by a validator compiled
+        once per process (see `qpx_request.validate()`)
+
     Args:
         request_parameters (:obj:`dict`): container with all the magic values in it
+            (QPX query, like `build_query()` output)
 
     Returns:
         (str): stringified request_parameters to match QPX template (https://qpx-express-demo.itasoftware.com/)
 
-    """
-    pass
+    Raises:
+        (:obj:`weekendfare.qpx_request.InvalidQuery`): every schema error found
 
-    #TOOLS: json.dumps(data, indent=2) https://docs.python.org/3.5/library/json.html
-    # Extra credit: validate against qpx_query_template with jsonschema (advanced)
+    """
+    return json.dumps(wf_request.validate(request_parameters), indent=2, sort_keys=True)
 
 def parse_response(
         response_data,
         price_filter=None,
-        #additional search criteria here
-        #don't worry, it can be ugly for now
+        columnar=False
+        #additional search criteria: see `FareTable.where()`
     ):
     """function to parse the response object for important info
 
+    Note:
+        raw/file-like responses are streamed one `tripOption` at a time;
+        `price_filter` stops parsing at the first option over the limit
+
     Args:
-        (:obj:`dict` json): data from QPX
+        (:obj:`dict` json, str, bytes or file-like): data from QPX
+        (float, optional): price_filter: max sale total (response currency)
+        (bool, optional): columnar: return a `FareTable` for batch filtering/ranking
 
     Returns:
-        (:obj:`dict`) flights worth knowing about
+        (:obj:`list` :obj:`weekendfare.models.TripOption` or :obj:`FareTable`)
+            flights worth knowing about, cheapest first
 
     """
-    pass
+    with wf_metrics.span('parse_response'):
+        trip_options = wf_parser.iter_trip_options(response_data, price_filter=price_filter)
+        if columnar:
+            trip_options = FareTable.from_trip_options(trip_options)
+        else:
+            trip_options = list(trip_options)
+    wf_metrics.incr('trip_options_parsed', len(trip_options))
+    return trip_options
+
+def get_cache():
+    """open the fare cache on first use
+
+    Returns:
+        (:obj:`weekendfare.fare_cache.FareCache`): global cache object
+
+    """
+    global QPX_DB
+    if QPX_DB is None:
+        local_config = get_config()
+        QPX_DB = wf_cache.FareCache(
+            path.join(HERE, local_config.get('WeekendFare', 'qpx_cache')),
+            ttl=local_config.getint(
+                'WeekendFare', 'cache_ttl', fallback=wf_cache.DEFAULT_TTL
+            ),
+            max_entries=local_config.getint(
+                'WeekendFare', 'cache_max_entries', fallback=wf_cache.DEFAULT_MAX_ENTRIES
+            ),
+            compression=local_config.getint(
+                'WeekendFare', 'cache_compression', fallback=wf_codec.DEFAULT_LEVEL
+            ),
+            logger=logger
+        )
+    return QPX_DB
+
+def get_session():
+    """build the pooled QPX HTTP session on first use
+
+    Note:
+        the session retries connection errors only: a POST that reached QPX
+        is retried by `send_query()`, which waits on the quota scheduler again
+
+    Returns:
+        (:obj:`requests.Session`): keep-alive session for `fetch_POST_request()`
+
+    """
+    global QPX_SESSION
+    if QPX_SESSION is None:
+        local_config = get_config()
+        QPX_SESSION = wf_utils.build_session(
+            pool_size=local_config.getint('QPX', 'pool_size', fallback=wf_utils.DEFAULT_POOL_SIZE),
+            retries=local_config.getint('QPX', 'retries', fallback=wf_utils.DEFAULT_RETRIES),
+            backoff=local_config.getfloat('QPX', 'backoff', fallback=wf_utils.DEFAULT_BACKOFF),
+            retry_methods=('GET',)
+        )
+    return QPX_SESSION
+
+def get_scheduler():
+    """build the QPX quota scheduler on first use
+
+    Returns:
+        (:obj:`weekendfare.scheduler.QuotaScheduler`): shared quota gatekeeper
+
+    """
+    global QPX_SCHEDULER
+    if QPX_SCHEDULER is None:
+        local_config = get_config()
+        QPX_SCHEDULER = wf_scheduler.QuotaScheduler(
+            path.join(HERE, local_config.get('QPX', 'quota_state', fallback='qpx_quota.json')),
+            local_config.getint('QPX', 'query_limit'),
+            rate=local_config.getfloat('QPX', 'query_rate', fallback=wf_scheduler.DEFAULT_RATE),
+            burst=local_config.getint('QPX', 'query_burst', fallback=wf_scheduler.DEFAULT_BURST),
+            interactive_reserve=local_config.getint(
+                'QPX', 'interactive_reserve', fallback=wf_scheduler.DEFAULT_RESERVE
+            ),
+            logger=logger
+        )
+    return QPX_SCHEDULER
+
+def get_flights():
+    """build the in-flight request coalescer on first use
+
+    Returns:
+        (:obj:`weekendfare.singleflight.SingleFlight`): shared by every `fetch_query()`
+
+    """
+    global QPX_FLIGHTS
+    if QPX_FLIGHTS is None:
+        local_config = get_config()
+        QPX_FLIGHTS = wf_singleflight.SingleFlight(
+            path.join(HERE, local_config.get('QPX', 'flight_locks', fallback='qpx_flights')),
+            logger=logger
+        )
+    return QPX_FLIGHTS
+
+def get_history():
+    """open the fare history database on first use
+
+    Note:
+        disabled (None) when `[WeekendFare] fare_history` is blank/missing
+
+    Returns:
+        (:obj:`weekendfare.fare_history.FareHistory` or None): global history object
+
+    """
+    global QPX_HISTORY
+    if QPX_HISTORY is None:
+        history_path = get_config().get('WeekendFare', 'fare_history', fallback='')
+        if not history_path:
+            return None
+        import weekendfare.fare_history as wf_history
+        QPX_HISTORY = wf_history.FareHistory(path.join(HERE, history_path), logger=logger)
+    return QPX_HISTORY
+
+def get_alerts():
+    """load the price-drop alert engine on first use
+
+    Note:
+        disabled (None) when `[Alerts] alert_state` is blank/missing.
+        Routes that already departed are dropped; state is saved at exit.
+        A relative `alert_log` is taken from the working directory, like
+        `log_path` and `metrics_path`
+
+    Returns:
+        (:obj:`weekendfare.alerts.AlertEngine` or None): global alert engine
+
+    """
+    global QPX_ALERTS, ALERT_LOG_PATH
+    if QPX_ALERTS is None:
+        local_config = get_config()
+        state_path = local_config.get('Alerts', 'alert_state', fallback='')
+        if not state_path:
+            return None
+        alert_log = local_config.get('Alerts', 'alert_log', fallback='').strip()
+        ALERT_LOG_PATH = path.abspath(alert_log) if alert_log else None
+        if ALERT_LOG_PATH:
+            makedirs(path.dirname(ALERT_LOG_PATH), exist_ok=True)
+        QPX_ALERTS = wf_alerts.AlertEngine(
+            path.join(HERE, state_path),
+            max_price=int(round(
+                local_config.getfloat('Alerts', 'max_price', fallback=0) * 100
+            )),
+            drop_pct=local_config.getfloat(
+                'Alerts', 'drop_pct', fallback=wf_alerts.DEFAULT_DROP_PCT
+            ),
+            top_k=local_config.getint('Alerts', 'top_k', fallback=wf_alerts.DEFAULT_TOP_K),
+            window=local_config.getint('Alerts', 'window', fallback=wf_alerts.DEFAULT_WINDOW),
+            logger=logger
+        )
+        QPX_ALERTS.expire(datetime.now().strftime('%Y-%m-%d'))
+        atexit.register(QPX_ALERTS.save)
+    return QPX_ALERTS
+
+def record_fares(
+        qpx_response,
+        query_fingerprint=None,
+        query_shape=None
+):
+    """add a fresh QPX response to the fare history and alert engine
+
+    Note:
+        the response is parsed once for both; each is best-effort:
+        failures are logged, never raised
+
+    Args:
+        (:obj:`dict`): qpx_response: data from QPX
+        (str, optional): query_fingerprint: `qpx_request.fingerprint()` of the query
+        (str, optional): query_shape: `qpx_request.shape_fingerprint()` of the query
+
+    Returns:
+        (:obj:`list` :obj:`weekendfare.alerts.Alert`): alerts fired
+
+    """
+    try:
+        history = get_history()
+        alert_engine = get_alerts()
+        if history is None and alert_engine is None:
+            return []
+        digest = wf_parse_pool.digest_options(
+            parse_response(qpx_response),
+            time.time(),
+            query_fingerprint=query_fingerprint,
+            query_shape=query_shape,
+            history=history is not None,
+            alerts=alert_engine is not None
+        )
+    except Exception:
+        logger.error(
+            'EXCEPTION: unable to parse response for fare history/alerts' +
+            '\r\tquery_fingerprint=%s',
+            query_fingerprint,
+            exc_info=True
+        )
+        return []
+    return record_digest(digest, query_fingerprint)
+
+def record_digest(digest, query_fingerprint=None):
+    """write one response's history rows and alert fares
+
+    Note:
+        best-effort like `record_fares()`; `digest` may come from a parse
+        worker (see `parse_pool.digest_response()`)
+
+    Args:
+        (:obj:`dict`): digest: `parse_pool.digest_options()` output
+        (str, optional): query_fingerprint: `qpx_request.fingerprint()` of the query
+
+    Returns:
+        (:obj:`list` :obj:`weekendfare.alerts.Alert`): alerts fired
+
+    """
+    history = get_history()
+    if history is not None and digest['history']:
+        try:
+            history.insert(digest['history'])
+        except Exception:
+            logger.error(
+                'EXCEPTION: unable to record fare history' +
+                '\r\tquery_fingerprint=%s',
+                query_fingerprint,
+                exc_info=True
+            )
+    alert_engine = get_alerts()
+    if alert_engine is None or not digest['fares']:
+        return []
+    try:
+        alerts = alert_engine.observe_fares(digest['fares'], digest['observed_at'])
+        for alert in alerts:
+            send_alert(alert)
+        return alerts
+    except Exception:
+        logger.error(
+            'EXCEPTION: unable to update fare alerts' +
+            '\r\tquery_fingerprint=%s',
+            query_fingerprint,
+            exc_info=True
+        )
+        return []
+
+def send_alert(alert):
+    """log a fired alert, append it to `[Alerts] alert_log` (JSONL)"""
+    logger.warning('fare alert: %s', alert)
+    wf_metrics.incr('fare_alerts', kind=alert.kind)
+    if ALERT_LOG_PATH:
+        with open(ALERT_LOG_PATH, 'a') as alert_fh:
+            alert_fh.write(json.dumps(alert.to_dict(), sort_keys=True) + '\n')
+
+def cache_ttl(departure_date, now=None):
+    """seconds a cached fare departing `departure_date` stays fresh
+
+    Note:
+        `[WeekendFare] cache_ttl_min` at departure, rising to `cache_ttl`
+        `cache_ttl_horizon` days out (see `fare_cache.adaptive_ttl()`)
+
+    Args:
+        departure_date (str): YYYY-MM-DD
+        now (float, optional): timestamp override (for testing)
+
+    Returns:
+        (int): seconds
+
+    """
+    local_config = get_config()
+    return wf_cache.adaptive_ttl(
+        departure_date,
+        now=now,
+        min_ttl=local_config.getint('WeekendFare', 'cache_ttl_min', fallback=wf_cache.DEFAULT_MIN_TTL),
+        max_ttl=local_config.getint('WeekendFare', 'cache_ttl', fallback=wf_cache.DEFAULT_TTL),
+        horizon_days=local_config.getfloat(
+            'WeekendFare', 'cache_ttl_horizon', fallback=wf_cache.DEFAULT_TTL_HORIZON
+        )
+    )
+
+def stale_queries(now=None):
+    """cached queries due for a refresh, soonest departure first
+
+    Note:
+        departed queries are dropped from the registry; evicted responses
+        count as stale
+
+    Args:
+        now (float, optional): timestamp override (for testing)
+
+    Returns:
+        (:obj:`list` :obj:`dict`): QPX queries to re-fetch
+
+    """
+    now = now or time.time()
+    cache = get_cache()
+    today = time.strftime('%Y-%m-%d', time.gmtime(now))
+    stale = []
+    for key, qpx_query in cache.queries():
+        departure_date = wf_cache.query_departure(qpx_query)
+        if departure_date and departure_date < today:
+            cache.forget_query(key, now)
+            continue
+        stored_at = cache.stored_at(key)
+        if stored_at is None or now - stored_at > cache_ttl(departure_date, now):
+            stale.append((departure_date or '', stored_at or 0, qpx_query))
+    stale.sort(key=lambda item: item[:2])
+    return [qpx_query for _, _, qpx_query in stale]
 
-QPX_CACHE = path.join(HERE, config.get('WeekendFare', 'qpx_cache'))
-QPX_DB = TinyDB(QPX_CACHE)
 def try_cache(
         qpx_query_slice,
         qpx_query_filters=None
 ):
-    """check the tinyDB cache for value
+    """check the fare cache for value
 
-    Note: only checks first slice (single slice tester)
+    Note: only checks first slice (single slice tester); freshness
+        depends on how soon it departs (see `cache_ttl()`).  Entries other
+        processes wrote are seen (the cache catches up on its log first),
+        which is what makes it a valid `SingleFlight` recheck
 
     Args:
         (:obj:`dict`): qpx_query_slice
+        (:obj:`dict`, optional): qpx_query_filters: passengers/refundable/solutions
 
     Returns:
-        (:obj:`dict` or None): value in tinydb
+        (:obj:`dict` or None): cached QPX response
 
     """
-    c_query = Query()
-
-    record = QPX_DB.search(
-        c_query.origin == qpx_query_slice['origin'] & \
-        c_query.destination == qpx_query_slice['destination'] & \
-        c_query.date == qpx_query_slice['date']
-    )
-
-    #TODO: add qpx_query_filters for better offline/cache behavior
+    with wf_metrics.span('cache_lookup'):
+        key = wf_cache.cache_key(qpx_query_slice, qpx_query_filters)
+        record = get_cache().get(key, ttl=cache_ttl(qpx_query_slice.get('date')))
 
     if record:
-        logger.debug('--record found')
-        logger.debug(record)
+        wf_metrics.incr('cache_lookups', result='hit')
+        logger.debug('--record found: %s', key)
         return record
 
     else:
+        wf_metrics.incr('cache_lookups', result='miss')
         return None
 
 
+def send_query(qpx_query, priority=wf_scheduler.PRIORITY_INTERACTIVE):
+    """POST one query to QPX, every attempt paid for through the quota scheduler
+
+    Note:
+        replies in `RETRY_STATUS_CODES` (429/5xx) are retried up to `[QPX]
+        retries` times, backing off (or honoring `Retry-After`) in between.
+        Each attempt `acquire()`s its own quota: a retried send counts.
+        Quota waits and backoff happen outside the flight lock (see
+        `SingleFlight.unlocked()`), so a background query stuck on quota
+        never holds up interactive ones sharing its lock stripe
+
+    Args:
+        qpx_query (:obj:`dict`): canonical, validated QPX query
+        priority (int, optional): scheduler class (see `weekendfare.scheduler`)
+
+    Returns:
+        (:obj:`requests.request`): 200 reply
+
+    Raises:
+        (:obj:`weekendfare.utilities.BadStatusCode`): bad status, retries used up
+
+    """
+    local_config = get_config()
+    retries = local_config.getint('QPX', 'retries', fallback=wf_utils.DEFAULT_RETRIES)
+    backoff = local_config.getfloat('QPX', 'backoff', fallback=wf_utils.DEFAULT_BACKOFF)
+    attempt = 0
+    while True:
+        with wf_metrics.span('quota_wait', priority=priority):
+            try:
+                get_scheduler().acquire(priority, timeout=0)   #budget free: keep the lock
+            except wf_scheduler.QuotaExceeded:
+                get_flights().unlocked(lambda: get_scheduler().acquire(priority))
+        wf_metrics.incr('qpx_queries', priority=priority)
+        try:
+            return wf_utils.fetch_POST_request(
+                local_config.get('QPX', 'base_url') + '/search',
+                qpx_query,
+                params={'key': local_config.get('QPX', 'api_key')},
+                logger=logger,
+                session=get_session(),
+                timeout=local_config.getfloat('QPX', 'timeout', fallback=wf_utils.DEFAULT_TIMEOUT)
+            )
+        except wf_utils.BadStatusCode as err_msg:
+            if attempt >= retries or err_msg.status_code not in wf_utils.RETRY_STATUS_CODES:
+                raise
+            delay = err_msg.retry_after
+            if delay is None:
+                delay = backoff * 2 ** attempt
+            attempt += 1
+            wf_metrics.incr('qpx_retries', status=err_msg.status_code)
+            logger.warning(
+                'QPX replied %s, retry %s/%s in %.1fs',
+                err_msg.status_code, attempt, retries, delay
+            )
+            get_flights().unlocked(lambda: time.sleep(delay))
+
 def fetch_query(
         qpx_query,
-        debug=DEBUG
+        debug=DEBUG,
+        priority=wf_scheduler.PRIORITY_INTERACTIVE
 ):
     """Fetch data from qpx and return in normal format
 
+    Note:
+        cache misses wait on the quota scheduler before hitting QPX; the
+        canonical form of `qpx_query` is what gets sent (and cached).
+        Identical queries already in flight (this or another local process)
+        are waited on instead of sent again
+
     Args:
         (:obj:`dict` json): QPX-validated query for fetching
         (bool, optional): debug mode: run in headless mode
+        (int, optional): priority: scheduler class (see `weekendfare.scheduler`)
 
     Returns:
         (:obj:`dict`): QPX response (or cached version)
 
     """
-    pass
+    qpx_query = wf_request.canonicalize(qpx_query)
+    qpx_slices, qpx_filters = wf_cache.split_query(qpx_query)
+    single_slice = len(qpx_slices) == 1
+    if single_slice:
+        record = try_cache(qpx_slices[0], qpx_filters)
+        if record:
+            return record
+
+    if debug:
+        logger.warning('DEBUG: cache miss, not hitting QPX API')
+        return None
+
+    qpx_query = wf_request.validate(qpx_query, canonical=True)  #never pay for a bad query
+    query_fingerprint = wf_request.fingerprint(qpx_query, canonical=True)
+    def post_query():
+        request = send_query(qpx_query, priority)
+        qpx_response = request.json()
+
+        if single_slice:
+            get_cache().put(
+                wf_cache.cache_key(qpx_slices[0], qpx_filters),
+                qpx_response,
+                query=qpx_query
+            )
+        record_fares(qpx_response, query_fingerprint, wf_request.shape_fingerprint(qpx_query))
+        return qpx_response
+
+    return get_flights().do(
+        query_fingerprint,
+        post_query,
+        recheck=(lambda: try_cache(qpx_slices[0], qpx_filters)) if single_slice else None
+    )
+
+def fetch_batch(
+        qpx_queries,
+        max_workers=DEFAULT_WORKERS,
+        debug=DEBUG,
+        priority=wf_scheduler.PRIORITY_BACKGROUND
+):
+    """fetch many QPX queries concurrently, cache first
+
+    Note:
+        cache hits are yielded immediately; misses are fetched by a bounded
+        thread pool sharing one keep-alive session and yielded as they complete.
+        Queries with the same fingerprint (see `qpx_request.py`) are fetched once
+
+    Args:
+        qpx_queries (:obj:`list` :obj:`dict`): QPX queries to run
+        max_workers (int, optional): concurrent requests in flight
+        debug (bool, optional): debug mode: never hit the API
+        priority (int, optional): scheduler class, sweeps queue behind the CLI
+
+    Yields:
+        (:obj:`dict`, :obj:`dict`): qpx_query, QPX response (None on failure)
+
+    """
+    get_cache()     #warm shared objects before threads race for them
+    if not debug:
+        get_session()
+        get_scheduler()
+        get_flights()
+        get_history()
+
+    pending = {}    #fingerprint: [qpx_query, ...] sharing one fetch
+    for qpx_query in qpx_queries:
+        query_fingerprint = wf_request.fingerprint(qpx_query)
+        if query_fingerprint in pending:
+            pending[query_fingerprint].append(qpx_query)
+            continue
+        qpx_slices, qpx_filters = wf_cache.split_query(qpx_query)
+        record = None
+        if len(qpx_slices) == 1:
+            record = try_cache(qpx_slices[0], qpx_filters)
+        if record:
+            yield qpx_query, record
+        else:
+            pending[query_fingerprint] = [qpx_query]
+
+    if not pending:
+        return
+    logger.info(
+        'fetching %s queries (%s duplicates), max_workers=%s',
+        len(pending),
+        sum(len(duplicates) - 1 for duplicates in pending.values()),
+        max_workers
+    )
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(fetch_query, duplicates[0], debug, priority): duplicates
+            for duplicates in pending.values()
+        }
+        for future in as_completed(futures):
+            duplicates = futures[future]
+            try:
+                qpx_response = future.result()
+            except Exception:
+                logger.error(
+                    'EXCEPTION: batch query failed' +
+                    '\r\tqpx_query=%s',
+                    duplicates[0],
+                    exc_info=True
+                )
+                qpx_response = None
+            for qpx_query in duplicates:
+                yield qpx_query, qpx_response
+
+def fetch_table(
+        qpx_query,
+        parse_pool,
+        debug=DEBUG,
+        priority=wf_scheduler.PRIORITY_BACKGROUND
+):
+    """cached payload, or freshly fetched and parsed table, for a query
+
+    Note:
+        cache hits come back as stored (compressed, references not
+        restored) for the caller to hand to `parse_pool`; without worker
+        processes they come back as a `FareCache.open()` reader instead, so
+        the parse streams straight off disk.  On a miss the raw
+        reply goes to `parse_pool` as is: the worker builds the table, cache
+        payload, history rows and alert fares from one parse, and this
+        thread only writes them out.  The flight is held until the cache is
+        filled, so coalesced callers (and other processes) never fetch twice
+
+    Args:
+        qpx_query (:obj:`dict`): QPX query
+        parse_pool (:obj:`weekendfare.parse_pool.ParsePool`): started parse pool
+        debug (bool, optional): debug mode: never hit the API
+        priority (int, optional): scheduler class
+
+    Returns:
+        (str, :obj:`object`) or None: (`payload`, bytes or reader for `ParsePool.submit()`),
+            (`table`, `FareTable.pack()` output), or None if not available
+
+    """
+    qpx_query = wf_request.canonicalize(qpx_query)
+    qpx_slices, qpx_filters = wf_cache.split_query(qpx_query)
+    single_slice = len(qpx_slices) == 1
+    def lookup():
+        key = wf_cache.cache_key(qpx_slices[0], qpx_filters)
+        ttl = cache_ttl(qpx_slices[0].get('date'))
+        with wf_metrics.span('cache_lookup'):
+            if parse_pool.processes:
+                payload = get_cache().get_payload(key, ttl=ttl)
+            else:
+                payload = get_cache().open(key, ttl=ttl)
+        wf_metrics.incr('cache_lookups', result='miss' if payload is None else 'hit')
+        return None if payload is None else ('payload', payload)
+
+    if single_slice:
+        cached = lookup()
+        if cached:
+            return cached
+    if debug:
+        logger.warning('DEBUG: cache miss, not hitting QPX API')
+        return None
+
+    qpx_query = wf_request.validate(qpx_query, canonical=True)  #never pay for a bad query
+    query_fingerprint = wf_request.fingerprint(qpx_query, canonical=True)
+    def post_query():
+        content = send_query(qpx_query, priority).content
+        cache = get_cache()
+        digest = parse_pool.submit_fresh(
+            content,
+            time.time(),
+            level=cache.compression if single_slice else None,
+            query_fingerprint=query_fingerprint,
+            query_shape=wf_request.shape_fingerprint(qpx_query),
+            history=get_history() is not None,
+            alerts=get_alerts() is not None
+        ).result()
+        if single_slice:
+            cache.put_payload(
+                wf_cache.cache_key(qpx_slices[0], qpx_filters),
+                digest['payload'],
+                query=qpx_query,
+                references=digest['references']
+            )
+        record_digest(digest, query_fingerprint)
+        return 'table', digest['table']
+
+    return get_flights().do(
+        'table:' + query_fingerprint,   #`fetch_query()` callers want the response itself
+        post_query,
+        recheck=lookup if single_slice else None,
+        lock_key=query_fingerprint
+    )
+
+def fetch_parsed(
+        qpx_queries,
+        max_workers=DEFAULT_WORKERS,
+        parse_pool=None,
+        debug=DEBUG,
+        priority=wf_scheduler.PRIORITY_BACKGROUND
+):
+    """fetch many queries on threads while other processes parse the responses
+
+    Note:
+        a pipeline: each payload goes to `parse_pool` as soon as its fetch
+        (or cache read) finishes, so network waits and parsing overlap; see
+        `fetch_table()`.  Tables come back without `TripOption` objects
+        (columns only)
+
+    Args:
+        qpx_queries (:obj:`list` :obj:`dict`): QPX queries to run
+        max_workers (int, optional): concurrent fetches
+        parse_pool (:obj:`weekendfare.parse_pool.ParsePool`, optional): started
+            parse pool (default: one worker per core)
+        debug (bool, optional): debug mode: never hit the API
+        priority (int, optional): scheduler class
+
+    Yields:
+        (:obj:`dict`, :obj:`weekendfare.fare_table.FareTable`): qpx_query, parsed
+            response (None on failure), in completion order
+
+    """
+    own_pool = parse_pool is None
+    if own_pool:
+        parse_pool = wf_parse_pool.ParsePool()
+    parse_pool.start()      #fork before any fetch thread exists
+    get_cache()
+    if not debug:
+        get_session()
+        get_scheduler()
+        get_flights()
+        get_history()
+        get_alerts()
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            stages = {
+                executor.submit(fetch_table, qpx_query, parse_pool, debug, priority):
+                    ('fetch', qpx_query)
+                for qpx_query in qpx_queries
+            }
+            pending = set(stages)
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage, qpx_query = stages.pop(future)
+                    try:
+                        if stage == 'fetch':
+                            fetched = future.result()
+                            if fetched is None:
+                                yield qpx_query, None
+                                continue
+                            kind, result = fetched
+                            if kind == 'payload':
+                                parse_future = parse_pool.submit(result)
+                                stages[parse_future] = ('parse', qpx_query)
+                                pending.add(parse_future)
+                                continue
+                            table = FareTable.unpack(result)
+                        else:
+                            table = parse_pool.table(future)
+                        wf_metrics.incr('trip_options_parsed', len(table))
+                        yield qpx_query, table
+                    except Exception:
+                        logger.error(
+                            'EXCEPTION: pipelined query failed' +
+                            '\r\tstage=%s' +
+                            '\r\tqpx_query=%s',
+                            stage,
+                            qpx_query,
+                            exc_info=True
+                        )
+                        yield qpx_query, None
+    finally:
+        if own_pool:
+            parse_pool.close()
+
+def fetch_trip(
+        qpx_query,
+        priced=False,
+        limit=None,
+        debug=DEBUG,
+        priority=wf_scheduler.PRIORITY_INTERACTIVE
+):
+    """trip options for any query, multi-slice ones built from one-ways
+
+    Note:
+        multi-slice queries are split per slice: cached one-ways are reused,
+        only missing slices are fetched, and the results are combined into
+        `TripOption.composed` options (separate tickets, not QPX round-trip
+        pricing).  `priced` sends the whole query to QPX instead
+
+    Args:
+        qpx_query (:obj:`dict`): QPX query
+        priced (bool, optional): true QPX pricing for multi-slice queries
+        limit (int, optional): most composed options to return
+        debug (bool, optional): debug mode: never hit the API
+        priority (int, optional): scheduler class (see `weekendfare.scheduler`)
+
+    Returns:
+        (:obj:`list` :obj:`weekendfare.models.TripOption`): trip options, cheapest first
+
+    """
+    qpx_query = wf_request.canonicalize(qpx_query)
+    per_slice_queries = wf_planner.slice_queries(qpx_query)
+    if priced or len(per_slice_queries) < 2:
+        return parse_response(fetch_query(qpx_query, debug=debug, priority=priority) or {})
+
+    responses = {}
+    for slice_query, qpx_response in fetch_batch(
+            per_slice_queries,
+            max_workers=len(per_slice_queries),
+            debug=debug,
+            priority=priority
+    ):
+        responses[id(slice_query)] = qpx_response
+    per_slice_options = []
+    for slice_query in per_slice_queries:
+        if not responses.get(id(slice_query)):
+            logger.warning(
+                'no one-way fares, cannot compose trip' +
+                '\r\tslice=%s',
+                slice_query['request']['slice'][0]
+            )
+            return []
+        per_slice_options.append(parse_response(responses[id(slice_query)]))
+
+    return wf_planner.compose_trip_options(per_slice_options, limit=limit)
+
+def describe_trip(fare_table, index):
+    """`FareTable.describe()` plus later slices and the composed flag, for CLI output"""
+    line = fare_table.describe(index)
+    if not fare_table.keep_options:
+        return line
+    trip_option = fare_table.trip_option(index)
+    for qpx_slice in trip_option.slices[1:]:
+        line += ' | {0}->{1} {2}'.format(
+            qpx_slice.origin,
+            qpx_slice.destination,
+            format_qpx_time(qpx_slice.departure, qpx_slice.first_leg.departure_offset)[:16].replace('T', ' ')
+        )
+    if trip_option.composed:
+        line += ' (separate one-way tickets)'
+    return line
+
+def cheapest_cents(qpx_response, fare_filter=None):
+    """lowest price in a QPX response, after `fare_filter`
+
+    Args:
+        qpx_response (:obj:`dict`): data from QPX (None: no fares)
+        fare_filter (callable, optional): `FareTable` -> row indices (e.g. `WeekendFare.filter_rows`)
+
+    Returns:
+        (int or None): price in cents
+
+    """
+    if not qpx_response:
+        return None
+    fare_table = parse_response(qpx_response, columnar=True)
+    rows = fare_filter(fare_table) if fare_filter else None
+    top = fare_table.top(1, rows)
+    return fare_table.price_cents[top[0]] if top else None
+
+def sweep_candidates(
+        qpx_queries,
+        fare_filter=None,
+        margin=wf_sweep.DEFAULT_MARGIN
+):
+    """branch-and-bound candidates for single-slice queries
+
+    Note:
+        fresh cache entries give an exact price; otherwise the fare history
+        (same date, then any weekend date on the route) gives a discounted
+        estimate, see `sweep_planner.estimate_bound()`.  Only one-way fares
+        quoted for the same query shape (passengers, refundable...) count
+
+    Args:
+        qpx_queries (:obj:`list` :obj:`dict`): single-slice QPX queries
+        fare_filter (callable, optional): `FareTable` -> row indices
+        margin (float, optional): discount on history estimates
+
+    Returns:
+        (:obj:`list` :obj:`weekendfare.sweep_planner.Candidate`): one per query
+
+    """
+    history = get_history()
+    route_estimates = {}
+    candidates = []
+    for qpx_query in qpx_queries:
+        qpx_slices, qpx_filters = wf_cache.split_query(qpx_query)
+        qpx_slice = qpx_slices[0]
+        key = (qpx_slice['origin'], qpx_slice['destination'], qpx_slice['date'])
+        candidate = wf_sweep.Candidate(key, qpx_query)
+        record = try_cache(qpx_slice, qpx_filters)
+        if record:
+            candidate.price = cheapest_cents(record, fare_filter)
+            if candidate.price is not None:
+                candidates.append(candidate)
+                continue
+        if history is not None:
+            shape = wf_request.shape_fingerprint(wf_request.canonicalize(qpx_query))
+            same_day = history.cheapest(
+                key[0], key[1], departs_from=key[2], departs_until=key[2], slices=1, shape=shape
+            )
+            if shape not in route_estimates:    #shape covers the route, not the date
+                route = history.cheapest(
+                    key[0], key[1], weekdays=WEEKEND_DAYS, slices=1, shape=shape
+                )
+                route_estimates[shape] = route[0]['price_cents'] if route else None
+            candidate.bound = wf_sweep.estimate_bound(
+                [same_day[0]['price_cents'] if same_day else None, route_estimates[shape]],
+                margin=margin
+            )
+        candidates.append(candidate)
+    return candidates
+
+def watch_queries(entry, today=None):
+    """QPX queries covering a watch entry's date window (departed dates skipped)
+
+    Args:
+        entry (:obj:`weekendfare.watcher.WatchEntry`): routes/date window
+        today (:obj:`datetime.date`, optional): date override (for testing)
+
+    Returns:
+        (:obj:`list` :obj:`dict`): one single-slice QPX query per route/date
+
+    """
+    local_config = get_config()
+    today = today or datetime.now().date()
+    if entry.weeks:
+        dates = weekend_dates(entry.weeks, start_date=today)
+    else:
+        first = max(datetime.strptime(entry.date_from, '%Y-%m-%d').date(), today)
+        last = datetime.strptime(entry.date_until, '%Y-%m-%d').date()
+        dates = [
+            (first + timedelta(days=offset)).strftime('%Y-%m-%d')
+            for offset in range((last - first).days + 1)
+        ]
+    return [
+        build_query(
+            [{'origin': entry.origin, 'destination': destination, 'date': date}],
+            solutions=local_config.getint('WeekendFare', 'solutions'),
+            refundable=local_config.getboolean('WeekendFare', 'refund')
+        )
+        for destination in entry.destinations
+        for date in dates
+    ]
+
+def watch_refresh(entry, now=None):
+    """bring a watch entry's fares up to date
+
+    Note:
+        fresh cache entries cost nothing; the next refresh is due when the
+        soonest departure's fare goes stale (see `cache_ttl()`), but never
+        sooner than the entry's `every` (or `[Watch] min_refresh`)
+
+    Args:
+        entry (:obj:`weekendfare.watcher.WatchEntry`): routes/date window
+        now (float, optional): timestamp override (for testing)
+
+    Returns:
+        (float): seconds until the next refresh
+
+    """
+    local_config = get_config()
+    min_refresh = entry.every or local_config.getint(
+        'Watch', 'min_refresh', fallback=DEFAULT_MIN_REFRESH
+    )
+    qpx_queries = watch_queries(entry)
+    if not qpx_queries:     #window is over: check back tomorrow
+        return 24 * 60 * 60
+    failed = 0
+    for _, qpx_response in fetch_batch(
+            qpx_queries,
+            local_config.getint('QPX', 'max_workers', fallback=DEFAULT_WORKERS),
+            debug=DEBUG
+    ):
+        if qpx_response is None:
+            failed += 1
+    logger.info('watch: refreshed %s (%s queries, %s failed)', entry, len(qpx_queries), failed)
+    return max(min_refresh, min(
+        cache_ttl(wf_cache.query_departure(qpx_query), now) for qpx_query in qpx_queries
+    ))
+
+def watch_answer(request):
+    """answer an ad-hoc watch socket query from the warm cache/session
+
+    Args:
+        request (:obj:`dict`): `origin`, `destination`, `date`, optional
+            `return` (YYYY-MM-DD) and `top` (fares to return, default 5)
+
+    Returns:
+        (:obj:`dict`): `fares`: trip options as dicts, cheapest first
+
+    """
+    local_config = get_config()
+    origin = validate_airport(request['origin'])
+    destination = validate_airport(request['destination'])
+    slices = [{'origin': origin, 'destination': destination, 'date': validate_datetime(request['date'])}]
+    if request.get('return'):
+        slices.append({
+            'origin': destination, 'destination': origin,
+            'date': validate_datetime(request['return'])
+        })
+    qpx_query = build_query(
+        slices,
+        solutions=local_config.getint('WeekendFare', 'solutions'),
+        refundable=local_config.getboolean('WeekendFare', 'refund')
+    )
+    if len(slices) > 1:
+        trip_options = fetch_trip(qpx_query, debug=DEBUG)
+    else:
+        trip_options = parse_response(fetch_query(qpx_query, debug=DEBUG) or {})
+    return {'fares': [trip_option.to_dict() for trip_option in trip_options[:int(request.get('top', 5))]]}
+
+def batch_query(item):
+    """QPX query for one `batch` input line
+
+    Note:
+        a line is either a full QPX query (`{"request": {...}}`) or shorthand:
+        `origin`, `destination`, `date`, optional `return`, `passengers`
+        (QPX counts), `solutions` and `refundable`
+
+    Args:
+        item (:obj:`dict`): parsed input line
+
+    Returns:
+        (:obj:`dict`): validated QPX query
+
+    Raises:
+        (:obj:`ValueError`): missing fields, bad codes/dates, or schema errors
+
+    """
+    if 'request' in item:
+        if not isinstance(item['request'], dict):
+            raise ValueError('"request" must be an object')
+        return wf_request.validate({'request': item['request']})
+    missing = [key for key in ('origin', 'destination', 'date') if not item.get(key)]
+    if missing:
+        raise ValueError('missing {0}'.format(', '.join(missing)))
+    for key, expected in BATCH_FIELD_TYPES:
+        if item.get(key) is not None and not isinstance(item[key], expected):
+            raise ValueError('"{0}" must be {1}'.format(key, expected.__name__))
+    local_config = get_config()
+    origin = validate_airport(item['origin'])
+    destination = validate_airport(item['destination'])
+    slices = [{'origin': origin, 'destination': destination, 'date': validate_datetime(item['date'])}]
+    if item.get('return'):
+        slices.append({
+            'origin': destination, 'destination': origin,
+            'date': validate_datetime(item['return'])
+        })
+    return wf_request.validate(build_query(
+        slices,
+        passengers=item.get('passengers'),
+        solutions=item.get('solutions') or local_config.getint('WeekendFare', 'solutions'),
+        refundable=bool(item.get('refundable', local_config.getboolean('WeekendFare', 'refund')))
+    ))
+
+def batch_resolve(qpx_query, top=None):
+    """fares for one `batch` query, cache first
+
+    Args:
+        qpx_query (:obj:`dict`): `batch_query()` output
+        top (int, optional): fares to return (default all)
+
+    Returns:
+        (:obj:`dict`): first slice `origin`/`destination`/`date`, `fares` cheapest first
+
+    Raises:
+        (:obj:`LookupError`): not cached in debug mode
+
+    """
+    qpx_response = fetch_query(qpx_query, debug=DEBUG, priority=wf_scheduler.PRIORITY_BACKGROUND)
+    if qpx_response is None:
+        raise LookupError('not cached (debug mode)')
+    trip_options = parse_response(qpx_response)
+    if top:
+        trip_options = trip_options[:top]
+    qpx_slice = qpx_query['request']['slice'][0]
+    return {
+        'origin': qpx_slice['origin'],
+        'destination': qpx_slice['destination'],
+        'date': qpx_slice['date'],
+        'fares': [trip_option.to_dict() for trip_option in trip_options]
+    }
 
 class WeekendFare(cli.Application):
     """Plumbum CLI application: WeekendFare"""
@@ -175,7 +1272,16 @@ class WeekendFare(cli.Application):
         help='enable verbose logging'
     )
 
-    #TODO: add query @cli.switch() calls
+    config_path = cli.SwitchAttr(
+        ['--config'],
+        str,
+        help='alternate config file (defaults to weekendfare.cfg)'
+    )
+
+    # -- query switches (prompted for when missing)
+    origin = cli.SwitchAttr(['-o', '--origin'], str, help='Origin airport code')
+    destination = cli.SwitchAttr(['-t', '--to'], str, help='Destination airport code')
+    date = cli.SwitchAttr(['-D', '--date'], str, help='Day of flight (YYYY-MM-DD)')
 
     # -- times to fly between (optional)
 
@@ -187,19 +1293,26 @@ class WeekendFare(cli.Application):
     pas_senior = cli.CountOf(["-s", "--senior"], help = "Senior ticket")
     # -- airline (optional)
     # -- round-trip?
-    def roundtrip(home):
-        if True:
-            return_date = "2016-12-11"
-            early_return_time = "06:00"
-            late_return_time = "22:00"
-        else:
-            return
+    return_date = cli.SwitchAttr(
+        ['-R', '--return'],
+        str,
+        help='Day of return flight (YYYY-MM-DD); combines cached one-ways unless --priced'
+    )
+    priced = cli.Flag(
+        ['--priced'],
+        help='Ask QPX to price round trips as one ticket instead of combining one-ways'
+    )
     # -- direct flight
     nonstop = cli.Flag(
         ["-n", "--nonstop"],
         help='Nonstop flight',
     )
-    layover_wait = 60
+    layover_wait = cli.SwitchAttr(
+        ['-L', '--layover'],
+        int,
+        help='Longest acceptable layover (minutes)'
+    )
+    top = cli.SwitchAttr(['--top'], int, default=5, help='Number of fares to show')
     # -- refundable? (cli.Flag)
     refund = cli.Flag(
         ['-r', '--refund'],
@@ -216,41 +1329,442 @@ class WeekendFare(cli.Application):
         global DEBUG
         if self.debug:
             DEBUG = self.debug
+        local_config = get_config(self.config_path)
         build_logger(self.verbose)
+        setup_metrics()
         logger.debug('hello world')
+        if self.nested_command:
+            return
         # -- start city
-        start = cli.terminal.readline("Origin Airport code:") #make sure is 3-digit str()
-        start.replace('\n', '')
+        start = self.origin or cli.terminal.readline("Origin Airport code:")
         start = validate_airport(start)
         # -- destination city
-        dest = cli.terminal.readline("End Airport code:") #make sure is 3-digit  str()
-        dest.replace('\n', '')
+        dest = self.destination or cli.terminal.readline("End Airport code:")
         dest = validate_airport(dest)
         # -- travel date(s)
-        date = cli.terminal.readline("Day of flight (YYYY-MM-DD):")
-        date.replace('\n', '')
+        date = self.date or cli.terminal.readline("Day of flight (YYYY-MM-DD):")
         date = validate_datetime(date)
 
 
-        qpx_query = {}
-        qpx_query['request'] = {}
-        qpx_query['request']['slice'] = [] #[slice1, slice2, slice3]
-        slice_data = {
-            'origin': start,
-            'destination': dest,
-            'date': date
-        }
-        qpx_query['request']['slice'].append(slice_data)
-        qpx_query['request']['pasengers'] = {
+        slices = [{'origin': start, 'destination': dest, 'date': date}]
+        if self.return_date:
+            return_date = validate_datetime(self.return_date)
+            if return_date < date:
+                raise ValueError("Return date is before departure")
+            slices.append({'origin': dest, 'destination': start, 'date': return_date})
+
+        qpx_query = build_query(
+            slices,
+            passengers=self.passengers(),
+            solutions=local_config.getint('WeekendFare', 'solutions'),
+            refundable=local_config.getboolean('WeekendFare', 'refund')
+        )
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(json.dumps(qpx_query, indent=2))
+
+        if len(slices) > 1:
+            fare_table = FareTable.from_trip_options(
+                fetch_trip(qpx_query, priced=self.priced, debug=DEBUG)
+            )
+        else:
+            fare_table = parse_response(fetch_query(qpx_query, debug=DEBUG) or {}, columnar=True)
+        logger.info('found %s trip options', len(fare_table))
+        for index in fare_table.top(self.top, self.filter_rows(fare_table)):
+            print(describe_trip(fare_table, index))
+
+    def filter_rows(self, fare_table):
+        """rows of `fare_table` matching config time window and CLI filters"""
+        local_config = get_config()
+        return fare_table.where(
+            depart_after=local_config.get('WeekendFare', 'early_time'),
+            depart_before=local_config.get('WeekendFare', 'late_time'),
+            nonstop=self.nonstop,
+            max_layover=self.layover_wait,
+            refundable=True if self.refund else None
+        )
+
+    def passengers(self):
+        """QPX passenger counts from switches (1 adult if none given)"""
+        passengers = {
             'adultCount': self.pas_adult,
             'infantInLapCount': self.pas_infant_lap,
-            'incantInSeatCount': self.pas_infant_seat,
+            'infantInSeatCount': self.pas_infant_seat,
             'childCount': self.pas_child,
             'seniorCount': self.pas_senior
         }
-        qpx_query['request']['solutions'] = SOLUTIONS #fixme, make default if not loaded
-        qpx_query['request']['refundable'] = REFUND #fixme, make default if not loaded
-        logger.debug(json.dumps(qpx_query, indent=2))
+        if not any(passengers.values()):
+            passengers['adultCount'] = 1
+        return passengers
+
+@WeekendFare.subcommand('sweep')
+class WeekendFareSweep(cli.Application):
+    """Fetch every weekend departure for a set of routes concurrently"""
+    destinations = cli.SwitchAttr(
+        ['-t', '--to'],
+        str,
+        mandatory=True,
+        help='Comma-separated destination airport codes'
+    )
+    weeks = cli.SwitchAttr(['-w', '--weeks'], int, default=8, help='Weeks to look ahead')
+    workers = cli.SwitchAttr(
+        ['-j', '--workers'],
+        int,
+        help='Concurrent requests (defaults to [QPX] max_workers)'
+    )
+    best = cli.SwitchAttr(
+        ['-b', '--best'],
+        int,
+        default=0,
+        help='After the sweep, show the N best fares across all routes/dates'
+    )
+    parse_processes = cli.SwitchAttr(
+        ['-P', '--parse-procs'],
+        int,
+        help='Parse responses in N worker processes (defaults to [QPX] parse_processes, 0: in this process)'
+    )
+
+    def main(self, origin):
+        """sweep `origin` -> each destination for every Fri/Sat/Sun"""
+        local_config = get_config()
+        origin = validate_airport(origin)
+        destinations = [validate_airport(dest) for dest in self.destinations.split(',')]
+        qpx_queries = [
+            build_query(
+                [{'origin': origin, 'destination': dest, 'date': date}],
+                passengers=self.parent.passengers(),
+                solutions=local_config.getint('WeekendFare', 'solutions'),
+                refundable=self.parent.refund or local_config.getboolean('WeekendFare', 'refund')
+            )
+            for dest in destinations
+            for date in weekend_dates(self.weeks)
+        ]
+        max_workers = self.workers or local_config.getint(
+            'QPX', 'max_workers', fallback=DEFAULT_WORKERS
+        )
+
+        parse_processes = self.parse_processes
+        if parse_processes is None:
+            parse_processes = local_config.getint('QPX', 'parse_processes', fallback=0)
+
+        fare_table = FareTable(keep_options=False)
+        with wf_parse_pool.ParsePool(parse_processes) as parse_pool:
+            for qpx_query, response_table in fetch_parsed(
+                    qpx_queries, max_workers, parse_pool, debug=DEBUG
+            ):
+                sale_total = None
+                if response_table:
+                    sale_total = response_table.row(response_table.top(1)[0])['sale_total']
+                    fare_table.merge(response_table)
+                self.report(qpx_query, sale_total)
+
+        if self.best:
+            print('-- best {0} of {1} fares --'.format(self.best, len(fare_table)))
+            for index in fare_table.top(self.best, self.parent.filter_rows(fare_table)):
+                print(fare_table.describe(index))
+
+    @staticmethod
+    def report(qpx_query, sale_total):
+        """one progress line per route/date"""
+        qpx_slice = qpx_query['request']['slice'][0]
+        print('{0} -> {1} {2}: {3}'.format(
+            qpx_slice['origin'],
+            qpx_slice['destination'],
+            qpx_slice['date'],
+            sale_total or 'no fares'
+        ))
+
+@WeekendFare.subcommand('getaway')
+class WeekendFareGetaway(cli.Application):
+    """Cheapest weekend fares across routes/dates, skipping queries that cannot win"""
+    destinations = cli.SwitchAttr(
+        ['-t', '--to'],
+        str,
+        mandatory=True,
+        help='Comma-separated destination airport codes'
+    )
+    weeks = cli.SwitchAttr(['-w', '--weeks'], int, default=8, help='Weeks to look ahead')
+    max_price = cli.SwitchAttr(['-m', '--max-price'], float, help='Price cap (e.g. 250)')
+    best = cli.SwitchAttr(['-b', '--best'], int, default=1, help='Number of fares to find')
+    workers = cli.SwitchAttr(
+        ['-j', '--workers'],
+        int,
+        default=1,
+        help='Candidates fetched at once (more is faster, may spend more queries)'
+    )
+
+    def main(self, origin):
+        """branch-and-bound over `origin` -> each destination for every Fri/Sat/Sun"""
+        local_config = get_config()
+        origin = validate_airport(origin)
+        destinations = [validate_airport(dest) for dest in self.destinations.split(',')]
+        qpx_queries = [
+            build_query(
+                [{'origin': origin, 'destination': dest, 'date': date}],
+                passengers=self.parent.passengers(),
+                solutions=local_config.getint('WeekendFare', 'solutions'),
+                refundable=self.parent.refund or local_config.getboolean('WeekendFare', 'refund')
+            )
+            for dest in destinations
+            for date in weekend_dates(self.weeks)
+        ]
+        fare_filter = self.parent.filter_rows
+        candidates = sweep_candidates(
+            qpx_queries,
+            fare_filter=fare_filter,
+            margin=local_config.getfloat('WeekendFare', 'bound_margin', fallback=wf_sweep.DEFAULT_MARGIN)
+        )
+
+        def fetch_prices(batch):
+            by_query = {id(candidate.query): candidate for candidate in batch}
+            for qpx_query, qpx_response in fetch_batch(
+                    [candidate.query for candidate in batch],
+                    max_workers=self.workers,
+                    debug=DEBUG
+            ):
+                yield by_query[id(qpx_query)], cheapest_cents(qpx_response, fare_filter)
+
+        result = wf_sweep.branch_and_bound(
+            candidates,
+            fetch_prices,
+            best_count=self.best,
+            price_cap=None if self.max_price is None else int(round(self.max_price * 100)),
+            batch_size=self.workers,
+            logger=logger
+        )
+        for candidate in result.best:
+            print('{0} -> {1} {2}: {3}'.format(
+                candidate.key[0], candidate.key[1], candidate.key[2],
+                '{0}.{1:02d}'.format(*divmod(candidate.price, 100))
+            ))
+        if not result.best:
+            print('no fares under the cap')
+        print('-- {0} candidates: {1} queried, {2} from cache, {3} pruned --'.format(
+            len(candidates), result.fetched, result.known, result.pruned
+        ))
+
+@WeekendFare.subcommand('refresh')
+class WeekendFareRefresh(cli.Application):
+    """Re-fetch cached fares that have gone stale, soonest departure first"""
+    limit = cli.SwitchAttr(
+        ['-n', '--limit'],
+        int,
+        help='Most queries to send (defaults to budget left after interactive_reserve)'
+    )
+    workers = cli.SwitchAttr(
+        ['-j', '--workers'],
+        int,
+        help='Concurrent requests (defaults to [QPX] max_workers)'
+    )
+    dry_run = cli.Flag(['--dry-run'], help='List stale queries without fetching')
+
+    def main(self):
+        """refresh stale entries within today's background budget"""
+        local_config = get_config()
+        qpx_queries = stale_queries()
+        limit = self.limit
+        if limit is None and not (DEBUG or self.dry_run):
+            scheduler = get_scheduler()
+            remaining = scheduler.usage()['remaining']
+            if remaining is not None:
+                limit = max(0, remaining - scheduler.interactive_reserve)
+        selected = qpx_queries if limit is None else qpx_queries[:limit]
+        print('{0} stale, refreshing {1}'.format(len(qpx_queries), len(selected)))
+
+        if self.dry_run:
+            for qpx_query in selected:
+                print(' '.join(
+                    '{origin}->{destination} {date}'.format(**qpx_slice)
+                    for qpx_slice in qpx_query['request']['slice']
+                ))
+            return
+
+        max_workers = self.workers or local_config.getint(
+            'QPX', 'max_workers', fallback=DEFAULT_WORKERS
+        )
+        failed = 0
+        for _, qpx_response in fetch_batch(selected, max_workers, debug=DEBUG):
+            if qpx_response is None:
+                failed += 1
+        if failed:
+            print('{0} refreshes failed, see log'.format(failed))
+
+@WeekendFare.subcommand('watch')
+class WeekendFareWatch(cli.Application):
+    """Keep a watchlist fresh and answer queries over a local socket (daemon)"""
+    watchlist = cli.SwitchAttr(
+        ['-w', '--watchlist'],
+        str,
+        help='Watchlist JSON (defaults to [Watch] watchlist)'
+    )
+    port = cli.SwitchAttr(
+        ['-p', '--port'],
+        int,
+        help='Local port for ad-hoc queries (defaults to [Watch] port, 0 picks one)'
+    )
+
+    def main(self):
+        """load watchlist, warm shared objects, serve until stopped"""
+        local_config = get_config()
+        entries = wf_watcher.load_watchlist(path.join(
+            HERE, self.watchlist or local_config.get('Watch', 'watchlist', fallback='watchlist.json')
+        ))
+        get_cache()     #everything a one-shot run rebuilds stays resident
+        wf_request.get_validator()
+        if not DEBUG:
+            get_session()
+            get_scheduler()
+            get_flights()
+            get_history()
+
+        daemon = wf_watcher.WatchDaemon(
+            watch_refresh,
+            watch_answer,
+            address=(
+                '127.0.0.1',
+                self.port if self.port is not None else local_config.getint(
+                    'Watch', 'port', fallback=wf_watcher.DEFAULT_PORT
+                )
+            ),
+            tick=local_config.getfloat('Watch', 'tick', fallback=wf_watcher.DEFAULT_TICK),
+            logger=logger
+        )
+        for entry in entries:
+            daemon.watch(entry)
+        host, port = daemon.start()
+        print('watching {0} entries, queries on {1}:{2}'.format(len(entries), host, port))
+        try:
+            daemon.run()
+        except KeyboardInterrupt:
+            daemon.stop()
+        finally:
+            daemon.close()
+
+@WeekendFare.subcommand('batch')
+class WeekendFareBatch(cli.Application):
+    """Stream JSONL queries from a file (or stdin) to JSONL fares on stdout"""
+    checkpoint_path = cli.SwitchAttr(
+        ['-c', '--checkpoint'],
+        str,
+        help='Progress file (defaults to <input>.checkpoint; needed with stdin)'
+    )
+    resume = cli.Flag(['--resume'], help='Continue after the last checkpointed line')
+    workers = cli.SwitchAttr(
+        ['-j', '--workers'],
+        int,
+        help='Concurrent requests (defaults to [QPX] max_workers)'
+    )
+    best = cli.SwitchAttr(['-b', '--best'], int, default=0, help='Fares per result (0: all)')
+
+    def main(self, requests_path='-'):
+        """one result line per query line, in input order"""
+        local_config = get_config()
+        checkpoint_path = self.checkpoint_path
+        if not checkpoint_path and requests_path != '-':
+            checkpoint_path = requests_path + '.checkpoint'
+        if self.resume and not checkpoint_path:
+            print('--resume needs --checkpoint when reading stdin')
+            return 1
+
+        get_cache()     #warm shared objects before threads race for them
+        wf_request.get_validator()
+        if not DEBUG:
+            get_session()
+            get_scheduler()
+            get_flights()
+            get_history()
+        runner = wf_batch.BatchRunner(
+            batch_query,
+            lambda qpx_query: batch_resolve(qpx_query, self.best),
+            max_workers=self.workers or local_config.getint(
+                'QPX', 'max_workers', fallback=DEFAULT_WORKERS
+            ),
+            checkpoint=wf_batch.Checkpoint(
+                checkpoint_path,
+                requests_path if requests_path == '-' else path.abspath(requests_path)
+            ) if checkpoint_path else None,
+            logger=logger
+        )
+        if requests_path == '-':
+            stats = runner.run(sys.stdin.buffer, sys.stdout, resume=self.resume)
+        else:
+            with open(requests_path, 'rb') as requests_fh:
+                stats = runner.run(requests_fh, sys.stdout, resume=self.resume)
+        return 1 if stats['invalid'] or stats['failed'] else 0
+
+@WeekendFare.subcommand('alerts')
+class WeekendFareAlerts(cli.Application):
+    """Current fare, rolling median and cheapest options per watched route/date"""
+    destination = cli.SwitchAttr(['-t', '--to'], str, help='Destination airport code')
+    best = cli.SwitchAttr(['-b', '--best'], int, default=3, help='Cheapest options to show')
+
+    def main(self, origin=None):
+        """route/date state kept by the alert engine, soonest departure first"""
+        alert_engine = get_alerts()
+        if alert_engine is None:
+            print('fare alerts disabled: set [Alerts] alert_state')
+            return 1
+        origin = validate_airport(origin) if origin else None
+        destination = validate_airport(self.destination) if self.destination else None
+        for key in sorted(alert_engine.routes, key=lambda key: (key[2], key[0], key[1])):
+            if (origin and key[0] != origin) or (destination and key[1] != destination):
+                continue
+            state = alert_engine.routes[key]
+            median = state.median.median()
+            print('{0}->{1} {2} {3} (median {4} over {5}) query {6:.8}'.format(
+                key[0],
+                key[1],
+                key[2],
+                cents_to_price(state.minimum, state.currency),
+                cents_to_price(int(round(median)), state.currency),
+                len(state.median),
+                key[3] or '-'
+            ))
+            for price_cents, _, flights in state.top[:self.best]:
+                print('\t{0} {1}'.format(cents_to_price(price_cents, state.currency), flights))
+
+@WeekendFare.subcommand('history')
+class WeekendFareHistory(cli.Application):
+    """Cheapest fares and price trends from the local fare history"""
+    destination = cli.SwitchAttr(['-t', '--to'], str, help='Destination airport code')
+    days = cli.SwitchAttr(['--days'], int, default=30, help='Only fares seen in the last N days')
+    flights = cli.SwitchAttr(
+        ['-f', '--flights'],
+        str,
+        help='Price trend of one itinerary, like UA294 or AS330,UA294'
+    )
+    best = cli.SwitchAttr(['-b', '--best'], int, default=5, help='Number of fares to show')
+    all_days = cli.Flag(['--all-days'], help='Any departure day, not just Fri/Sat/Sun')
+
+    def main(self, origin=None):
+        """cheapest `origin` -> `--to` fares, or `--flights` price trend"""
+        history = get_history()
+        if history is None:
+            print('fare history disabled: set [WeekendFare] fare_history')
+            return 1
+        since = datetime.now().timestamp() - self.days * 86400
+
+        if self.flights:
+            for row in history.price_trend(self.flights, since=since):
+                print('{0} {1} {2}'.format(
+                    datetime.fromtimestamp(row['observed_at']).strftime('%Y-%m-%d %H:%M'),
+                    row['departure_date'],
+                    row['sale_total']
+                ))
+            return
+
+        if not origin or not self.destination:
+            print('origin and --to are required without --flights')
+            return 1
+        rows = history.cheapest(
+            validate_airport(origin),
+            validate_airport(self.destination),
+            since=since,
+            weekdays=None if self.all_days else WEEKEND_DAYS,
+            limit=self.best
+        )
+        for row in rows:
+            print('{sale_total} {origin}->{destination} {departure_date} {departure_time} '
+                  '{stops} stop(s) {flights}'.format(**row))
 
 
 if __name__ == '__main__':
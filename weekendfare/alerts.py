@@ -0,0 +1,471 @@
+"""alerts.py
+
+Incremental price-drop alerts per (route, departure dates, query shape)
+
+-- Fed parsed trip options as responses arrive; history is never rescanned
+-- One-ways, round trips and other passenger mixes are tracked apart: each
+   response is observed under the shape of the query that asked for it
+-- Per route/date: current minimum, rolling median of recent minimums,
+   top-k cheapest options of the latest response (bounded heap)
+-- Threshold (`max_price`) and percentage-drop (`drop_pct`) alerts
+-- State saved as JSON (atomic replace) and reloaded at start
+
+"""
+from collections import deque
+from os import path, replace
+import threading
+import bisect
+import heapq
+import json
+import time
+
+import weekendfare.utilities as wf_utils
+from weekendfare.models import cents_to_price
+
+STATE_VERSION = 2       #2: keys carry every slice date and the query scope
+DEFAULT_TOP_K = 5
+DEFAULT_WINDOW = 20     #observations in the rolling median
+DEFAULT_DROP_PCT = 0.2
+MIN_SAMPLES = 3         #observations needed before a drop alert can fire
+REARM_MARGIN = 0.05     #minimum must rebound this far above an alerted price to alert again
+SAVE_INTERVAL = 60      #seconds between state saves while observing
+
+def route_key(trip_option, scope=''):
+    """(origin, destination, local departure dates, scope) of a trip option
+
+    Note:
+        origin/destination come from the first slice; dates lists every
+        slice's local departure date, like `2017-01-13` or `2017-01-13/2017-01-15`
+
+    Args:
+        trip_option (:obj:`weekendfare.models.TripOption`): parsed option
+        scope (str, optional): query the option answers, see `AlertEngine.observe()`
+
+    """
+    first_slice = trip_option.slices[0]
+    dates = []
+    for qpx_slice in trip_option.slices:
+        first_leg = qpx_slice.first_leg
+        local_departure = time.gmtime(first_leg.departure + first_leg.departure_offset * 60)
+        dates.append(time.strftime('%Y-%m-%d', local_departure))
+    return (
+        first_slice.origin,
+        first_slice.destination,
+        '/'.join(dates),
+        scope
+    )
+
+def option_summary(trip_option):
+    """[price_cents, id, flights]: what the top-k keeps of a trip option"""
+    return [
+        trip_option.price_cents,
+        trip_option.id,
+        ','.join(flight for qpx_slice in trip_option.slices for flight in qpx_slice.flights)
+    ]
+
+def fare_entries(trip_options, scope=''):
+    """what `AlertEngine.observe_fares()` needs of each trip option
+
+    Note:
+        plain tuples and strings: cheap to send back from a parse worker
+
+    Args:
+        trip_options (:obj:`list` :obj:`weekendfare.models.TripOption`): one response
+        scope (str, optional): query the response answers, see `AlertEngine.observe()`
+
+    Returns:
+        (:obj:`list` :obj:`tuple`): (`route_key()`, currency, `option_summary()`) per option
+
+    """
+    return [
+        (route_key(trip_option, scope), trip_option.currency, option_summary(trip_option))
+        for trip_option in trip_options
+        if trip_option.slices
+    ]
+
+class RollingMedian(object):
+    """median of the last `size` values
+
+    Note:
+        a deque keeps arrival order and a sorted list answers the median;
+        `bisect` finds positions in O(log n), the list shift is O(n) on a
+        window of a few dozen values
+
+    Args:
+        size (int): values kept
+        values (:obj:`list`, optional): oldest-first values to start from
+
+    """
+    def __init__(self, size, values=()):
+        self.size = size
+        self._window = deque()
+        self._sorted = []
+        for value in values:
+            self.push(value)
+
+    def __len__(self):
+        return len(self._window)
+
+    def push(self, value):
+        """add `value`, dropping the oldest once full"""
+        if len(self._window) == self.size:
+            oldest = self._window.popleft()
+            del self._sorted[bisect.bisect_left(self._sorted, oldest)]
+        self._window.append(value)
+        bisect.insort(self._sorted, value)
+
+    def median(self):
+        """middle value (mean of the middle two), None when empty"""
+        count = len(self._sorted)
+        if not count:
+            return None
+        middle = count // 2
+        if count % 2:
+            return self._sorted[middle]
+        return (self._sorted[middle - 1] + self._sorted[middle]) / 2
+
+    def values(self):
+        """oldest-first values, for saving"""
+        return list(self._window)
+
+class RouteState(object):
+    """what the engine remembers about one `route_key()`
+
+    Args:
+        window (int): observations in the rolling median
+        minimum (int, optional): cheapest fare of the latest observation, cents
+        currency (str, optional): currency of `minimum`
+        history (:obj:`list` int, optional): oldest-first recent minimums
+        top (:obj:`list`, optional): cheapest `option_summary()`s of the latest observation
+        alerted (int, optional): lowest price alerted on since the fare last rebounded
+        updated (float, optional): epoch of the latest observation
+
+    """
+    __slots__ = ('minimum', 'currency', 'median', 'top', 'alerted', 'updated')
+
+    def __init__(
+            self,
+            window,
+            minimum=None,
+            currency=None,
+            history=(),
+            top=None,
+            alerted=None,
+            updated=None
+    ):
+        self.minimum = minimum
+        self.currency = currency
+        self.median = RollingMedian(window, history)
+        self.top = top or []
+        self.alerted = alerted
+        self.updated = updated
+
+    def to_dict(self):
+        return {
+            'minimum': self.minimum,
+            'currency': self.currency,
+            'history': self.median.values(),
+            'top': self.top,
+            'alerted': self.alerted,
+            'updated': self.updated
+        }
+
+class Alert(object):
+    """one fired alert
+
+    Args:
+        kind (str): `threshold` (at/under `max_price`) or `drop` (under the rolling median)
+        route (:obj:`tuple`): `route_key()` of the fare
+        price_cents (int): fare that fired the alert
+        currency (str): currency of `price_cents`
+        baseline_cents (float or None): rolling median before this observation
+        previous_cents (int or None): minimum of the previous observation
+        trip_option (:obj:`list`): `option_summary()` of the fare
+        observed_at (float): epoch of the observation
+
+    """
+    __slots__ = (
+        'kind', 'route', 'price_cents', 'currency', 'baseline_cents', 'previous_cents',
+        'trip_option', 'observed_at'
+    )
+
+    def __init__(
+            self,
+            kind,
+            route,
+            price_cents,
+            currency,
+            baseline_cents,
+            previous_cents,
+            trip_option,
+            observed_at
+    ):
+        self.kind = kind
+        self.route = route
+        self.price_cents = price_cents
+        self.currency = currency
+        self.baseline_cents = baseline_cents
+        self.previous_cents = previous_cents
+        self.trip_option = trip_option
+        self.observed_at = observed_at
+
+    @property
+    def drop_pct(self):
+        """how far under the rolling median, None without one"""
+        if not self.baseline_cents:
+            return None
+        return 1 - self.price_cents / self.baseline_cents
+
+    def to_dict(self):
+        origin, destination, departure_date, _ = self.route
+        return {
+            'kind': self.kind,
+            'origin': origin,
+            'destination': destination,
+            'departure_date': departure_date,
+            'price_cents': self.price_cents,
+            'sale_total': cents_to_price(self.price_cents, self.currency),
+            'baseline_cents': self.baseline_cents,
+            'previous_cents': self.previous_cents,
+            'flights': self.trip_option[2],
+            'trip_id': self.trip_option[1],
+            'observed_at': self.observed_at
+        }
+
+    def __str__(self):
+        origin, destination, departure_date, _ = self.route
+        message = '{0} {1}->{2} {3} {4} ({5})'.format(
+            self.kind.upper(),
+            origin,
+            destination,
+            departure_date,
+            cents_to_price(self.price_cents, self.currency),
+            self.trip_option[2]
+        )
+        if self.drop_pct is not None:
+            message += ' {0:.0%} under median {1}'.format(
+                self.drop_pct,
+                cents_to_price(int(round(self.baseline_cents)), self.currency)
+            )
+        return message
+
+class AlertEngine(object):
+    """incremental per-route fare state and the alerts it fires
+
+    Note:
+        each `observe()`d response is one observation per route/date it
+        covers.  Every option costs O(log k): a push/replace on the top-k
+        max-heap plus O(1) checks against the threshold and the median of
+        earlier observations.  At most one alert (the cheapest qualifying
+        fare) fires per route/date per observation, and not again until
+        the minimum rebounds `REARM_MARGIN` above the alerted price
+
+    Args:
+        state_path (str, optional): JSON state file abspath > relpath (None: memory only)
+        max_price (int, optional): alert at/under this many cents (0: off)
+        drop_pct (float, optional): alert this far under the rolling median (0: off)
+        top_k (int, optional): cheapest options kept per route/date
+        window (int, optional): observations in the rolling median
+        save_interval (float, optional): seconds between saves while observing
+        logger (:obj:`logging.Logger`, optional): logger for tracking engine
+
+    """
+    def __init__(
+            self,
+            state_path=None,
+            max_price=0,
+            drop_pct=DEFAULT_DROP_PCT,
+            top_k=DEFAULT_TOP_K,
+            window=DEFAULT_WINDOW,
+            save_interval=SAVE_INTERVAL,
+            logger=wf_utils.DEFAULT_LOGGER
+    ):
+        self.state_path = state_path
+        self.max_price = max_price
+        self.drop_pct = drop_pct
+        self.top_k = top_k
+        self.window = window
+        self.save_interval = save_interval
+        self.logger = logger
+        self.routes = {}
+        self._dirty = False
+        self._saved_at = time.time()
+        self._lock = threading.Lock()
+        self.load()
+
+    def __len__(self):
+        return len(self.routes)
+
+    def load(self):
+        """read saved state (a missing or unreadable file starts empty)"""
+        self.routes = {}
+        if not self.state_path or not path.isfile(self.state_path):
+            return
+        try:
+            with open(self.state_path, 'r') as filehandle:
+                state = json.load(filehandle)
+        except ValueError:
+            self.logger.warning(
+                'Unable to parse alert state, resetting' +
+                '\r\tstate_path=%s',
+                self.state_path
+            )
+            return
+        if state.get('version') != STATE_VERSION:
+            return
+        for key, route in state.get('routes', {}).items():
+            self.routes[tuple(key.split('|'))] = RouteState(self.window, **route)
+
+    def save(self, force=False):
+        """write state (atomic replace) if anything changed
+
+        Returns:
+            (bool): state written
+
+        """
+        if not self.state_path:
+            return False
+        with self._lock:
+            if not (self._dirty or force):
+                return False
+            state = {
+                'version': STATE_VERSION,
+                'routes': {'|'.join(key): route.to_dict() for key, route in self.routes.items()}
+            }
+            self._dirty = False
+            self._saved_at = time.time()
+        tmp_path = self.state_path + '.tmp'
+        with open(tmp_path, 'w') as filehandle:
+            json.dump(state, filehandle)
+        replace(tmp_path, self.state_path)
+        return True
+
+    def expire(self, today):
+        """forget routes departing before `today` (YYYY-MM-DD)
+
+        Returns:
+            (int): routes dropped
+
+        """
+        with self._lock:
+            expired = [key for key in self.routes if key[2].split('/')[0] < today]
+            for key in expired:
+                del self.routes[key]
+            if expired:
+                self._dirty = True
+        return len(expired)
+
+    def _check(self, state, price_cents, baseline):
+        """alert kind a fare of `price_cents` qualifies for, if any"""
+        if state.alerted is not None and price_cents >= state.alerted:
+            return None
+        if self.max_price and price_cents <= self.max_price:
+            return 'threshold'
+        if (
+                self.drop_pct and baseline is not None and
+                price_cents <= baseline * (1 - self.drop_pct)
+        ):
+            return 'drop'
+        return None
+
+    def _observe_route(self, key, fares, observed_at):
+        """fold one route/date's (currency, `option_summary()`) fares into its state"""
+        state = self.routes.get(key)
+        if state is None:
+            state = self.routes[key] = RouteState(self.window)
+        baseline = state.median.median() if len(state.median) >= MIN_SAMPLES else None
+
+        top = []    #max-heap of the k cheapest: (-price, -order, summary)
+        cheapest = None
+        candidate = None
+        for order, (currency, summary) in enumerate(fares):
+            price_cents = summary[0]
+            entry = (-price_cents, -order, summary)
+            if len(top) < self.top_k:
+                heapq.heappush(top, entry)
+            elif entry > top[0]:
+                heapq.heapreplace(top, entry)
+            if cheapest is None or price_cents < cheapest[1][0]:
+                cheapest = (currency, summary)
+                kind = self._check(state, price_cents, baseline)
+                if kind:
+                    candidate = (kind, currency, summary)
+
+        alert = None
+        if candidate:
+            kind, currency, summary = candidate
+            alert = Alert(
+                kind,
+                key,
+                summary[0],
+                currency,
+                baseline,
+                state.minimum,
+                summary,
+                observed_at
+            )
+            state.alerted = summary[0]
+        elif (
+                state.alerted is not None and
+                cheapest[1][0] > state.alerted * (1 + REARM_MARGIN)
+        ):
+            state.alerted = None
+
+        state.currency, summary = cheapest
+        state.minimum = summary[0]
+        state.median.push(summary[0])
+        state.top = [entry[2] for entry in sorted(top, reverse=True)]
+        state.updated = observed_at
+        return alert
+
+    def observe(self, trip_options, observed_at=None, scope=''):
+        """fold one parsed response into route state, fire alerts
+
+        Note:
+            fares only compare within one `scope`: pass something that
+            tells queries apart beyond route and dates (passengers,
+            refundable...), like `qpx_request.shape_fingerprint()`
+
+        Args:
+            trip_options (:obj:`list` :obj:`weekendfare.models.TripOption`): `parse_response()` output
+            observed_at (float, optional): quote time (default now)
+            scope (str, optional): query the response answers
+
+        Returns:
+            (:obj:`list` :obj:`Alert`): alerts fired, at most one per route/date
+
+        """
+        return self.observe_fares(fare_entries(trip_options, scope), observed_at)
+
+    def observe_fares(self, fares, observed_at=None):
+        """`observe()` one response already reduced by `fare_entries()`
+
+        Args:
+            fares (:obj:`list` :obj:`tuple`): `fare_entries()` output
+            observed_at (float, optional): quote time (default now)
+
+        Returns:
+            (:obj:`list` :obj:`Alert`): alerts fired, at most one per route/date
+
+        """
+        observed_at = observed_at or time.time()
+        by_route = {}
+        for key, currency, summary in fares:
+            by_route.setdefault(tuple(key), []).append((currency, summary))
+
+        alerts = []
+        with self._lock:
+            for key, route_fares in by_route.items():
+                alert = self._observe_route(key, route_fares, observed_at)
+                if alert:
+                    alerts.append(alert)
+            if by_route:
+                self._dirty = True
+            save_due = time.time() - self._saved_at >= self.save_interval
+        if save_due:
+            self.save()
+        return alerts
+
+    def route(self, origin, destination, departure_date, scope=''):
+        """state of one route/date(s), None if never observed"""
+        return self.routes.get((origin.upper(), destination.upper(), departure_date, scope))
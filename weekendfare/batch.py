@@ -0,0 +1,240 @@
+"""batch.py
+
+Streaming JSONL batch runner with checkpoint/resume
+
+-- One request per input line (file or stdin), one result per output line
+-- Bounded window of requests in flight on a thread pool; results come
+   out in input order, so memory never grows with the input
+-- Checkpoint (input line + byte offset) written after results are flushed;
+   `resume` picks up from there after a crash
+-- Turning a line into a query and resolving it are passed in: the runner
+   only streams, schedules and checkpoints
+
+"""
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from os import path, replace
+import json
+import time
+
+import weekendfare.utilities as wf_utils
+
+CHECKPOINT_VERSION = 1
+DEFAULT_WORKERS = 8
+WINDOW_PER_WORKER = 4       #requests in flight (or waiting to be written) per worker
+CHECKPOINT_EVERY = 100      #output lines between checkpoints
+CHECKPOINT_SECONDS = 5.0    #...or seconds, whichever comes first
+
+class Checkpoint(object):
+    """progress through one input: lines done and the byte offset after them
+
+    Note:
+        written only after the results it covers are flushed, so a crash
+        replays at most the lines since the last checkpoint (results carry
+        their `line` number: duplicates are easy to drop)
+
+    Args:
+        checkpoint_path (str): JSON checkpoint file abspath > relpath
+        source (str): input the checkpoint belongs to (path, or `-` for stdin)
+
+    """
+    def __init__(self, checkpoint_path, source):
+        self.checkpoint_path = checkpoint_path
+        self.source = source
+        self.line = 0
+        self.offset = 0
+        self.done = False
+
+    def load(self):
+        """read saved progress (none saved: start from zero)
+
+        Raises:
+            (:obj:`ValueError`): checkpoint belongs to another input, or is unreadable
+
+        """
+        if not path.isfile(self.checkpoint_path):
+            return self
+        with open(self.checkpoint_path, 'r') as checkpoint_fh:
+            state = json.load(checkpoint_fh)
+        if state.get('version') != CHECKPOINT_VERSION or state.get('source') != self.source:
+            raise ValueError('checkpoint {0} is for {1!r}, not {2!r}'.format(
+                self.checkpoint_path, state.get('source'), self.source
+            ))
+        self.line = state['line']
+        self.offset = state['offset']
+        self.done = state.get('done', False)
+        return self
+
+    def save(self, line, offset, done=False):
+        """record progress (atomic replace)"""
+        self.line = line
+        self.offset = offset
+        self.done = done
+        tmp_path = self.checkpoint_path + '.tmp'
+        with open(tmp_path, 'w') as checkpoint_fh:
+            json.dump({
+                'version': CHECKPOINT_VERSION,
+                'source': self.source,
+                'line': line,
+                'offset': offset,
+                'done': done,
+                'saved_at': time.time()
+            }, checkpoint_fh)
+        replace(tmp_path, self.checkpoint_path)
+
+def iter_lines(input_fh, start_line=0, start_offset=0):
+    """number the input's lines, skipping those already done
+
+    Note:
+        seekable inputs jump straight to `start_offset`; pipes are read
+        and dropped up to `start_line`
+
+    Args:
+        input_fh (binary file-like): JSONL input
+        start_line (int, optional): lines already done
+        start_offset (int, optional): byte offset after them
+
+    Yields:
+        (int, int, bytes): 1-based line number, byte offset after the line, raw line
+
+    """
+    line_number = 0
+    offset = 0
+    if start_line:
+        try:
+            input_fh.seek(start_offset)
+            line_number, offset = start_line, start_offset
+        except (AttributeError, OSError, ValueError):
+            pass
+    for raw_line in input_fh:
+        line_number += 1
+        offset += len(raw_line)
+        if line_number <= start_line:
+            continue
+        yield line_number, offset, raw_line
+
+class BatchRunner(object):
+    """stream JSONL requests through a thread pool, results out in input order
+
+    Args:
+        to_query (callable): `to_query(item)` turns one parsed input line into
+            a query, raising `ValueError` if it is invalid
+        resolve (callable): `resolve(query)` returns a JSON-ready dict (cache or fetch)
+        max_workers (int, optional): concurrent `resolve()` calls
+        window (int, optional): requests in flight or waiting to be written, at most
+        checkpoint (:obj:`Checkpoint`, optional): where progress goes (None: no resume)
+        logger (:obj:`logging.Logger`, optional): logger for tracking batch
+
+    """
+    def __init__(
+            self,
+            to_query,
+            resolve,
+            max_workers=DEFAULT_WORKERS,
+            window=None,
+            checkpoint=None,
+            logger=wf_utils.DEFAULT_LOGGER
+    ):
+        self.to_query = to_query
+        self.resolve = resolve
+        self.max_workers = max_workers
+        self.window = window or max_workers * WINDOW_PER_WORKER
+        self.checkpoint = checkpoint
+        self.logger = logger
+        self.stats = {'lines': 0, 'ok': 0, 'invalid': 0, 'failed': 0}
+        self._progress = (0, 0)     #(line, offset) of the last result written
+        self._unsaved = 0
+        self._saved_at = 0.0
+
+    def _prepare(self, line_number, raw_line):
+        """query for one line, or the error result to write instead"""
+        try:
+            item = json.loads(raw_line.decode('utf-8'))
+            if not isinstance(item, dict):
+                raise ValueError('expected a JSON object')
+            return item, self.to_query(item), None
+        except (ValueError, TypeError, AttributeError) as err_msg:    #odd JSON shapes
+            self.stats['invalid'] += 1
+            return None, None, {'line': line_number, 'ok': False, 'error': str(err_msg)}
+
+    def _result(self, line_number, item, future):
+        """output record of one resolved line"""
+        result = {'line': line_number}
+        if item.get('id') is not None:
+            result['id'] = item['id']
+        try:
+            result.update(future.result())
+            result['ok'] = True
+            self.stats['ok'] += 1
+        except Exception as err_msg:
+            self.logger.error(
+                'EXCEPTION: batch line failed' +
+                '\r\tline=%s',
+                line_number,
+                exc_info=True
+            )
+            result.update(ok=False, error=str(err_msg) or type(err_msg).__name__)
+            self.stats['failed'] += 1
+        return result
+
+    def run(self, input_fh, output_fh, resume=False):
+        """stream every request in `input_fh` to a result line in `output_fh`
+
+        Args:
+            input_fh (binary file-like): JSONL requests (blank lines are skipped)
+            output_fh (text file-like): JSONL results, one per request
+            resume (bool, optional): continue from `checkpoint` instead of line 1
+
+        Returns:
+            (:obj:`dict`): lines/ok/invalid/failed counts for this run
+
+        """
+        start_line = start_offset = 0
+        if resume and self.checkpoint is not None:
+            self.checkpoint.load()
+            if self.checkpoint.done:
+                self.logger.info('batch: %s already done', self.checkpoint.source)
+                return dict(self.stats)
+            start_line, start_offset = self.checkpoint.line, self.checkpoint.offset
+            if start_line:
+                self.logger.info('batch: resuming after line %s', start_line)
+
+        self._progress = (start_line, start_offset)
+        self._unsaved = 0
+        self._saved_at = time.time()
+        in_flight = deque()     #(line, offset, item, future, error result), input order
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for line_number, offset, raw_line in iter_lines(input_fh, start_line, start_offset):
+                if not raw_line.strip():
+                    continue
+                item, query, error = self._prepare(line_number, raw_line)
+                future = None if error else executor.submit(self.resolve, query)
+                in_flight.append((line_number, offset, item, future, error))
+                self._drain(in_flight, output_fh, self.window - 1)
+            self._drain(in_flight, output_fh, 0)
+
+        output_fh.flush()
+        if self.checkpoint is not None:
+            self.checkpoint.save(*self._progress, done=True)
+        self.logger.info('batch: %s', self.stats)
+        return dict(self.stats)
+
+    def _drain(self, in_flight, output_fh, keep):
+        """write finished results from the head of the window, waiting while more than `keep`"""
+        while in_flight and (
+                len(in_flight) > keep or in_flight[0][4] or in_flight[0][3].done()
+        ):
+            line_number, offset, item, future, error = in_flight.popleft()
+            result = error or self._result(line_number, item, future)
+            output_fh.write(json.dumps(result, sort_keys=True) + '\n')
+            self.stats['lines'] += 1
+            self._progress = (line_number, offset)
+            self._unsaved += 1
+            if self.checkpoint is not None and (
+                    self._unsaved >= CHECKPOINT_EVERY or
+                    time.time() - self._saved_at >= CHECKPOINT_SECONDS
+            ):
+                output_fh.flush()   #never checkpoint past what is written out
+                self.checkpoint.save(*self._progress)
+                self._unsaved = 0
+                self._saved_at = time.time()
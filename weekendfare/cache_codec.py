@@ -0,0 +1,354 @@
+"""cache_codec.py
+
+Compact on-disk form for cached QPX responses
+
+-- Reference data (`trips.data` airports/cities/aircraft/carriers/taxes) and
+   per-fare `pricing[].tax` lists interned once in a shared table
+-- Responses keep short references to interned items, then get zlib-compressed
+-- Plain JSON payloads (older caches, `level=0`) still decode
+-- `open_payload()` streams a payload's JSON, decompressing as it is read
+
+"""
+import threading
+import hashlib
+import json
+import io
+import zlib
+
+import weekendfare.utilities as wf_utils
+from weekendfare.log_store import LogStore
+
+ZLIB_MAGIC = b'WFZ1'    #payload prefix: interned + zlib-compressed
+REF_KEY = '$ref'        #`{'$ref': id}` stands in for an interned value
+REF_ID_LENGTH = 20      #hex chars of sha1 kept as a reference id
+DEFAULT_LEVEL = 6       #zlib level, 0 stores plain JSON
+INTERNED_SECTIONS = ('airport', 'city', 'aircraft', 'tax', 'carrier')
+READ_SIZE = 64 * 1024   #compressed bytes read per step when streaming
+
+def _dumps(value):
+    """compact, key-sorted JSON bytes (stable ids for equal values)"""
+    return json.dumps(value, separators=(',', ':'), sort_keys=True).encode('utf-8')
+
+def _ref_id(payload):
+    """reference id of an item's JSON bytes"""
+    return hashlib.sha1(payload).hexdigest()[:REF_ID_LENGTH]
+
+class ReferenceTable(object):
+    """content-addressed store of values shared between cached responses
+
+    Note:
+        values are keyed by a hash of their JSON, so an airport renamed by
+        QPX simply becomes a new item.  Items are small and bounded by the
+        number of distinct airports/carriers/tax lists seen; they are never
+        evicted.  Lookups decode a fresh copy: callers may mutate what they get
+
+    Args:
+        store_path (str): path to backing log abspath > relpath
+        logger (:obj:`logging.Logger`, optional): logger for tracking table
+
+    """
+    def __init__(self, store_path, logger=wf_utils.DEFAULT_LOGGER):
+        self.store = LogStore(store_path, logger=logger)
+        self._payloads = {}     #ref id: JSON bytes, filled on first use
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.store)
+
+    def intern(self, value):
+        """store `value` once, return its reference id"""
+        payload = _dumps(value)
+        ref_id = _ref_id(payload)
+        self.merge({ref_id: payload})
+        return ref_id
+
+    def merge(self, items):
+        """store items interned elsewhere (see `ReferenceCollector`)
+
+        Args:
+            items (:obj:`dict`): reference id: JSON bytes
+
+        """
+        with self._lock:
+            for ref_id, payload in items.items():
+                if ref_id not in self._payloads:
+                    self.store.put_if_absent(ref_id, payload, 0)   #another process may have it
+                    self._payloads[ref_id] = payload
+
+    def lookup(self, ref_id):
+        """value behind a reference id
+
+        Raises:
+            (KeyError): unknown reference (table lost or truncated)
+
+        """
+        payload = self._payloads.get(ref_id)
+        if payload is None:
+            with self._lock:
+                payload = self.store.read(ref_id)
+                if payload is None:     #interned by another process since we last looked
+                    self.store.refresh()
+                    payload = self.store.read(ref_id)
+                if payload is None:
+                    raise KeyError(ref_id)
+                payload = self._payloads[ref_id] = bytes(payload)
+        return json.loads(payload.decode('utf-8'))
+
+    def compact(self):
+        with self._lock:
+            self.store.compact()
+
+    def close(self):
+        self.store.close()
+
+class ReferenceCollector(object):
+    """`ReferenceTable` stand-in that only collects what gets interned
+
+    Note:
+        ids are content hashes, the same ones the table would hand out, so
+        a process without the table (a parse worker) can `encode()` and
+        pass `items` back for `ReferenceTable.merge()`
+
+    """
+    def __init__(self):
+        self.items = {}     #ref id: JSON bytes
+
+    def intern(self, value):
+        payload = _dumps(value)
+        ref_id = _ref_id(payload)
+        self.items[ref_id] = payload
+        return ref_id
+
+def _trips(record):
+    """`record['trips']` if `record` looks like a QPX response"""
+    if not isinstance(record, dict):
+        return None
+    trips = record.get('trips')
+    return trips if isinstance(trips, dict) else None
+
+def intern_response(record, references):
+    """copy of a QPX response with shared data replaced by references
+
+    Note:
+        only the copied path is rebuilt: the caller's `record` is untouched
+
+    Args:
+        record (:obj:`dict`): QPX response (anything else is returned as-is)
+        references (:obj:`ReferenceTable`): where shared values go
+
+    Returns:
+        (:obj:`dict`): response holding `{'$ref': id}` stand-ins
+
+    """
+    trips = _trips(record)
+    if trips is None:
+        return record
+    trips = dict(trips)
+
+    data = trips.get('data')
+    if isinstance(data, dict):
+        data = dict(data)
+        for section in INTERNED_SECTIONS:
+            if isinstance(data.get(section), list):
+                data[section] = [references.intern(item) for item in data[section]]
+        trips['data'] = data
+
+    trip_options = []
+    for trip_option in trips.get('tripOption') or []:
+        if isinstance(trip_option, dict) and trip_option.get('pricing'):
+            trip_option = dict(trip_option)
+            trip_option['pricing'] = [
+                dict(pricing, tax={REF_KEY: references.intern(pricing['tax'])})
+                if isinstance(pricing, dict) and pricing.get('tax') else pricing
+                for pricing in trip_option['pricing']
+            ]
+        trip_options.append(trip_option)
+    if 'tripOption' in trips:
+        trips['tripOption'] = trip_options
+
+    interned = dict(record)
+    interned['trips'] = trips
+    return interned
+
+def restore_response(record, references):
+    """undo `intern_response()` in place
+
+    Args:
+        record (:obj:`dict`): freshly decoded interned response
+        references (:obj:`ReferenceTable`): table the references point into
+
+    Returns:
+        (:obj:`dict`): full QPX response
+
+    """
+    trips = _trips(record)
+    if trips is None:
+        return record
+
+    data = trips.get('data')
+    if isinstance(data, dict):
+        for section in INTERNED_SECTIONS:
+            if isinstance(data.get(section), list):
+                data[section] = [
+                    references.lookup(item) if isinstance(item, str) else item
+                    for item in data[section]
+                ]
+
+    for trip_option in trips.get('tripOption') or []:
+        for pricing in trip_option.get('pricing') or []:
+            tax = pricing.get('tax')
+            if isinstance(tax, dict) and REF_KEY in tax:
+                pricing['tax'] = references.lookup(tax[REF_KEY])
+    return record
+
+def encode(record, references=None, level=DEFAULT_LEVEL):
+    """cache payload for a record
+
+    Args:
+        record (:obj:`dict`): JSON-serializable value
+        references (:obj:`ReferenceTable`, optional): intern shared data here
+            (or a `ReferenceCollector`)
+        level (int, optional): zlib level, 0 for plain JSON
+
+    Returns:
+        (bytes): payload for `LogStore.put()`
+
+    """
+    if not level:
+        return json.dumps(record, separators=(',', ':')).encode('utf-8')
+    if references is not None:
+        record = intern_response(record, references)
+    payload = json.dumps(record, separators=(',', ':')).encode('utf-8')
+    return ZLIB_MAGIC + zlib.compress(payload, level)
+
+def decode_bytes(payload, references=None):
+    """JSON bytes of a cache payload (full response, references restored)"""
+    if not payload.startswith(ZLIB_MAGIC):
+        return bytes(payload)
+    return json.dumps(decode(payload, references), separators=(',', ':')).encode('utf-8')
+
+def compress(content, level=DEFAULT_LEVEL):
+    """cache payload for raw JSON bytes, kept as received (nothing interned)
+
+    Note:
+        interning needs the whole response decoded; this does not, so a
+        streamed reply can be cached without ever building its dict
+
+    Args:
+        content (bytes): JSON document
+        level (int, optional): zlib level, 0 for plain JSON
+
+    Returns:
+        (bytes): payload for `LogStore.put()`
+
+    """
+    if not level:
+        return bytes(content)
+    return ZLIB_MAGIC + zlib.compress(content, level)
+
+def interned_json(payload):
+    """JSON bytes of a cache payload, references left as `{'$ref': id}` stand-ins
+
+    Note:
+        enough for `qpx_parser.iter_trip_options()` (prices, slices, times):
+        it never reads `trips.data` or tax lists.  Needs no `ReferenceTable`,
+        so it works in another process
+
+    """
+    if not payload.startswith(ZLIB_MAGIC):
+        return bytes(payload)
+    return zlib.decompress(payload[len(ZLIB_MAGIC):])
+
+def decode(payload, references=None):
+    """record from a cache payload (plain JSON or `encode()`d)
+
+    Args:
+        payload (bytes): stored payload
+        references (:obj:`ReferenceTable`, optional): table used by `encode()`
+
+    Returns:
+        (:obj:`dict`): original record
+
+    """
+    if not payload.startswith(ZLIB_MAGIC):
+        return json.loads(bytes(payload).decode('utf-8'))
+    record = json.loads(zlib.decompress(payload[len(ZLIB_MAGIC):]).decode('utf-8'))
+    if references is not None:
+        record = restore_response(record, references)
+    return record
+
+class PayloadReader(object):
+    """file-like JSON reader over a cache payload, decompressing as it goes
+
+    Note:
+        references are left as `{'$ref': id}` stand-ins (see `interned_json()`).
+        Only one step of compressed input (and what it inflates to) is held
+        in memory
+
+    Args:
+        source (file-like): payload stream, positioned past any `ZLIB_MAGIC`
+        compressed (bool, optional): inflate what `source` yields
+        head (bytes, optional): bytes already read from `source`, served first
+
+    """
+    def __init__(self, source, compressed=True, head=b''):
+        self._source = source
+        self._decompressor = zlib.decompressobj() if compressed else None
+        self._buffer = head
+        self._exhausted = False
+
+    def _fill(self, size):
+        """grow the buffer to `size` bytes (or the end of the payload)"""
+        while not self._exhausted and (size < 0 or len(self._buffer) < size):
+            if self._decompressor is None:
+                data = self._source.read(READ_SIZE)
+                if not data:
+                    self._exhausted = True
+                self._buffer += data
+                continue
+
+            data = self._decompressor.unconsumed_tail or self._source.read(READ_SIZE)
+            if not data:
+                self._buffer += self._decompressor.flush()
+                self._exhausted = True
+            else:
+                self._buffer += self._decompressor.decompress(data, READ_SIZE)
+
+    def read(self, size=-1):
+        """read up to `size` bytes of JSON (all if negative)"""
+        if size is None:
+            size = -1
+        self._fill(size)
+        if size < 0:
+            data, self._buffer = self._buffer, b''
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def close(self):
+        close = getattr(self._source, 'close', None)
+        if close is not None:
+            close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def open_payload(source):
+    """stream the JSON of a cache payload (see `qpx_parser.iter_trip_options()`)
+
+    Args:
+        source (bytes or file-like): stored payload, plain JSON or `encode()`d
+
+    Returns:
+        (:obj:`PayloadReader`): file-like JSON reader
+
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+    head = source.read(len(ZLIB_MAGIC))
+    if head == ZLIB_MAGIC:
+        return PayloadReader(source)
+    return PayloadReader(source, compressed=False, head=head)
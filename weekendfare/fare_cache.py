@@ -0,0 +1,403 @@
+"""fare_cache.py
+
+Hash-indexed cache for QPX responses
+
+-- Cache keys (canonical query fingerprint)
+-- In-memory index with TTL/LRU eviction
+-- Adaptive TTL: fares close to departure go stale sooner
+-- Persistent append-only backing file (see `log_store.py`)
+-- Compressed payloads, reference data shared between entries (see `cache_codec.py`)
+-- Query registry (`<cache_path>.queries`) for incremental refresh
+
+"""
+from collections import OrderedDict
+from calendar import timegm
+import threading
+import json
+import time
+
+import weekendfare.utilities as wf_utils
+import weekendfare.qpx_request as wf_request
+import weekendfare.cache_codec as wf_codec
+from weekendfare.log_store import LogStore
+
+DEFAULT_TTL = 6 * 60 * 60      #seconds, also the longest adaptive TTL
+DEFAULT_MIN_TTL = 15 * 60       #seconds, adaptive TTL at departure
+DEFAULT_TTL_HORIZON = 42        #days out where adaptive TTL reaches DEFAULT_TTL
+DEFAULT_MAX_ENTRIES = 5000
+QUERY_STORE_SUFFIX = '.queries'
+REFERENCE_STORE_SUFFIX = '.refs'
+
+def split_query(qpx_query):
+    """break a QPX query into its slices and cache filters
+
+    Args:
+        qpx_query (:obj:`dict`): QPX query (`{'request': {...}}`)
+
+    Returns:
+        (:obj:`list`, :obj:`dict`): slice list, filters for `cache_key()`
+
+    """
+    request = qpx_query.get('request', qpx_query)
+    slices = request.get('slice', [])
+    filters = {key: value for key, value in request.items() if key != 'slice'}
+
+    return slices, filters
+
+def cache_key(
+        qpx_query_slice,
+        qpx_query_filters=None
+):
+    """build hashable key for a single slice query
+
+    Note:
+        fingerprint of the canonical one-slice query (see `qpx_request.py`),
+        so `{'childCount': 0}` == `{}` and `sea` == `SEA`
+
+    Args:
+        qpx_query_slice (:obj:`dict`): slice with origin/destination/date
+        qpx_query_filters (:obj:`dict`, optional): every other request field
+
+    Returns:
+        (str): stable cache key
+
+    """
+    request = dict(qpx_query_filters or {})
+    request['slice'] = [qpx_query_slice]
+    return wf_request.fingerprint({'request': request})
+
+def query_departure(qpx_query):
+    """earliest slice date of a QPX query
+
+    Args:
+        qpx_query (:obj:`dict`): QPX query
+
+    Returns:
+        (str or None): YYYY-MM-DD departure date
+
+    """
+    slices, _ = split_query(qpx_query)
+    dates = [qpx_slice['date'] for qpx_slice in slices if qpx_slice.get('date')]
+    return min(dates) if dates else None
+
+def adaptive_ttl(
+        departure_date,
+        now=None,
+        min_ttl=DEFAULT_MIN_TTL,
+        max_ttl=DEFAULT_TTL,
+        horizon_days=DEFAULT_TTL_HORIZON
+):
+    """how long a fare for `departure_date` stays fresh
+
+    Note:
+        linear from `min_ttl` (departing now) to `max_ttl` (`horizon_days`
+        out or later): 2 days out is ~30min, 6 weeks out is 6h by default
+
+    Args:
+        departure_date (str): YYYY-MM-DD departure (None: `max_ttl`)
+        now (float, optional): timestamp override (for testing)
+        min_ttl (int, optional): seconds, at (or after) departure
+        max_ttl (int, optional): seconds, at the horizon
+        horizon_days (float, optional): days out where `max_ttl` is reached
+
+    Returns:
+        (int): seconds
+
+    """
+    if not departure_date:
+        return max_ttl
+    now = now or time.time()
+    departure = timegm(time.strptime(departure_date, '%Y-%m-%d'))
+    days_out = max(0.0, (departure - now) / 86400)
+    if not horizon_days or days_out >= horizon_days:
+        return max_ttl
+    return int(min_ttl + (max_ttl - min_ttl) * days_out / horizon_days)
+
+class FareCache(object):
+    """LRU cache of QPX responses over an append-only `LogStore`
+
+    Note:
+        only keys and timestamps are held in memory; records are read back
+        from the log on `get()`.  Safe to share between threads.
+        `ttl` is the upper bound: `get(ttl=...)` can be stricter per lookup.
+        Records are stored interned and compressed (`<cache_path>.refs` holds
+        the shared reference data); plain JSON entries from older caches
+        still read.  Processes sharing `cache_path` see each other's
+        entries: every lookup first catches up on the log (see `LogStore.refresh()`)
+
+    Args:
+        cache_path (str): path to backing file abspath > relpath
+        ttl (int, optional): seconds before an entry goes stale
+        max_entries (int, optional): LRU cap on number of entries
+        compression (int, optional): zlib level for new entries, 0 for plain JSON
+        logger (:obj:`logging.Logger`, optional): logger for tracking cache
+
+    """
+    def __init__(
+            self,
+            cache_path,
+            ttl=DEFAULT_TTL,
+            max_entries=DEFAULT_MAX_ENTRIES,
+            compression=wf_codec.DEFAULT_LEVEL,
+            logger=wf_utils.DEFAULT_LOGGER
+    ):
+        self.cache_path = cache_path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.compression = compression
+        self.logger = logger
+        self._entries = OrderedDict()   #key: stored_at, oldest first
+        self.store = None
+        self.references = None
+        self._query_store = None        #opened on first use, see `queries()`
+        self._lock = threading.RLock()
+
+        self.load()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def _is_expired(self, stored_at, now, ttl=None):
+        """check an entry timestamp against ttl"""
+        if ttl is None or (self.ttl and ttl > self.ttl):
+            ttl = self.ttl
+        return ttl and now - stored_at > ttl
+
+    def _sync(self):
+        """catch up on entries other processes wrote to the shared log (lock held)"""
+        store = self.store
+        store.refresh()
+        if store.rebuilt:
+            self._entries = OrderedDict(
+                (key, stored_at) for key, (stored_at, _, _)
+                in sorted(store.index.items(), key=lambda item: item[1][0])
+            )
+        else:
+            for key in store.changes:
+                if key in store.index:
+                    self._entries[key] = store.index[key][0]
+                    self._entries.move_to_end(key)
+                else:
+                    self._entries.pop(key, None)
+        store.changes = []
+        store.rebuilt = False
+
+    def _drop(self, key, now):
+        """remove entry from memory and tombstone it in the log"""
+        del self._entries[key]
+        self.store.delete(key, now)
+
+    def get(self, key, now=None, ttl=None):
+        """fetch record from cache
+
+        Args:
+            key (str): `cache_key()` value
+            now (float, optional): timestamp override (for testing)
+            ttl (int, optional): stricter freshness for this lookup (see `adaptive_ttl()`)
+
+        Returns:
+            (:obj:`dict` or None): cached record if present and fresh
+
+        """
+        payload = self.get_payload(key, now, ttl)
+        if payload is None:
+            return None
+        return wf_codec.decode(payload, self.references)
+
+    def get_payload(self, key, now=None, ttl=None):
+        """stored payload bytes, not decoded (see `cache_codec.open_payload()`)
+
+        Args:
+            key (str): `cache_key()` value
+            now (float, optional): timestamp override (for testing)
+            ttl (int, optional): stricter freshness for this lookup (see `adaptive_ttl()`)
+
+        Returns:
+            (bytes or None): payload if present and fresh
+
+        """
+        now = now or time.time()
+        with self._lock:
+            self._sync()
+            try:
+                stored_at = self._entries[key]
+            except KeyError:
+                return None
+
+            if self._is_expired(stored_at, now, ttl):
+                self.logger.debug('--cache expired: %s', key)
+                self._drop(key, now)
+                return None
+
+            self._entries.move_to_end(key)
+            return self.store.read(key)
+
+    def open(self, key, now=None, ttl=None):
+        """stream raw record from cache (see `qpx_parser.iter_trip_options()`)
+
+        Args:
+            key (str): `cache_key()` value
+            now (float, optional): timestamp override (for testing)
+            ttl (int, optional): stricter freshness for this lookup (see `adaptive_ttl()`)
+
+        Note:
+            compressed entries are inflated as they are read, references
+            left as stand-ins (see `cache_codec.PayloadReader`)
+
+        Returns:
+            (:obj:`cache_codec.PayloadReader` or None): file-like JSON reader if present and fresh
+
+        """
+        now = now or time.time()
+        with self._lock:
+            self._sync()
+            stored_at = self._entries.get(key)
+            if stored_at is None:
+                return None
+            if self._is_expired(stored_at, now, ttl):
+                self._drop(key, now)
+                return None
+
+            self._entries.move_to_end(key)
+            record_reader = self.store.open_record(key)
+        return None if record_reader is None else wf_codec.open_payload(record_reader)
+
+    def stored_at(self, key):
+        """timestamp of a live entry (None if missing), without touching LRU order"""
+        with self._lock:
+            return self._entries.get(key)
+
+    def put(self, key, record, now=None, query=None):
+        """append record to cache log
+
+        Args:
+            key (str): `cache_key()` value
+            record (:obj:`dict`): JSON-serializable value to store
+            now (float, optional): timestamp override (for testing)
+            query (:obj:`dict`, optional): QPX query behind `record`, kept for `queries()`
+
+        """
+        self.put_payload(
+            key,
+            wf_codec.encode(record, self.references, self.compression),
+            now=now,
+            query=query
+        )
+
+    def put_payload(self, key, payload, now=None, query=None, references=None):
+        """append an already encoded record to cache log
+
+        Args:
+            key (str): `cache_key()` value
+            payload (bytes): `cache_codec.encode()` output, at this cache's `compression`
+            now (float, optional): timestamp override (for testing)
+            query (:obj:`dict`, optional): QPX query behind `payload`, kept for `queries()`
+            references (:obj:`dict`, optional): `ReferenceCollector.items` the payload points at
+
+        """
+        now = now or time.time()
+        if references:
+            self.references.merge(references)   #before the payload: readers never miss a reference
+        with self._lock:
+            self._sync()
+            self.store.put(key, payload, now)
+            self._entries[key] = now
+            self._entries.move_to_end(key)
+            if query is not None:
+                self._get_query_store().put(
+                    key, json.dumps(query, separators=(',', ':')).encode('utf-8'), now
+                )
+            self._trim(now)
+
+    def _get_query_store(self):
+        """open query registry on first use (plain lookups never need it)"""
+        if self._query_store is None:
+            self._query_store = LogStore(self.cache_path + QUERY_STORE_SUFFIX, logger=self.logger)
+        return self._query_store
+
+    def queries(self):
+        """every registered query, whether or not its response is still fresh
+
+        Returns:
+            (:obj:`list` (str, :obj:`dict`)): cache key, QPX query
+
+        """
+        with self._lock:
+            query_store = self._get_query_store()
+            query_store.refresh()
+            return [
+                (key, json.loads(query_store.read(key).decode('utf-8')))
+                for key in list(query_store.index)
+            ]
+
+    def forget_query(self, key, now=None):
+        """drop a query from the registry (e.g. departed)"""
+        with self._lock:
+            self._get_query_store().delete(key, now or time.time())
+
+    def evict(self, now=None):
+        """drop expired entries then trim oldest entries down to max_entries
+
+        Note:
+            `put()` only trims; expired entries are otherwise dropped lazily
+            on `get()` or by calling this directly
+
+        Args:
+            now (float, optional): timestamp override (for testing)
+
+        Returns:
+            (int): number of entries dropped
+
+        """
+        now = now or time.time()
+        with self._lock:
+            self._sync()
+            expired = [
+                key for key, stored_at in self._entries.items()
+                if self._is_expired(stored_at, now)
+            ]
+            for key in expired:
+                self._drop(key, now)
+
+            return len(expired) + self._trim(now)
+
+    def _trim(self, now):
+        """drop least-recently-used entries down to max_entries"""
+        dropped = 0
+        while self.max_entries and len(self._entries) > self.max_entries:
+            key = next(iter(self._entries))
+            self._drop(key, now)
+            self.forget_query(key, now)     #LRU victims are not worth refreshing
+            dropped += 1
+
+        return dropped
+
+    def load(self):
+        """open backing log and rebuild LRU order from record timestamps"""
+        self.store = LogStore(self.cache_path, track_changes=True, logger=self.logger)
+        self.references = wf_codec.ReferenceTable(
+            self.cache_path + REFERENCE_STORE_SUFFIX, logger=self.logger
+        )
+        self._entries = OrderedDict(
+            (key, stored_at) for key, (stored_at, _, _)
+            in sorted(self.store.index.items(), key=lambda item: item[1][0])
+        )
+        self.evict()
+
+    def compact(self):
+        """force compaction of the backing log"""
+        with self._lock:
+            self.store.compact()
+            if self._query_store is not None:
+                self._query_store.compact()
+
+    def close(self):
+        """release backing log"""
+        self.store.close()
+        self.references.close()
+        if self._query_store is not None:
+            self._query_store.close()
+            self._query_store = None
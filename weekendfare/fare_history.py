@@ -0,0 +1,274 @@
+"""fare_history.py
+
+SQLite fare history of every trip option QPX has shown us
+
+-- One row per `models.TripOption` per observation, via `dataset`
+-- Bulk insert per response in one transaction
+-- Indexed queries: cheapest fare on a route, price trend of a flight
+-- Rows keep the query's shape (passengers, refundable, slice count...), so
+   bounds only compare like with like
+
+"""
+import threading
+import time
+
+import weekendfare.utilities as wf_utils
+from weekendfare.models import cents_to_price
+
+TABLE = 'fares'
+INDEXES = (
+    ('ix_fares_route', ['origin', 'destination', 'departure_date', 'observed_at']),
+    ('ix_fares_flights', ['flights', 'observed_at'])
+)
+INSERT_CHUNK = 1000
+
+def history_rows(
+        trip_options,
+        observed_at,
+        query_fingerprint=None,
+        query_shape=None
+):
+    """flatten trip options into fare history rows
+
+    Note:
+        route/departure come from the first slice; `flights` lists every
+        flight number of the trip, like `AS330,UA294`
+
+    Args:
+        trip_options (:obj:`list` :obj:`weekendfare.models.TripOption`): one response
+        observed_at (float): epoch the fares were quoted
+        query_fingerprint (str, optional): `qpx_request.fingerprint()` of the query
+        query_shape (str, optional): `qpx_request.shape_fingerprint()` of the query
+
+    Returns:
+        (:obj:`list` :obj:`dict`): rows for `FareHistory.insert()`
+
+    """
+    rows = []
+    for trip_option in trip_options:
+        first_slice = trip_option.slices[0]
+        first_leg = first_slice.first_leg
+        local_departure = time.gmtime(first_leg.departure + first_leg.departure_offset * 60)
+        rows.append({
+            'observed_at': int(observed_at),
+            'fingerprint': query_fingerprint or '',
+            'shape': query_shape or '',
+            'origin': first_slice.origin,
+            'destination': first_slice.destination,
+            'departure': first_leg.departure,
+            'departure_date': time.strftime('%Y-%m-%d', local_departure),
+            'departure_time': time.strftime('%H:%M', local_departure),
+            'departure_weekday': local_departure.tm_wday,
+            'price_cents': trip_option.price_cents,
+            'currency': trip_option.currency,
+            'carrier': first_slice.segments[0].carrier,
+            'flights': ','.join(
+                flight for qpx_slice in trip_option.slices for flight in qpx_slice.flights
+            ),
+            'stops': trip_option.stops,
+            'duration': trip_option.duration,
+            'refundable': trip_option.refundable,
+            'slices': len(trip_option.slices)
+        })
+    return rows
+
+class FareHistory(object):
+    """fare observations in SQLite, queried with indexed SQL
+
+    Note:
+        `dataset` (and SQLAlchemy) are imported on construction, not at
+        module level.  Writes are serialized with a lock: fetch threads
+        share one history
+
+    Args:
+        db_path (str): path to SQLite file abspath > relpath
+        logger (:obj:`logging.Logger`, optional): logger for tracking history
+
+    """
+    def __init__(
+            self,
+            db_path,
+            logger=wf_utils.DEFAULT_LOGGER
+    ):
+        import dataset
+        self.db_path = db_path
+        self.logger = logger
+        self.db = dataset.connect('sqlite:///' + db_path)
+        self._lock = threading.Lock()
+        self._indexed = False
+
+    def __len__(self):
+        if not self._has_table():
+            return 0
+        return len(self.db[TABLE])
+
+    def _has_table(self):
+        return TABLE in self.db.tables
+
+    def _has_column(self, column):
+        return self._has_table() and self.db[TABLE].has_column(column)
+
+    def _ensure_indexes(self):
+        """create route/flight indexes once the table has its columns"""
+        table = self.db[TABLE]
+        for name, columns in INDEXES:
+            if not table.has_index(columns):
+                table.create_index(columns, name=name)
+        self._indexed = True
+
+    def insert(self, rows):
+        """bulk insert rows in one transaction
+
+        Args:
+            rows (:obj:`list` :obj:`dict`): `history_rows()` output
+
+        Returns:
+            (int): rows written
+
+        """
+        if not rows:
+            return 0
+        with self._lock:
+            if not self._indexed:   #first write creates columns: keep DDL out of the transaction
+                self.db[TABLE].insert_many(rows, chunk_size=INSERT_CHUNK)
+                self._ensure_indexes()
+                return len(rows)
+            with self.db as transaction:
+                transaction[TABLE].insert_many(rows, chunk_size=INSERT_CHUNK, ensure=False)
+        return len(rows)
+
+    def record(
+            self,
+            trip_options,
+            observed_at=None,
+            query_fingerprint=None,
+            query_shape=None
+    ):
+        """store one response's trip options
+
+        Args:
+            trip_options (:obj:`list` :obj:`weekendfare.models.TripOption`): parsed response
+            observed_at (float, optional): quote time (default now)
+            query_fingerprint (str, optional): `qpx_request.fingerprint()` of the query
+            query_shape (str, optional): `qpx_request.shape_fingerprint()` of the query
+
+        Returns:
+            (int): rows written
+
+        """
+        return self.insert(history_rows(
+            trip_options,
+            observed_at or time.time(),
+            query_fingerprint=query_fingerprint,
+            query_shape=query_shape
+        ))
+
+    def _select(self, sql, **params):
+        """run a query, rows as dicts with `sale_total` added"""
+        if not self._has_table():
+            return []
+        rows = []
+        for row in self.db.query(sql, **params):
+            row = dict(row)
+            row['sale_total'] = cents_to_price(row['price_cents'], row['currency'])
+            rows.append(row)
+        return rows
+
+    def cheapest(
+            self,
+            origin,
+            destination,
+            since=None,
+            departs_from=None,
+            departs_until=None,
+            weekdays=None,
+            slices=None,
+            shape=None,
+            limit=1
+    ):
+        """cheapest fares seen on a route
+
+        Note:
+            round trips and other passenger mixes share the route columns:
+            pass `slices`/`shape` when the price is compared to one query
+
+        Args:
+            origin (str): first-slice origin code
+            destination (str): first-slice destination code
+            since (float, optional): only fares observed after this epoch
+            departs_from (str, optional): YYYY-MM-DD earliest departure date
+            departs_until (str, optional): YYYY-MM-DD latest departure date
+            weekdays (:obj:`tuple` int, optional): `date.weekday()` values to keep
+            slices (int, optional): only trips with this many slices
+            shape (str, optional): only fares quoted for this `qpx_request.shape_fingerprint()`
+            limit (int, optional): rows to return
+
+        Returns:
+            (:obj:`list` :obj:`dict`): fare rows, cheapest first
+
+        """
+        clauses = ['origin = :origin', 'destination = :destination']
+        params = {'origin': origin.upper(), 'destination': destination.upper(), 'limit': limit}
+        if departs_from:
+            clauses.append('departure_date >= :departs_from')
+            params['departs_from'] = departs_from
+        if departs_until:
+            clauses.append('departure_date <= :departs_until')
+            params['departs_until'] = departs_until
+        if since:
+            clauses.append('observed_at >= :since')
+            params['since'] = int(since)
+        if weekdays:
+            clauses.append('departure_weekday IN ({0})'.format(
+                ','.join(str(int(weekday)) for weekday in weekdays)
+            ))
+        if slices:
+            clauses.append('slices = :slices')
+            params['slices'] = int(slices)
+        if shape:
+            if not self._has_column('shape'):   #history from before shapes were kept
+                return []
+            clauses.append('shape = :shape')
+            params['shape'] = shape
+        return self._select(
+            'SELECT * FROM {0} WHERE {1} ORDER BY price_cents, duration LIMIT :limit'.format(
+                TABLE, ' AND '.join(clauses)
+            ),
+            **params
+        )
+
+    def price_trend(
+            self,
+            flights,
+            departure_date=None,
+            since=None
+    ):
+        """every observed price of one itinerary, oldest first
+
+        Args:
+            flights (str): flight numbers like `UA294` or `AS330,UA294`
+            departure_date (str, optional): YYYY-MM-DD departure to follow
+            since (float, optional): only fares observed after this epoch
+
+        Returns:
+            (:obj:`list` :obj:`dict`): fare rows ordered by `observed_at`
+
+        """
+        clauses = ['flights = :flights']
+        params = {'flights': flights.upper()}
+        if departure_date:
+            clauses.append('departure_date = :departure_date')
+            params['departure_date'] = departure_date
+        if since:
+            clauses.append('observed_at >= :since')
+            params['since'] = int(since)
+        return self._select(
+            'SELECT * FROM {0} WHERE {1} ORDER BY observed_at'.format(
+                TABLE, ' AND '.join(clauses)
+            ),
+            **params
+        )
+
+    def close(self):
+        """release database connection"""
+        self.db.close()
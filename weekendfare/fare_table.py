@@ -0,0 +1,296 @@
+"""fare_table.py
+
+Columnar table of trip options for batch filtering and ranking
+
+-- One `array.array` per column (price cents, times, stops, ...)
+-- Filters run over whole columns, returning row indices
+-- Top-N ranking across routes/dates of a sweep
+-- Packs to flat bytes per column (cheap to pass between processes)
+
+"""
+from array import array
+import heapq
+import time
+
+from weekendfare.models import local_minutes, cents_to_price
+
+COLUMN_TYPES = (
+    ('price_cents', 'q'),
+    ('departure', 'q'),         #epoch seconds (UTC)
+    ('departure_offset', 'h'),  #UTC offset, minutes
+    ('departure_minutes', 'H'), #local minutes past midnight
+    ('arrival', 'q'),
+    ('duration', 'l'),          #minutes, all slices
+    ('stops', 'H'),
+    ('max_connection', 'l'),    #minutes, longest layover
+    ('refundable', 'b'),
+    ('carrier_id', 'H'),        #first segment carrier, see `codes`
+    ('origin_id', 'H'),
+    ('destination_id', 'H'),
+    ('currency_id', 'H')
+)
+COLUMN_NAMES = tuple(name for name, _ in COLUMN_TYPES)
+CODE_COLUMNS = ('carrier_id', 'origin_id', 'destination_id', 'currency_id')
+
+def time_to_minutes(time_str):
+    """'HH:MM' (config `early_time`/`late_time`) -> minutes past midnight"""
+    hours, _, minutes = time_str.partition(':')
+    return int(hours) * 60 + int(minutes or 0)
+
+class FareTable(object):
+    """array-backed columns over many trip options
+
+    Note:
+        string columns (carrier/airport/currency) are stored as ids into
+        `self.codes`; first slice gives origin/destination/departure
+
+    Args:
+        keep_options (bool, optional): keep `TripOption` objects for `trip_option()`
+
+    """
+    def __init__(self, keep_options=True):
+        self.keep_options = keep_options
+        self.columns = {name: array(typecode) for name, typecode in COLUMN_TYPES}
+        self.codes = []         #id -> code
+        self._code_ids = {}     #code -> id
+        self.options = []
+
+    @classmethod
+    def from_trip_options(cls, trip_options, keep_options=True):
+        """build table from an iterable of `models.TripOption`"""
+        table = cls(keep_options=keep_options)
+        table.extend(trip_options)
+        return table
+
+    def __len__(self):
+        return len(self.columns['price_cents'])
+
+    def __getattr__(self, name):
+        try:
+            return self.__dict__['columns'][name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def code_id(self, code):
+        """intern a code into the table's id space"""
+        try:
+            return self._code_ids[code]
+        except KeyError:
+            self._code_ids[code] = len(self.codes)
+            self.codes.append(code)
+            return self._code_ids[code]
+
+    def append(self, trip_option):
+        """add one `models.TripOption` as a row"""
+        first_slice = trip_option.slices[0]
+        first_leg = first_slice.first_leg
+        columns = self.columns
+        columns['price_cents'].append(trip_option.price_cents)
+        columns['departure'].append(first_leg.departure)
+        columns['departure_offset'].append(first_leg.departure_offset)
+        columns['departure_minutes'].append(
+            local_minutes(first_leg.departure, first_leg.departure_offset)
+        )
+        columns['arrival'].append(first_slice.arrival)
+        columns['duration'].append(trip_option.duration)
+        columns['stops'].append(trip_option.stops)
+        columns['max_connection'].append(
+            max(qpx_slice.max_connection for qpx_slice in trip_option.slices)
+        )
+        columns['refundable'].append(1 if trip_option.refundable else 0)
+        columns['carrier_id'].append(self.code_id(first_slice.segments[0].carrier))
+        columns['origin_id'].append(self.code_id(first_slice.origin))
+        columns['destination_id'].append(self.code_id(first_slice.destination))
+        columns['currency_id'].append(self.code_id(trip_option.currency))
+        if self.keep_options:
+            self.options.append(trip_option)
+
+    def extend(self, trip_options):
+        """add many `models.TripOption` rows (one response, or a whole sweep)"""
+        for trip_option in trip_options:
+            self.append(trip_option)
+
+    def merge(self, other):
+        """append every row of another table (codes re-interned into this one)
+
+        Raises:
+            (:obj:`ValueError`): `other` dropped its options but this table keeps them
+
+        """
+        if self.keep_options and not other.keep_options:
+            raise ValueError('cannot merge a table without options into one keeping them')
+        code_map = [self.code_id(code) for code in other.codes]
+        for name in COLUMN_NAMES:
+            if name in CODE_COLUMNS:
+                self.columns[name].extend(code_map[code_id] for code_id in other.columns[name])
+            else:
+                self.columns[name].extend(other.columns[name])
+        if self.keep_options:
+            self.options.extend(other.options)
+
+    def pack(self):
+        """compact form: codes plus raw bytes per column (options are not kept)
+
+        Returns:
+            (:obj:`tuple`): (codes, column bytes in `COLUMN_TYPES` order) for `unpack()`
+
+        """
+        return (
+            tuple(self.codes),
+            tuple(self.columns[name].tobytes() for name in COLUMN_NAMES)
+        )
+
+    @classmethod
+    def unpack(cls, packed):
+        """table from `pack()` output (without `TripOption` objects)"""
+        codes, column_bytes = packed
+        table = cls(keep_options=False)
+        for code in codes:
+            table.code_id(code)
+        for (name, _), raw in zip(COLUMN_TYPES, column_bytes):
+            table.columns[name].frombytes(raw)
+        return table
+
+    def where(
+            self,
+            max_price=None,
+            depart_after=None,
+            depart_before=None,
+            nonstop=False,
+            max_layover=None,
+            refundable=None,
+            origin=None,
+            destination=None,
+            departs_from=None,
+            departs_until=None,
+            indices=None
+    ):
+        """row indices matching every given criterion
+
+        Args:
+            max_price (float, optional): max sale total (currency units)
+            depart_after (str, optional): local 'HH:MM' earliest departure (config `early_time`)
+            depart_before (str, optional): local 'HH:MM' latest departure (config `late_time`)
+            nonstop (bool, optional): only nonstop options
+            max_layover (int, optional): longest acceptable connection, minutes
+            refundable (bool, optional): only refundable (True) / non-refundable (False)
+            origin (str, optional): first-slice origin code
+            destination (str, optional): first-slice destination code
+            departs_from (float, optional): epoch lower bound on departure
+            departs_until (float, optional): epoch upper bound on departure
+            indices (:obj:`list` int, optional): restrict to these rows
+
+        Returns:
+            (:obj:`list` int): matching row indices, in table order
+
+        """
+        columns = self.columns
+        tests = []
+        if max_price is not None:
+            tests.append(('price_cents', int(round(max_price * 100)), 'le'))
+        if depart_after is not None:
+            tests.append(('departure_minutes', time_to_minutes(depart_after), 'ge'))
+        if depart_before is not None:
+            tests.append(('departure_minutes', time_to_minutes(depart_before), 'le'))
+        if nonstop:
+            tests.append(('stops', 0, 'eq'))
+        if max_layover is not None:
+            tests.append(('max_connection', max_layover, 'le'))
+        if refundable is not None:
+            tests.append(('refundable', 1 if refundable else 0, 'eq'))
+        for column, code in (('origin_id', origin), ('destination_id', destination)):
+            if code is not None:
+                if code not in self._code_ids:
+                    return []
+                tests.append((column, self._code_ids[code], 'eq'))
+        if departs_from is not None:
+            tests.append(('departure', departs_from, 'ge'))
+        if departs_until is not None:
+            tests.append(('departure', departs_until, 'le'))
+
+        for column_name, bound, op in tests:
+            column = columns[column_name]
+            if indices is None:     #first pass: whole column
+                if op == 'le':
+                    indices = [index for index, value in enumerate(column) if value <= bound]
+                elif op == 'ge':
+                    indices = [index for index, value in enumerate(column) if value >= bound]
+                else:
+                    indices = [index for index, value in enumerate(column) if value == bound]
+            else:                   #later passes: only survivors
+                if op == 'le':
+                    indices = [index for index in indices if column[index] <= bound]
+                elif op == 'ge':
+                    indices = [index for index in indices if column[index] >= bound]
+                else:
+                    indices = [index for index in indices if column[index] == bound]
+
+        if indices is None:
+            return list(range(len(self)))
+        return indices
+
+    def top(self, count, indices=None, key='price_cents'):
+        """cheapest (or smallest `key`) rows
+
+        Args:
+            count (int): rows to return
+            indices (:obj:`list` int, optional): candidate rows (e.g. from `where()`)
+            key (str, optional): column to rank on (ties broken by duration)
+
+        Returns:
+            (:obj:`list` int): row indices, best first
+
+        """
+        if indices is None:
+            indices = range(len(self))
+        column = self.columns[key]
+        duration = self.columns['duration']
+        return heapq.nsmallest(count, indices, key=lambda index: (column[index], duration[index]))
+
+    def filter(self, **criteria):
+        """new table holding only rows matching `where(**criteria)`"""
+        return self.take(self.where(**criteria))
+
+    def take(self, indices):
+        """new table holding the given rows"""
+        table = FareTable(keep_options=self.keep_options)
+        table.codes = list(self.codes)
+        table._code_ids = dict(self._code_ids)
+        for name, typecode in COLUMN_TYPES:
+            column = self.columns[name]
+            table.columns[name] = array(typecode, [column[index] for index in indices])
+        if self.keep_options:
+            table.options = [self.options[index] for index in indices]
+        return table
+
+    def trip_option(self, index):
+        """`models.TripOption` for a row (requires keep_options)"""
+        return self.options[index]
+
+    def row(self, index):
+        """dict view of one row, codes resolved"""
+        columns = self.columns
+        return {
+            'sale_total': cents_to_price(
+                columns['price_cents'][index], self.codes[columns['currency_id'][index]]
+            ),
+            'origin': self.codes[columns['origin_id'][index]],
+            'destination': self.codes[columns['destination_id'][index]],
+            'carrier': self.codes[columns['carrier_id'][index]],
+            'departure': columns['departure'][index],
+            'arrival': columns['arrival'][index],
+            'departure_local': '{0:02d}:{1:02d}'.format(*divmod(columns['departure_minutes'][index], 60)),
+            'date': time.strftime(
+                '%Y-%m-%d',
+                time.gmtime(columns['departure'][index] + columns['departure_offset'][index] * 60)
+            ),
+            'duration': columns['duration'][index],
+            'stops': columns['stops'][index],
+            'max_connection': columns['max_connection'][index],
+            'refundable': bool(columns['refundable'][index])
+        }
+
+    def describe(self, index):
+        """one-line summary of a row, for CLI output"""
+        row = self.row(index)
+        return '{sale_total} {origin}->{destination} {date} {departure_local} {stops} stop(s) {carrier}'.format(**row)
@@ -0,0 +1,416 @@
+"""log_store.py
+
+Append-only record store backing the fare cache
+
+-- Append-only PUT/DEL records
+-- In-memory offset index rebuilt at open
+-- Memory-mapped reads
+-- Compaction of dead records
+-- Shared between processes: appends/compaction under a sidecar file lock,
+   other writers' records picked up by `refresh()`
+
+Record layout (header line + raw payload):
+    PUT <stored_at> <length> <key>\\n<payload>\\n
+    DEL <stored_at> 0 <key>\\n\\n
+
+"""
+from os import path, replace, fsync, stat, fstat
+import mmap
+
+import weekendfare.utilities as wf_utils
+
+OP_PUT = b'PUT'
+OP_DEL = b'DEL'
+COMPACT_MIN_BYTES = 1024 * 1024     #never compact files smaller than this
+COMPACT_DEAD_RATIO = 0.5            #compact once half the file is dead records
+LOCK_SUFFIX = '.lock'               #sidecar lock serializing writers across processes
+
+class RecordReader(object):
+    """file-like reader over one payload in the log
+
+    Note:
+        uses its own file handle so callers can stream a record while other
+        threads keep appending
+
+    Args:
+        store_path (str): path to log file
+        offset (int): payload offset
+        length (int): payload length
+
+    """
+    def __init__(self, store_path, offset, length):
+        self._filehandle = open(store_path, 'rb')
+        self._filehandle.seek(offset)
+        self._remaining = length
+
+    def read(self, size=-1):
+        """read up to `size` bytes of the payload (all if negative)"""
+        if size is None or size < 0 or size > self._remaining:
+            size = self._remaining
+        data = self._filehandle.read(size)
+        self._remaining -= len(data)
+        return data
+
+    def close(self):
+        self._filehandle.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class LogStore(object):
+    """append-only key/bytes store with an in-memory offset index
+
+    Note:
+        several processes may share one log.  Writes take `<store_path>.lock`,
+        catch up on records other processes appended, then append at the
+        real end of file.  Reads use the index as of the last `refresh()`
+        (writes refresh too); a compaction elsewhere is noticed by the log
+        file being replaced, and the index rebuilt.  Not thread-safe by
+        itself: owners serialize calls
+
+    Args:
+        store_path (str): path to log file abspath > relpath
+        compact_min_bytes (int, optional): smallest file worth compacting
+        compact_dead_ratio (float, optional): dead/total ratio that triggers compaction
+        track_changes (bool, optional): collect keys other processes wrote (see `refresh()`)
+        logger (:obj:`logging.Logger`, optional): logger for tracking store
+
+    """
+    def __init__(
+            self,
+            store_path,
+            compact_min_bytes=COMPACT_MIN_BYTES,
+            compact_dead_ratio=COMPACT_DEAD_RATIO,
+            track_changes=False,
+            logger=wf_utils.DEFAULT_LOGGER
+    ):
+        self.store_path = store_path
+        self.compact_min_bytes = compact_min_bytes
+        self.compact_dead_ratio = compact_dead_ratio
+        self.track_changes = track_changes
+        self.logger = logger
+        self.changes = []       #keys other processes put/deleted, see `refresh()`
+        self.rebuilt = False    #index rebuilt after another process compacted
+
+        self.index = {}         #key: (stored_at, offset, length)
+        self._record_sizes = {} #key: bytes on disk incl. header
+        self.live_bytes = 0
+        self.size = 0
+        self._filehandle = None
+        self._mmap = None
+
+        self.open()
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def _file_lock(self):
+        return wf_utils.FileLock(self.store_path + LOCK_SUFFIX)
+
+    def open(self):
+        """open log file and rebuild index from record headers"""
+        if not path.isfile(self.store_path):
+            open(self.store_path, 'ab').close()
+
+        with self._file_lock():
+            self._open_locked()
+
+    def _open_locked(self):
+        self._filehandle = open(self.store_path, 'r+b')
+        self._rebuild_index()
+
+    def close(self):
+        """release mmap and file handles"""
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        if self._filehandle is not None:
+            self._filehandle.close()
+            self._filehandle = None
+
+    @property
+    def dead_bytes(self):
+        """bytes on disk held by overwritten/deleted records"""
+        return self.size - self.live_bytes
+
+    def _rebuild_index(self):
+        """scan headers (skipping payloads) to rebuild offset index"""
+        self.index = {}
+        self._record_sizes = {}
+        self.live_bytes = 0
+        self._scan(0)
+        self._remap()
+
+    def _scan(self, offset, track=False):
+        """index records from `offset` to end of file (lock held)
+
+        Note:
+            a torn trailing record (crash mid-write) is truncated away;
+            writers hold the lock, so a live append is never mistaken for one
+
+        """
+        filehandle = self._filehandle
+        file_size = fstat(filehandle.fileno()).st_size
+        filehandle.seek(offset)
+        while True:
+            header = filehandle.readline()
+            if not header:
+                break
+            try:
+                op, stored_at, length, key = header.rstrip(b'\n').split(b' ', 3)
+                length = int(length)
+                stored_at = float(stored_at)
+            except ValueError:
+                self.logger.warning(
+                    'Corrupt record header, truncating log' +
+                    '\r\toffset=%s',
+                    offset
+                )
+                break
+            payload_offset = offset + len(header)
+            record_end = payload_offset + length + 1
+            if record_end > file_size:
+                self.logger.warning(
+                    'Torn record, truncating log' +
+                    '\r\toffset=%s',
+                    offset
+                )
+                break
+            filehandle.seek(record_end)
+
+            key = key.decode('utf-8')
+            self._forget(key)
+            if op == OP_PUT:
+                self._remember(key, stored_at, payload_offset, length, record_end - offset)
+            if track:
+                self.changes.append(key)
+            offset = record_end
+
+        if offset < file_size:
+            filehandle.truncate(offset)
+        self.size = offset
+
+    def refresh(self):
+        """pick up records other processes appended, or their compaction
+
+        Note:
+            costs one `stat()` when nothing changed.  With `track_changes`,
+            keys written elsewhere are added to `changes`; `rebuilt` is set
+            when the whole index was reloaded instead (owners re-sync, then
+            clear both)
+
+        """
+        try:
+            file_stat = stat(self.store_path)
+        except OSError:
+            return
+        if self._is_current(file_stat):
+            return
+        with self._file_lock():
+            self._refresh_locked()
+
+    def _is_current(self, file_stat):
+        return (
+            file_stat.st_size == self.size and
+            file_stat.st_ino == fstat(self._filehandle.fileno()).st_ino
+        )
+
+    def _refresh_locked(self):
+        file_stat = stat(self.store_path)
+        if self._is_current(file_stat):
+            return
+        if (
+                file_stat.st_ino != fstat(self._filehandle.fileno()).st_ino or
+                file_stat.st_size < self.size
+        ):     #replaced (compacted) by another process
+            self.close()
+            self._open_locked()
+            self.changes = []
+            self.rebuilt = self.track_changes
+            return
+        self._scan(self.size, track=self.track_changes)
+
+    def _remember(self, key, stored_at, payload_offset, length, record_size):
+        """add live record to index"""
+        self.index[key] = (stored_at, payload_offset, length)
+        self._record_sizes[key] = record_size
+        self.live_bytes += record_size
+
+    def _forget(self, key):
+        """drop record from index (now dead bytes)"""
+        if key in self.index:
+            del self.index[key]
+            self.live_bytes -= self._record_sizes.pop(key)
+
+    def _remap(self):
+        """(re)create read-only mmap over current file size"""
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        if self.size:
+            self._mmap = mmap.mmap(self._filehandle.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _append(self, op, key, stored_at, payload=b''):
+        """write one record to the end of the log (lock held, index current)
+
+        Returns:
+            (int): offset of payload
+
+        """
+        header = b' '.join([
+            op,
+            repr(float(stored_at)).encode(),
+            str(len(payload)).encode(),
+            key.encode('utf-8')
+        ]) + b'\n'
+        with open(self.store_path, 'ab') as append_handle:  #O_APPEND: never over another record
+            append_handle.write(header + payload + b'\n')
+
+        payload_offset = self.size + len(header)
+        self.size += len(header) + len(payload) + 1
+        return payload_offset
+
+    def put(self, key, payload, stored_at):
+        """append payload for key
+
+        Args:
+            key (str): record key (no newlines)
+            payload (bytes): raw record body
+            stored_at (float): timestamp of record
+
+        """
+        with self._file_lock():
+            self._refresh_locked()
+            self._put_locked(key, payload, stored_at)
+            self._maybe_compact_locked()
+
+    def put_if_absent(self, key, payload, stored_at):
+        """append payload for key unless any process already stored it
+
+        Returns:
+            (bool): record written
+
+        """
+        with self._file_lock():
+            self._refresh_locked()
+            if key in self.index:
+                return False
+            self._put_locked(key, payload, stored_at)
+            return True
+
+    def _put_locked(self, key, payload, stored_at):
+        self._forget(key)
+        start = self.size
+        payload_offset = self._append(OP_PUT, key, stored_at, payload)
+        self._remember(key, stored_at, payload_offset, len(payload), self.size - start)
+
+    def delete(self, key, stored_at=0):
+        """append tombstone for key
+
+        Args:
+            key (str): record key
+            stored_at (float, optional): timestamp of tombstone
+
+        """
+        with self._file_lock():
+            self._refresh_locked()
+            if key not in self.index:
+                return
+            self._forget(key)
+            self._append(OP_DEL, key, stored_at)
+
+    def read(self, key, size=None):
+        """read payload for key through mmap
+
+        Args:
+            key (str): record key
+            size (int, optional): read at most this many leading bytes
+
+        Returns:
+            (bytes or None): payload if key is live
+
+        """
+        try:
+            _, offset, length = self.index[key]
+        except KeyError:
+            return None
+        if size is not None:
+            length = min(length, size)
+
+        if self._mmap is None or offset + length > len(self._mmap):
+            self._remap()
+        return self._mmap[offset:offset + length]
+
+    def open_record(self, key):
+        """stream payload for key instead of reading it all at once
+
+        Args:
+            key (str): record key
+
+        Returns:
+            (:obj:`RecordReader` or None): file-like reader if key is live
+
+        """
+        try:
+            _, offset, length = self.index[key]
+        except KeyError:
+            return None
+
+        return RecordReader(self.store_path, offset, length)
+
+    def maybe_compact(self):
+        """compact if enough of the log is dead records
+
+        Returns:
+            (bool): compaction ran
+
+        """
+        with self._file_lock():
+            self._refresh_locked()
+            return self._maybe_compact_locked()
+
+    def _maybe_compact_locked(self):
+        if self.size < self.compact_min_bytes:
+            return False
+        if self.dead_bytes < self.size * self.compact_dead_ratio:
+            return False
+        self._compact_locked()
+        return True
+
+    def compact(self):
+        """rewrite live records to a fresh log and swap it in"""
+        with self._file_lock():
+            self._refresh_locked()
+            self._compact_locked()
+
+    def _compact_locked(self):
+        self.logger.info(
+            'Compacting cache log' +
+            '\r\tsize=%s' +
+            '\r\tdead_bytes=%s',
+            self.size, self.dead_bytes
+        )
+        tmp_path = self.store_path + '.compact'
+        live = sorted(self.index.items(), key=lambda item: item[1][1])
+        with open(tmp_path, 'wb') as tmp_handle:
+            for key, (stored_at, _, _) in live:
+                payload = self.read(key)
+                header = b' '.join([
+                    OP_PUT,
+                    repr(float(stored_at)).encode(),
+                    str(len(payload)).encode(),
+                    key.encode('utf-8')
+                ]) + b'\n'
+                tmp_handle.write(header + payload + b'\n')
+            tmp_handle.flush()
+            fsync(tmp_handle.fileno())
+
+        self.close()
+        replace(tmp_path, self.store_path)
+        self._open_locked()
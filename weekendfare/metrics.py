@@ -0,0 +1,190 @@
+"""metrics.py
+
+Cheap in-process timing spans and counters for WeekendFare hot paths
+
+-- `span()` times a block: count/sum/max seconds per name and labels
+-- `incr()` counts events or amounts (bytes, queries, trip options)
+-- `set_gauge()` keeps a last-seen value (quota remaining)
+-- Exported as Prometheus text (`.prom`) or a JSON stats dump
+
+"""
+from contextlib import contextmanager
+from os import path, makedirs, replace
+import threading
+import json
+import time
+
+PREFIX = 'weekendfare_'
+
+def _series(name, labels):
+    """hashable (name, sorted labels) identity, label values as str"""
+    return (name, tuple(sorted((key, str(value)) for key, value in labels.items())))
+
+def _format_labels(label_items):
+    if not label_items:
+        return ''
+    return '{' + ','.join(
+        '{0}="{1}"'.format(key, value.replace('\\', '\\\\').replace('"', '\\"'))
+        for key, value in label_items
+    ) + '}'
+
+class Metrics(object):
+    """thread-safe counters, gauges and span timings
+
+    Note:
+        one lock and a dict update per event: cheap enough to leave on.
+        Labels should stay low-cardinality (method, result, priority), not
+        per-query values
+
+    Args:
+        enabled (bool, optional): False turns every call into a no-op
+
+    """
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.spans = {}     #series: [count, sum seconds, max seconds]
+
+    def incr(self, name, value=1, **labels):
+        """add `value` to a counter"""
+        if not self.enabled:
+            return
+        series = _series(name, labels)
+        with self._lock:
+            self.counters[series] = self.counters.get(series, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        """record the latest value of a gauge"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self.gauges[_series(name, labels)] = value
+
+    def observe(self, name, seconds, **labels):
+        """add one timing to a span summary"""
+        if not self.enabled:
+            return
+        series = _series(name, labels)
+        with self._lock:
+            summary = self.spans.get(series)
+            if summary is None:
+                self.spans[series] = [1, seconds, seconds]
+            else:
+                summary[0] += 1
+                summary[1] += seconds
+                if seconds > summary[2]:
+                    summary[2] = seconds
+
+    @contextmanager
+    def span(self, name, **labels):
+        """time the enclosed block (exceptions are timed too, labelled `error`)"""
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.observe(name, time.perf_counter() - start, error='true', **labels)
+            raise
+        self.observe(name, time.perf_counter() - start, **labels)
+
+    def reset(self):
+        """drop everything recorded"""
+        with self._lock:
+            self.counters.clear()
+            self.gauges.clear()
+            self.spans.clear()
+            self.started = time.time()
+
+    def to_dict(self):
+        """JSON-ready snapshot
+
+        Returns:
+            (:obj:`dict`): counters/gauges/spans as lists of `{name, labels, ...}`
+
+        """
+        with self._lock:
+            counters = sorted(self.counters.items())
+            gauges = sorted(self.gauges.items())
+            spans = sorted((series, list(summary)) for series, summary in self.spans.items())
+        return {
+            'started': self.started,
+            'exported': time.time(),
+            'counters': [
+                {'name': name, 'labels': dict(labels), 'value': value}
+                for (name, labels), value in counters
+            ],
+            'gauges': [
+                {'name': name, 'labels': dict(labels), 'value': value}
+                for (name, labels), value in gauges
+            ],
+            'spans': [
+                {
+                    'name': name, 'labels': dict(labels),
+                    'count': count, 'seconds': total, 'max_seconds': longest
+                }
+                for (name, labels), (count, total, longest) in spans
+            ]
+        }
+
+    def to_prometheus(self):
+        """Prometheus text exposition format
+
+        Returns:
+            (str): `weekendfare_*` counters (`_total`), gauges and span
+                summaries (`_seconds_count`, `_seconds_sum`, `_seconds_max`)
+
+        """
+        snapshot = self.to_dict()
+        lines = []
+        typed = set()
+        def add(metric, metric_type, labels, value):
+            if metric not in typed:
+                typed.add(metric)
+                lines.append('# TYPE {0} {1}'.format(metric, metric_type))
+            lines.append('{0}{1} {2}'.format(
+                metric, _format_labels(sorted(labels.items())), repr(value)
+            ))
+
+        for counter in snapshot['counters']:
+            add(PREFIX + counter['name'] + '_total', 'counter', counter['labels'], counter['value'])
+        for gauge in snapshot['gauges']:
+            add(PREFIX + gauge['name'], 'gauge', gauge['labels'], gauge['value'])
+        for span in snapshot['spans']:
+            base = PREFIX + span['name'] + '_seconds'
+            add(base + '_count', 'counter', span['labels'], span['count'])
+            add(base + '_sum', 'counter', span['labels'], span['seconds'])
+            add(base + '_max', 'gauge', span['labels'], span['max_seconds'])
+        return '\n'.join(lines) + '\n'
+
+    def export(self, export_path):
+        """write a snapshot: Prometheus text for `.prom`/`.txt`, JSON otherwise
+
+        Note:
+            written to a temp file then swapped in, so scrapers never see half a file
+
+        Args:
+            export_path (str): file to (over)write
+
+        """
+        if export_path.endswith(('.prom', '.txt')):
+            payload = self.to_prometheus()
+        else:
+            payload = json.dumps(self.to_dict(), indent=2, sort_keys=True)
+        makedirs(path.dirname(path.abspath(export_path)), exist_ok=True)
+        tmp_path = export_path + '.tmp'
+        with open(tmp_path, 'w') as filehandle:
+            filehandle.write(payload)
+        replace(tmp_path, export_path)
+
+METRICS = Metrics()
+
+## module-level shortcuts onto the shared registry ##
+incr = METRICS.incr
+set_gauge = METRICS.set_gauge
+observe = METRICS.observe
+span = METRICS.span
@@ -0,0 +1,347 @@
+"""models.py
+
+Compact trip model for parsed QPX results
+
+-- TripOption > Slice > Segment > Leg, all `__slots__`
+-- Prices as integer cents + currency code
+-- Times as epoch seconds (+ UTC offset in minutes for local time of day)
+-- Interned IATA airport/carrier/aircraft codes
+
+"""
+from calendar import timegm
+from sys import intern
+import time
+
+def price_to_cents(price_str):
+    """split a QPX price string without going through float
+
+    Args:
+        price_str (str): QPX price, like `USD206.80`
+
+    Returns:
+        (int, str): amount in cents, currency code
+
+    """
+    currency, amount = price_str[:3], price_str[3:]
+    if not currency.isalpha() or not amount:
+        raise ValueError('Unexpected QPX price: {0}'.format(price_str))
+    whole, _, fraction = amount.partition('.')
+    try:
+        cents = int(whole) * 100 + int((fraction + '00')[:2])
+    except ValueError:
+        raise ValueError('Unexpected QPX price: {0}'.format(price_str))
+    return cents, intern(currency)
+
+def cents_to_price(cents, currency):
+    """inverse of `price_to_cents()`: (20680, 'USD') -> 'USD206.80'"""
+    return '{0}{1}.{2:02d}'.format(currency, cents // 100, cents % 100)
+
+def parse_qpx_time(time_str):
+    """parse QPX local timestamp
+
+    Args:
+        time_str (str): QPX time, like `2017-01-13T07:30-08:00`
+
+    Returns:
+        (int, int): epoch seconds (UTC), UTC offset in minutes
+
+    """
+    try:
+        sign = -1 if time_str[16] == '-' else 1
+        utc_offset = sign * (int(time_str[17:19]) * 60 + int(time_str[20:22]))
+        local_epoch = timegm((
+            int(time_str[0:4]), int(time_str[5:7]), int(time_str[8:10]),
+            int(time_str[11:13]), int(time_str[14:16]), 0
+        ))
+    except (IndexError, ValueError):
+        raise ValueError('Unexpected QPX time: {0}'.format(time_str))
+    return local_epoch - utc_offset * 60, utc_offset
+
+def format_qpx_time(epoch, utc_offset):
+    """inverse of `parse_qpx_time()`"""
+    local = time.gmtime(epoch + utc_offset * 60)
+    sign = '-' if utc_offset < 0 else '+'
+    return '{0}{1}{2:02d}:{3:02d}'.format(
+        time.strftime('%Y-%m-%dT%H:%M', local),
+        sign,
+        abs(utc_offset) // 60,
+        abs(utc_offset) % 60
+    )
+
+def local_minutes(epoch, utc_offset):
+    """minutes past local midnight, for time-of-day windows"""
+    return ((epoch + utc_offset * 60) % 86400) // 60
+
+class Leg(object):
+    """one takeoff/landing"""
+    __slots__ = (
+        'origin', 'destination', 'aircraft',
+        'departure', 'departure_offset', 'arrival', 'arrival_offset',
+        'duration', 'connection'
+    )
+
+    def __init__(
+            self,
+            origin,
+            destination,
+            departure,
+            departure_offset,
+            arrival,
+            arrival_offset,
+            duration=0,
+            aircraft=None,
+            connection=0
+    ):
+        self.origin = intern(origin)
+        self.destination = intern(destination)
+        self.departure = departure
+        self.departure_offset = departure_offset
+        self.arrival = arrival
+        self.arrival_offset = arrival_offset
+        self.duration = duration
+        self.aircraft = intern(aircraft) if aircraft else None
+        self.connection = connection
+
+    @classmethod
+    def from_qpx(cls, qpx_leg):
+        """build from `qpxexpress#legInfo`"""
+        departure, departure_offset = parse_qpx_time(qpx_leg['departureTime'])
+        arrival, arrival_offset = parse_qpx_time(qpx_leg['arrivalTime'])
+        return cls(
+            qpx_leg['origin'],
+            qpx_leg['destination'],
+            departure,
+            departure_offset,
+            arrival,
+            arrival_offset,
+            duration=qpx_leg.get('duration', 0),
+            aircraft=qpx_leg.get('aircraft'),
+            connection=qpx_leg.get('connectionDuration', 0)
+        )
+
+    def to_dict(self):
+        return {
+            'origin': self.origin,
+            'destination': self.destination,
+            'departureTime': format_qpx_time(self.departure, self.departure_offset),
+            'arrivalTime': format_qpx_time(self.arrival, self.arrival_offset),
+            'duration': self.duration,
+            'aircraft': self.aircraft,
+            'connectionDuration': self.connection
+        }
+
+class Segment(object):
+    """one flight number, made of one or more legs"""
+    __slots__ = ('carrier', 'number', 'cabin', 'duration', 'connection', 'legs')
+
+    def __init__(
+            self,
+            carrier,
+            number,
+            legs,
+            cabin=None,
+            duration=0,
+            connection=0
+    ):
+        self.carrier = intern(carrier)
+        self.number = number
+        self.legs = legs
+        self.cabin = intern(cabin) if cabin else None
+        self.duration = duration
+        self.connection = connection
+
+    @classmethod
+    def from_qpx(cls, qpx_segment):
+        """build from `qpxexpress#segmentInfo`"""
+        return cls(
+            qpx_segment['flight']['carrier'],
+            qpx_segment['flight']['number'],
+            [Leg.from_qpx(qpx_leg) for qpx_leg in qpx_segment.get('leg', [])],
+            cabin=qpx_segment.get('cabin'),
+            duration=qpx_segment.get('duration', 0),
+            connection=qpx_segment.get('connectionDuration', 0)
+        )
+
+    @property
+    def flight(self):
+        """carrier + number, like `UA294`"""
+        return self.carrier + self.number
+
+    def to_dict(self):
+        return {
+            'flight': {'carrier': self.carrier, 'number': self.number},
+            'cabin': self.cabin,
+            'duration': self.duration,
+            'connectionDuration': self.connection,
+            'leg': [leg.to_dict() for leg in self.legs]
+        }
+
+class Slice(object):
+    """one origin -> destination journey"""
+    __slots__ = ('duration', 'segments')
+
+    def __init__(self, segments, duration=0):
+        self.segments = segments
+        self.duration = duration
+
+    @classmethod
+    def from_qpx(cls, qpx_slice):
+        """build from `qpxexpress#sliceInfo`"""
+        return cls(
+            [Segment.from_qpx(qpx_segment) for qpx_segment in qpx_slice.get('segment', [])],
+            duration=qpx_slice.get('duration', 0)
+        )
+
+    @property
+    def legs(self):
+        return [leg for segment in self.segments for leg in segment.legs]
+
+    @property
+    def first_leg(self):
+        return self.segments[0].legs[0]
+
+    @property
+    def last_leg(self):
+        return self.segments[-1].legs[-1]
+
+    @property
+    def origin(self):
+        return self.first_leg.origin
+
+    @property
+    def destination(self):
+        return self.last_leg.destination
+
+    @property
+    def departure(self):
+        return self.first_leg.departure
+
+    @property
+    def arrival(self):
+        return self.last_leg.arrival
+
+    @property
+    def stops(self):
+        return max(0, len(self.legs) - 1)
+
+    @property
+    def max_connection(self):
+        """longest layover in minutes (0 for nonstop)"""
+        connections = [segment.connection for segment in self.segments]
+        connections.extend(leg.connection for leg in self.legs)
+        return max(connections) if connections else 0
+
+    @property
+    def flights(self):
+        return [segment.flight for segment in self.segments]
+
+    @property
+    def carriers(self):
+        return sorted(set(segment.carrier for segment in self.segments))
+
+    def to_dict(self):
+        return {
+            'duration': self.duration,
+            'segment': [segment.to_dict() for segment in self.segments]
+        }
+
+class TripOption(object):
+    """one priced itinerary (`qpxexpress#tripOption`)
+
+    Note:
+        `composed` options are separate one-way tickets added together (see
+        `trip_planner.py`), not a fare QPX priced as one trip
+
+    """
+    __slots__ = (
+        'id', 'price_cents', 'currency', 'refundable', 'latest_ticketing', 'slices', 'composed'
+    )
+
+    def __init__(
+            self,
+            trip_id,
+            price_cents,
+            currency,
+            slices,
+            refundable=False,
+            latest_ticketing=None,
+            composed=False
+    ):
+        self.id = trip_id
+        self.price_cents = price_cents
+        self.currency = currency
+        self.slices = slices
+        self.refundable = refundable
+        self.latest_ticketing = latest_ticketing
+        self.composed = composed
+
+    @classmethod
+    def from_qpx(cls, qpx_option):
+        """build from raw `qpxexpress#tripOption`
+
+        Note:
+            `tax`, `fareCalculation` and `segmentPricing` are dropped
+
+        """
+        price_cents, currency = price_to_cents(qpx_option['saleTotal'])
+        pricing = qpx_option.get('pricing', [])
+        latest_ticketing = None
+        if pricing and pricing[0].get('latestTicketingTime'):
+            latest_ticketing = parse_qpx_time(pricing[0]['latestTicketingTime'])[0]
+        return cls(
+            qpx_option.get('id'),
+            price_cents,
+            currency,
+            [Slice.from_qpx(qpx_slice) for qpx_slice in qpx_option.get('slice', [])],
+            refundable=bool(pricing) and all(price.get('refundable', False) for price in pricing),
+            latest_ticketing=latest_ticketing
+        )
+
+    @property
+    def sale_total(self):
+        """QPX-style price string, like `USD206.80`"""
+        return cents_to_price(self.price_cents, self.currency)
+
+    @property
+    def stops(self):
+        return sum(qpx_slice.stops for qpx_slice in self.slices)
+
+    @property
+    def duration(self):
+        return sum(qpx_slice.duration for qpx_slice in self.slices)
+
+    def sort_key(self):
+        """cheapest, then shortest"""
+        return (self.price_cents, self.duration)
+
+    def __lt__(self, other):
+        return self.sort_key() < other.sort_key()
+
+    def __eq__(self, other):
+        return isinstance(other, TripOption) and self.to_dict() == other.to_dict()
+
+    def __hash__(self):
+        return hash((self.id, self.price_cents))
+
+    def __repr__(self):
+        return '<TripOption {0}{1} {2}>'.format(
+            self.sale_total,
+            ' composed' if self.composed else '',
+            ' | '.join(
+                '{0}-{1} {2}'.format(
+                    qpx_slice.origin, qpx_slice.destination, ','.join(qpx_slice.flights)
+                ) for qpx_slice in self.slices
+            )
+        )
+
+    def to_dict(self):
+        """JSON-friendly (QPX-shaped) view"""
+        trip_dict = {
+            'id': self.id,
+            'saleTotal': self.sale_total,
+            'refundable': self.refundable,
+            'slice': [qpx_slice.to_dict() for qpx_slice in self.slices]
+        }
+        if self.composed:
+            trip_dict['composed'] = True
+        return trip_dict
@@ -0,0 +1,188 @@
+"""parse_pool.py
+
+Parse QPX responses on other cores
+
+-- Workers get raw payload bytes (cache payloads stay compressed on the way)
+-- Decompress + `qpx_parser` + `FareTable` all run in the worker, streamed:
+   no response is ever decoded whole
+-- Results come back packed (codes + raw column bytes), not nested dicts
+-- Fresh QPX replies are worked up whole in the worker: table, cache payload
+   (compressed as received), fare history rows and alert fares in one pass;
+   the parent only writes what comes back
+-- `processes=0` parses in the calling process: same results, no pool
+
+"""
+from concurrent.futures import ProcessPoolExecutor, Future
+import os
+
+import weekendfare.cache_codec as wf_codec
+import weekendfare.qpx_parser as wf_parser
+import weekendfare.fare_history as wf_history
+import weekendfare.alerts as wf_alerts
+from weekendfare.fare_table import FareTable
+
+def parse_payload(payload, price_filter=None):
+    """packed `FareTable` of one response (runs in a worker)
+
+    Args:
+        payload (bytes or file-like): QPX response JSON, or a fare cache
+            payload (file-like only without a pool: see `FareCache.open()`)
+        price_filter (float, optional): max sale total (response currency)
+
+    Returns:
+        (:obj:`tuple`): `FareTable.pack()` output
+
+    """
+    with wf_codec.open_payload(payload) as reader:
+        table = FareTable.from_trip_options(
+            wf_parser.iter_trip_options(reader, price_filter=price_filter),
+            keep_options=False
+        )
+    return table.pack()
+
+def digest_options(
+        trip_options,
+        observed_at,
+        query_fingerprint=None,
+        query_shape=None,
+        history=True,
+        alerts=True
+):
+    """fare history rows and alert fares of one parsed response
+
+    Args:
+        trip_options (:obj:`list` :obj:`weekendfare.models.TripOption`): parsed response
+        observed_at (float): epoch the fares were quoted
+        query_fingerprint (str, optional): `qpx_request.fingerprint()` of the query
+        query_shape (str, optional): `qpx_request.shape_fingerprint()` of the query
+        history (bool, optional): build `history` rows
+        alerts (bool, optional): build alert `fares`
+
+    Returns:
+        (:obj:`dict`): `observed_at`, `history` (`fare_history.history_rows()`),
+            `fares` (`alerts.fare_entries()`); unwanted parts are empty
+
+    """
+    return {
+        'observed_at': observed_at,
+        'history': wf_history.history_rows(
+            trip_options, observed_at, query_fingerprint, query_shape
+        ) if history else [],
+        'fares': wf_alerts.fare_entries(trip_options, query_shape or '') if alerts else []
+    }
+
+def digest_response(
+        content,
+        observed_at,
+        level=None,
+        query_fingerprint=None,
+        query_shape=None,
+        history=True,
+        alerts=True
+):
+    """everything kept from a fresh QPX reply, from one parse (runs in a worker)
+
+    Args:
+        content (bytes): raw QPX response body
+        observed_at (float): epoch the fares were quoted
+        level (int, optional): cache compression level (None: no cache payload)
+        query_fingerprint (str, optional): `qpx_request.fingerprint()` of the query
+        query_shape (str, optional): `qpx_request.shape_fingerprint()` of the query
+        history (bool, optional): build fare history rows
+        alerts (bool, optional): build alert fares
+
+    Note:
+        options are streamed out of `content` (see `qpx_parser.iter_trip_options()`);
+        the cache payload is `content` compressed as is, with nothing
+        interned, since interning would need the whole response decoded
+
+    Returns:
+        (:obj:`dict`): `digest_options()` plus `table` (`FareTable.pack()`),
+            `payload` and `references` (for `FareCache.put_payload()`)
+
+    """
+    trip_options = list(wf_parser.iter_trip_options(content))
+    digest = digest_options(
+        trip_options, observed_at, query_fingerprint, query_shape, history, alerts
+    )
+    digest['table'] = FareTable.from_trip_options(trip_options, keep_options=False).pack()
+    digest['payload'] = None if level is None else wf_codec.compress(content, level)
+    digest['references'] = {}
+    return digest
+
+def _warm_up():
+    """no-op task: forces a worker to start"""
+    return os.getpid()
+
+class ParsePool(object):
+    """process pool turning response payloads into `FareTable`s
+
+    Note:
+        workers are forked once, up front (`start()`), before callers start
+        fetch threads of their own.  Futures resolve to packed tables: see
+        `table()`
+
+    Args:
+        processes (int, optional): worker processes (None: one per core, 0: no pool)
+
+    """
+    def __init__(self, processes=None):
+        if processes is None:
+            processes = os.cpu_count() or 1
+        self.processes = processes
+        self._executor = None
+
+    def start(self):
+        """fork every worker now"""
+        if self.processes and self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.processes)
+            warm_ups = [self._executor.submit(_warm_up) for _ in range(self.processes)]
+            for future in warm_ups:
+                future.result()
+        return self
+
+    def _submit(self, func, *args, **kwargs):
+        """run `func` in a worker (inline without a pool)"""
+        if not self.processes:
+            future = Future()
+            try:
+                future.set_result(func(*args, **kwargs))
+            except Exception as err_msg:
+                future.set_exception(err_msg)
+            return future
+        self.start()
+        return self._executor.submit(func, *args, **kwargs)
+
+    def submit(self, payload, price_filter=None):
+        """parse `payload` in a worker
+
+        Returns:
+            (:obj:`concurrent.futures.Future`): resolves to `parse_payload()` output
+
+        """
+        return self._submit(parse_payload, payload, price_filter)
+
+    def submit_fresh(self, content, observed_at, **kwargs):
+        """work up a fresh QPX reply in a worker (keywords: see `digest_response()`)
+
+        Returns:
+            (:obj:`concurrent.futures.Future`): resolves to `digest_response()` output
+
+        """
+        return self._submit(digest_response, content, observed_at, **kwargs)
+
+    @staticmethod
+    def table(future):
+        """`FareTable` from a finished `submit()` future"""
+        return FareTable.unpack(future.result())
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.close()
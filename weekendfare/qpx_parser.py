@@ -0,0 +1,132 @@
+"""qpx_parser.py
+
+Streaming parser for QPX `trips/search` responses
+
+-- Incremental scan for the `trips.tripOption` array
+-- One `models.TripOption` per `qpxexpress#tripOption`
+-- Early stop on price (QPX sorts options by price)
+
+"""
+import codecs
+import io
+import json
+import re
+
+from weekendfare.models import TripOption
+
+TRIP_OPTION_PATTERN = re.compile(r'"tripOption"\s*:\s*\[')
+CHUNK_SIZE = 64 * 1024
+WHITESPACE = ' \t\r\n'
+
+def _iter_chunks(source, chunk_size):
+    """yield text chunks from str/bytes/file-like source"""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)    #decoded a chunk at a time, never copied whole
+    if isinstance(source, str):
+        for start in range(0, len(source), chunk_size):
+            yield source[start:start + chunk_size]
+        return
+
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    while True:
+        chunk = source.read(chunk_size)
+        if not chunk:
+            tail = decoder.decode(b'', final=True)
+            if tail:
+                yield tail
+            return
+        if isinstance(chunk, bytes):
+            chunk = decoder.decode(chunk)
+        yield chunk
+
+def iter_raw_trip_options(source, chunk_size=CHUNK_SIZE):
+    """yield each `tripOption` dict without loading the whole response
+
+    Note:
+        only the current option (plus one chunk) is held in memory; the
+        `trips.data` block is skipped over, never decoded
+
+    Args:
+        source (str, bytes or file-like): raw QPX response
+        chunk_size (int, optional): characters read per step
+
+    Yields:
+        (:obj:`dict`): one raw `qpxexpress#tripOption`
+
+    """
+    decoder = json.JSONDecoder()
+    chunks = _iter_chunks(source, chunk_size)
+    buffer = ''
+
+    ## Scan forward to the array ##
+    keep = 64   #enough of the tail to catch a key split across chunks
+    for chunk in chunks:
+        buffer += chunk
+        match = TRIP_OPTION_PATTERN.search(buffer)
+        if match:
+            buffer = buffer[match.end():]
+            break
+        buffer = buffer[-keep:]
+    else:
+        return  #no options in response
+
+    ## Decode one element at a time ##
+    exhausted = False
+    while True:
+        position = 0
+        while position < len(buffer) and buffer[position] in WHITESPACE + ',':
+            position += 1
+        if position == len(buffer):
+            if exhausted:
+                raise ValueError('Truncated QPX response: unterminated tripOption array')
+            buffer = ''
+            try:
+                buffer = next(chunks)
+            except StopIteration:
+                exhausted = True
+            continue
+        if buffer[position] == ']':
+            return
+
+        try:
+            option, end = decoder.raw_decode(buffer, position)
+        except ValueError:
+            if exhausted:
+                raise
+            try:
+                buffer = buffer[position:] + next(chunks)
+            except StopIteration:
+                exhausted = True
+                buffer = buffer[position:]
+            continue
+
+        buffer = buffer[end:]
+        yield option
+
+def iter_trip_options(
+        source,
+        price_filter=None,
+        chunk_size=CHUNK_SIZE
+):
+    """stream parsed trip options, stopping once over `price_filter`
+
+    Args:
+        source (:obj:`dict`, str, bytes or file-like): QPX response
+        price_filter (float, optional): max sale total (response currency)
+        chunk_size (int, optional): characters read per step
+
+    Yields:
+        (:obj:`weekendfare.models.TripOption`): trip options, cheapest first
+
+    """
+    if isinstance(source, dict):
+        raw_options = iter(source.get('trips', {}).get('tripOption', []))
+    else:
+        raw_options = iter_raw_trip_options(source, chunk_size)
+
+    max_cents = None if price_filter is None else int(round(price_filter * 100))
+    for option in raw_options:
+        trip_option = TripOption.from_qpx(option)
+        if max_cents is not None and trip_option.price_cents > max_cents:
+            return  #QPX sorts by price: nothing cheaper follows
+        yield trip_option
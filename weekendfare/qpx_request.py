@@ -0,0 +1,230 @@
+"""qpx_request.py
+
+Canonical form and fingerprint of QPX `trips/search` queries
+
+-- Defaults filled from `qpx_query_template.json` (`"default"` keywords)
+-- Known misspelled keys mapped back (`pasengers`, `incantInSeatCount`)
+-- Codes upper-cased, config strings coerced to schema types
+-- Stable sha1 fingerprint: keys cache entries and request dedup
+-- Schema validation with one compiled validator (jsonschema loaded lazily)
+
+"""
+from os import path
+import threading
+import copy
+import hashlib
+import json
+import re
+
+import weekendfare.metrics as wf_metrics
+
+HERE = path.abspath(path.dirname(__file__))
+TEMPLATE_ABSPATH = path.join(HERE, 'qpx_query_template.json')
+
+KEY_ALIASES = {
+    'pasengers': 'passengers',
+    'incantInSeatCount': 'infantInSeatCount'
+}
+UPPER_KEYS = (
+    'origin', 'destination', 'alliance', 'preferredCabin',
+    'saleCountry', 'ticketingCountry', 'maxPrice',
+    'permittedCarrier', 'prohibitedCarrier'
+)
+UNORDERED_KEYS = ('permittedCarrier', 'prohibitedCarrier')
+DATE_PATTERN = re.compile(r'^[0-9]{4}-[0-9]{2}-[0-9]{2}$')  #matches template `date`
+MAX_VALIDATED_SHAPES = 10000
+
+TEMPLATE = None
+VALIDATOR = None
+VALIDATED_SHAPES = set()
+VALIDATED_LOCK = threading.Lock()
+
+class InvalidQuery(ValueError):
+    """QPX query failed `qpx_query_template.json` validation
+
+    Args:
+        errors (:obj:`list` str): every problem found, as `path: message`
+
+    """
+    def __init__(self, errors):
+        self.errors = errors
+        super(InvalidQuery, self).__init__(
+            'Invalid QPX query:\n\t' + '\n\t'.join(errors)
+        )
+
+def get_template():
+    """load `qpx_query_template.json` on first use
+
+    Returns:
+        (:obj:`dict`): QPX query JSON schema
+
+    """
+    global TEMPLATE
+    if TEMPLATE is None:
+        with open(TEMPLATE_ABSPATH, 'r') as template_fh:
+            TEMPLATE = json.load(template_fh)
+    return TEMPLATE
+
+def _coerce(value, schema, key=None):
+    """normalize one scalar against its schema type"""
+    value_type = schema.get('type')
+    if isinstance(value, str):
+        value = value.strip()
+        if key in UPPER_KEYS:
+            value = value.upper()
+        if value_type == 'integer' and value.lstrip('-').isdigit():
+            return int(value)
+        if value_type == 'boolean' and value.lower() in ('true', 'false'):
+            return value.lower() == 'true'
+        return value
+    if value_type == 'boolean' and isinstance(value, int):
+        return bool(value)
+    if value_type == 'integer' and isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+def _normalize(value, schema, key=None):
+    """walk `value` alongside `schema`, filling defaults"""
+    if isinstance(value, dict):
+        properties = schema.get('properties', {})
+        normalized = {}
+        for sub_key, sub_value in value.items():
+            sub_key = KEY_ALIASES.get(sub_key, sub_key)
+            if sub_value is None:
+                continue    #same as leaving it out
+            normalized[sub_key] = _normalize(sub_value, properties.get(sub_key, {}), sub_key)
+        for sub_key, sub_schema in properties.items():
+            if sub_key not in normalized and 'default' in sub_schema:
+                normalized[sub_key] = _normalize(
+                    copy.deepcopy(sub_schema['default']), sub_schema, sub_key
+                )
+        return normalized
+
+    if isinstance(value, (list, tuple)):
+        items = [_normalize(item, schema.get('items', {}), key) for item in value]
+        if key in UNORDERED_KEYS:
+            items = sorted(set(items))
+        return items
+
+    return _coerce(value, schema, key)
+
+def canonicalize(qpx_query):
+    """normalize a QPX query so logically identical queries compare equal
+
+    Note:
+        slice order is kept (it is the itinerary); everything else is
+        order-free.  Unknown keys are kept as-is
+
+    Args:
+        qpx_query (:obj:`dict`): QPX query (`{'request': {...}}` or bare request)
+
+    Returns:
+        (:obj:`dict`): new canonical QPX query (`{'request': {...}}`)
+
+    """
+    request = qpx_query.get('request', qpx_query)
+    request_schema = get_template()['properties']['request']
+    return {'request': _normalize(request, request_schema)}
+
+def fingerprint(qpx_query, canonical=False):
+    """stable hash of a QPX query
+
+    Args:
+        qpx_query (:obj:`dict`): QPX query
+        canonical (bool, optional): `qpx_query` is already `canonicalize()`d
+
+    Returns:
+        (str): sha1 hex digest of the canonical query
+
+    """
+    if not canonical:
+        qpx_query = canonicalize(qpx_query)
+    payload = json.dumps(qpx_query, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+def get_validator():
+    """compile the query template into a validator on first use
+
+    Note:
+        jsonschema is imported here, not at module level: `--help` and
+        cached lookups never pay for it
+
+    Returns:
+        (:obj:`jsonschema.Draft4Validator`): reusable validator
+
+    """
+    global VALIDATOR
+    if VALIDATOR is None:
+        import jsonschema
+        template = get_template()
+        jsonschema.Draft4Validator.check_schema(template)
+        VALIDATOR = jsonschema.Draft4Validator(template)
+    return VALIDATOR
+
+def shape_fingerprint(qpx_query):
+    """fingerprint of a canonical query with slice dates blanked out
+
+    Note:
+        a sweep's queries differ only by date, so they share one shape
+
+    """
+    request = dict(qpx_query['request'])
+    request['slice'] = [
+        {key: value for key, value in qpx_slice.items() if key != 'date'}
+        if isinstance(qpx_slice, dict) else qpx_slice
+        for qpx_slice in request.get('slice', [])
+    ]
+    return fingerprint({'request': request}, canonical=True)
+
+def validate(qpx_query, canonical=False):
+    """canonicalize and check a QPX query against the template
+
+    Note:
+        fast path: once a query shape has passed full validation, queries of
+        the same shape only have their slice dates checked
+
+    Args:
+        qpx_query (:obj:`dict`): QPX query
+        canonical (bool, optional): `qpx_query` is already `canonicalize()`d
+
+    Returns:
+        (:obj:`dict`): canonical QPX query
+
+    Raises:
+        (:obj:`InvalidQuery`): with every error found, not just the first
+
+    """
+    if not canonical:
+        qpx_query = canonicalize(qpx_query)
+    slices = qpx_query['request'].get('slice')
+    shape = None
+    if isinstance(slices, list) and all(isinstance(qpx_slice, dict) for qpx_slice in slices):
+        shape = shape_fingerprint(qpx_query)
+        if shape in VALIDATED_SHAPES and all(
+                isinstance(qpx_slice.get('date'), str) and DATE_PATTERN.match(qpx_slice['date'])
+                for qpx_slice in slices
+        ):
+            wf_metrics.incr('validations', path='fast')
+            return qpx_query
+
+    with wf_metrics.span('validate'):
+        errors = sorted(
+            get_validator().iter_errors(qpx_query),
+            key=lambda error: [str(part) for part in error.path]
+        )
+    wf_metrics.incr('validations', path='full')
+    if errors:
+        raise InvalidQuery([
+            '{0}: {1}'.format(
+                '.'.join(str(part) for part in error.path) or '(root)',
+                error.message
+            )
+            for error in errors
+        ])
+
+    if shape is not None:
+        with VALIDATED_LOCK:
+            if len(VALIDATED_SHAPES) >= MAX_VALIDATED_SHAPES:
+                VALIDATED_SHAPES.clear()
+            VALIDATED_SHAPES.add(shape)
+    return qpx_query
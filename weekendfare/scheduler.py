@@ -0,0 +1,210 @@
+"""scheduler.py
+
+Quota-aware scheduling of QPX requests
+
+-- Token bucket (requests/second with burst)
+-- Per-day quota accounting (`[QPX] query_limit`)
+-- Priority classes: interactive ahead of background
+-- State shared across processes through a locked JSON file
+
+"""
+from os import path, replace
+from datetime import datetime, timedelta
+import itertools
+import threading
+import heapq
+import json
+import time
+
+import weekendfare.utilities as wf_utils
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 10
+DEFAULT_RATE = 1.0          #requests per second, 0 to disable
+DEFAULT_BURST = 5
+DEFAULT_RESERVE = 5         #daily queries background jobs may not touch
+POLL_INTERVAL = 1.0         #seconds between re-reading shared state while queued
+MAX_POLL_INTERVAL = 60.0    #polling backs off to this while the budget stays spent
+
+class QuotaExceeded(Exception):
+    """raised when `acquire()` times out waiting for budget"""
+    pass
+
+def seconds_until_midnight(now):
+    """seconds from timestamp `now` until the next local midnight"""
+    now_dt = datetime.fromtimestamp(now)
+    midnight = datetime.combine(now_dt.date() + timedelta(days=1), datetime.min.time())
+    return (midnight - now_dt).total_seconds()
+
+class QuotaScheduler(object):
+    """gatekeeper between callers and `fetch_query()`
+
+    Note:
+        callers queue in priority order inside a process.  Across processes,
+        background callers are held out of the last `interactive_reserve`
+        queries of the day so a sweep can never starve the CLI
+
+    Args:
+        state_path (str): path to shared state file abspath > relpath
+        daily_limit (int): queries allowed per day (0 for unlimited)
+        rate (float, optional): token refill, requests per second
+        burst (int, optional): token bucket size
+        interactive_reserve (int, optional): daily queries held back for interactive use
+        poll_interval (float, optional): seconds between state re-reads while waiting
+        logger (:obj:`logging.Logger`, optional): logger for tracking quota
+
+    """
+    def __init__(
+            self,
+            state_path,
+            daily_limit,
+            rate=DEFAULT_RATE,
+            burst=DEFAULT_BURST,
+            interactive_reserve=DEFAULT_RESERVE,
+            poll_interval=POLL_INTERVAL,
+            logger=wf_utils.DEFAULT_LOGGER
+    ):
+        self.state_path = state_path
+        self.daily_limit = daily_limit
+        self.rate = rate
+        self.burst = burst
+        self.interactive_reserve = min(interactive_reserve, daily_limit)
+        self.poll_interval = poll_interval
+        self.logger = logger
+
+        self._lock_path = state_path + '.lock'
+        self._cond = threading.Condition()
+        self._queue = []        #heap of (priority, seq) tickets
+        self._counter = itertools.count()
+
+    def _load_state(self, now):
+        """read shared state, rolling over day and refilling tokens
+
+        Note:
+            the refill is worked out from `updated` on every read, so it
+            never needs saving by itself
+
+        Returns:
+            (:obj:`dict`, bool): state, and whether it must be saved (new day)
+
+        """
+        state = {}
+        if path.isfile(self.state_path):
+            try:
+                with open(self.state_path, 'r') as filehandle:
+                    state = json.load(filehandle)
+            except ValueError:
+                self.logger.warning(
+                    'Unable to parse quota state, resetting' +
+                    '\r\tstate_path=%s',
+                    self.state_path
+                )
+
+        today = datetime.fromtimestamp(now).strftime('%Y-%m-%d')
+        rolled_over = state.get('day') != today
+        if rolled_over:
+            state['day'] = today
+            state['used'] = 0
+        elapsed = max(0.0, now - state.get('updated', now))
+        state['tokens'] = min(
+            float(self.burst),
+            state.get('tokens', float(self.burst)) + elapsed * self.rate
+        )
+        state['updated'] = now
+        return state, rolled_over
+
+    def _save_state(self, state):
+        """write shared state (atomic replace)"""
+        tmp_path = self.state_path + '.tmp'
+        with open(tmp_path, 'w') as filehandle:
+            json.dump(state, filehandle)
+        replace(tmp_path, self.state_path)
+
+    def _try_consume(self, priority, now):
+        """take one query from the shared budget
+
+        Note:
+            state is only written when it changed: a consume or a new day
+
+        Returns:
+            (float): 0 if consumed, else seconds until budget may be available
+
+        """
+        with wf_utils.FileLock(self._lock_path):
+            state, rolled_over = self._load_state(now)
+            limit = self.daily_limit
+            if priority > PRIORITY_INTERACTIVE:
+                limit -= self.interactive_reserve
+            wait = 0
+            if self.daily_limit and state['used'] >= limit:
+                wait = seconds_until_midnight(now)
+            elif self.rate and state['tokens'] < 1:
+                wait = (1 - state['tokens']) / self.rate
+            if wait:
+                if rolled_over:
+                    self._save_state(state)
+                return wait
+
+            if self.rate:
+                state['tokens'] -= 1
+            state['used'] += 1
+            self._save_state(state)
+            return 0
+
+    def acquire(self, priority=PRIORITY_BACKGROUND, timeout=None):
+        """wait for budget to send one QPX query
+
+        Args:
+            priority (int, optional): PRIORITY_INTERACTIVE or PRIORITY_BACKGROUND
+            timeout (float, optional): seconds to wait before giving up (default forever)
+
+        Raises:
+            QuotaExceeded: `timeout` passed without budget
+
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        ticket = (priority, next(self._counter))
+        poll_interval = self.poll_interval  #doubles while the budget stays spent
+        with self._cond:
+            heapq.heappush(self._queue, ticket)
+            try:
+                while True:
+                    now = time.time()
+                    wait = self.poll_interval
+                    if self._queue[0] == ticket:
+                        wait = self._try_consume(priority, now)
+                        if not wait:
+                            heapq.heappop(self._queue)
+                            return
+                        self.logger.debug(
+                            'quota: waiting %.1fs priority=%s', wait, priority
+                        )
+                    if deadline is not None:
+                        if now >= deadline:
+                            raise QuotaExceeded(
+                                'No QPX budget within {0}s (limit={1}/day)'.format(
+                                    timeout, self.daily_limit
+                                )
+                            )
+                        wait = min(wait, deadline - now)
+                    self._cond.wait(min(wait, poll_interval))
+                    if wait > poll_interval:
+                        poll_interval = min(poll_interval * 2, MAX_POLL_INTERVAL)
+            except BaseException:
+                self._queue.remove(ticket)
+                heapq.heapify(self._queue)
+                raise
+            finally:
+                self._cond.notify_all()
+
+    def usage(self):
+        """per-day quota accounting
+
+        Returns:
+            (:obj:`dict`): day, used, remaining, tokens
+
+        """
+        with wf_utils.FileLock(self._lock_path):
+            state, _ = self._load_state(time.time())
+        state['remaining'] = max(0, self.daily_limit - state['used']) if self.daily_limit else None
+        return state
@@ -0,0 +1,167 @@
+"""singleflight.py
+
+Coalescing of identical in-flight QPX requests
+
+-- One leader per key does the work, concurrent duplicates wait on its result
+-- In-process: threads share a `threading.Event` per key
+-- Cross-process: striped `utilities.FileLock`, with a cache re-check once held
+-- Long waits inside the work (quota, backoff) let the stripe go: `unlocked()`
+
+"""
+from os import path, makedirs
+import threading
+import zlib
+
+import weekendfare.utilities as wf_utils
+
+DEFAULT_STRIPES = 256
+
+class _Call(object):
+    """one in-flight call, shared by its leader and waiters"""
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class _Filled(Exception):
+    """`recheck()` hit after `SingleFlight.unlocked()`: abandon `func()`"""
+    def __init__(self, result):
+        super(_Filled, self).__init__()
+        self.result = result
+
+class SingleFlight(object):
+    """run a function once per key no matter how many callers ask at once
+
+    Note:
+        waiters get the leader's result object itself (or its exception).
+        Lock files are striped by key hash so the lock directory stays bounded;
+        unrelated keys sharing a stripe only serialize across processes
+
+    Args:
+        lock_dir (str, optional): directory for cross-process lock files
+            (None: coalesce within this process only)
+        lock_stripes (int, optional): number of lock files in `lock_dir`
+        logger (:obj:`logging.Logger`, optional): logger for tracking coalescing
+
+    """
+    def __init__(
+            self,
+            lock_dir=None,
+            lock_stripes=DEFAULT_STRIPES,
+            logger=wf_utils.DEFAULT_LOGGER
+    ):
+        self.lock_dir = lock_dir
+        self.lock_stripes = lock_stripes
+        self.logger = logger
+        self._calls = {}    #key: _Call
+        self._lock = threading.Lock()
+        self.stats = {'led': 0, 'coalesced': 0, 'rechecked': 0}
+        self._held = threading.local()  #`.lock`: (FileLock, recheck) of this thread's `_lead()`
+
+        if lock_dir:
+            makedirs(lock_dir, exist_ok=True)
+
+    def lock_path(self, key):
+        """lock file guarding `key` across processes"""
+        stripe = zlib.crc32(key.encode('utf-8')) % self.lock_stripes
+        return path.join(self.lock_dir, 'flight_{0:03d}.lock'.format(stripe))
+
+    def do(self, key, func, recheck=None, lock_key=None):
+        """run `func()` unless an identical call is already in flight
+
+        Args:
+            key (str): identity of the call (see `qpx_request.fingerprint()`)
+            func (callable): does the work, e.g. the QPX POST
+            recheck (callable, optional): cheap lookup tried once the
+                cross-process lock is held (e.g. the fare cache); a non-None
+                value is returned instead of calling `func()`
+            lock_key (str, optional): cross-process identity, when callers
+                wanting different results for one request use different `key`s
+
+        Returns:
+            (:obj:`object`): result of `func()`/`recheck()`, possibly another caller's
+
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+                self.stats['led'] += 1
+            else:
+                self.stats['coalesced'] += 1
+
+        if not leader:
+            self.logger.debug('--joined in-flight call: %s', key)
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = self._lead(lock_key or key, func, recheck)
+        except Exception as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def _lead(self, key, func, recheck):
+        """leader side: take the cross-process lock, re-check, then work"""
+        if not self.lock_dir or recheck is None:
+            return func()
+
+        file_lock = wf_utils.FileLock(self.lock_path(key))
+        with file_lock:
+            result = recheck()
+            if result is None:
+                self._held.lock = (file_lock, recheck)
+                try:
+                    return func()
+                except _Filled as filled:
+                    result = filled.result
+                finally:
+                    self._held.lock = None
+
+            self.logger.debug('--filled by another process: %s', key)
+            with self._lock:
+                self.stats['rechecked'] += 1
+            return result
+
+    def unlocked(self, wait):
+        """run `wait()` with this thread's cross-process lock let go
+
+        Note:
+            for long waits inside `func()` (quota, backoff) that must not
+            hold up unrelated keys on the same stripe.  The lock is retaken
+            afterwards and `recheck()` run again: if another process filled
+            the result meanwhile, `func()` is abandoned and `do()` returns
+            that instead.  Outside a locked `do()` this just calls `wait()`
+
+        Args:
+            wait (callable): the blocking call, e.g. `QuotaScheduler.acquire()`
+
+        Returns:
+            (:obj:`object`): result of `wait()`
+
+        """
+        held = getattr(self._held, 'lock', None)
+        if held is None:
+            return wait()
+
+        file_lock, recheck = held
+        file_lock.release()
+        try:
+            result = wait()
+        finally:
+            file_lock.acquire()
+        filled = recheck()
+        if filled is not None:
+            raise _Filled(filled)
+        return result
@@ -0,0 +1,366 @@
+"""stub_server.py
+
+Local stand-in for the QPX `trips/search` endpoint, for offline load testing
+
+-- Responses synthesized from `stub_template.json` (shipped with the package)
+   for any route/date/solutions
+-- Configurable latency, error rate, 429 throttling and response size
+-- `GET /stats` reports request/error/throttle counts
+
+Usage:
+    python -m weekendfare.stub_server --port 8765 --latency 0.2 --error-rate 0.05
+    then set `[QPX] base_url = http://127.0.0.1:8765/qpxExpress/v1/trips`
+
+"""
+from datetime import datetime
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+from collections import OrderedDict
+from os import path
+import threading
+import random
+import copy
+import json
+import time
+import zlib
+
+from plumbum import cli
+
+from weekendfare.models import parse_qpx_time, format_qpx_time, price_to_cents, cents_to_price
+
+HERE = path.abspath(path.dirname(__file__))
+TEMPLATE_PATH = path.join(HERE, 'stub_template.json')    #copy of `Tests/demo_response.json`
+DEFAULT_SOLUTIONS = 20
+MAX_SOLUTIONS = 500         #QPX upper limit on `solutions`
+RESPONSE_CACHE_SIZE = 256   #synthesized bodies kept per server
+ROUND_TRIP_DISCOUNT = 0.9   #multi-slice answers cost less than their one-ways
+
+def _shift_time(time_str, seconds):
+    """move a QPX local timestamp, keeping its UTC offset"""
+    epoch, utc_offset = parse_qpx_time(time_str)
+    return format_qpx_time(epoch + seconds, utc_offset)
+
+def _route_factor(qpx_slice):
+    """stable 0.6-1.4 price multiplier per origin/destination/date"""
+    seed = '{origin}|{destination}|{date}'.format(**qpx_slice).upper().encode('utf-8')
+    return 0.6 + (zlib.crc32(seed) % 81) / 100
+
+def _retarget_slice(template_slice, qpx_slice):
+    """copy of a template `sliceInfo` flown on the requested route/date"""
+    new_slice = copy.deepcopy(template_slice)
+    legs = [leg for segment in new_slice['segment'] for leg in segment['leg']]
+    template_date = legs[0]['departureTime'][:10]
+    shift = int((
+        datetime.strptime(qpx_slice['date'], '%Y-%m-%d') -
+        datetime.strptime(template_date, '%Y-%m-%d')
+    ).total_seconds())
+    for leg in legs:
+        leg['departureTime'] = _shift_time(leg['departureTime'], shift)
+        leg['arrivalTime'] = _shift_time(leg['arrivalTime'], shift)
+    legs[0]['origin'] = qpx_slice['origin'].upper()
+    legs[-1]['destination'] = qpx_slice['destination'].upper()
+    return new_slice, shift
+
+def synthesize_response(
+        qpx_query,
+        template,
+        max_solutions=MAX_SOLUTIONS,
+        pad_bytes=0
+):
+    """QPX-shaped response for any query, built from a template response
+
+    Note:
+        template options are reused in price order (cycling with a small
+        markup past the template's count), retargeted to each requested
+        slice and repriced by a stable per-route factor
+
+    Args:
+        qpx_query (:obj:`dict`): QPX query (`{'request': {...}}`)
+        template (:obj:`dict`): single-slice QPX response to copy from
+        max_solutions (int, optional): cap on trip options returned
+        pad_bytes (int, optional): filler added to `trips.data` (response size)
+
+    Returns:
+        (:obj:`dict`): QPX response
+
+    """
+    request = qpx_query.get('request', qpx_query)
+    slices = request.get('slice', [])
+    solutions = min(int(request.get('solutions') or DEFAULT_SOLUTIONS), max_solutions)
+    template_options = template['trips']['tripOption']
+
+    trip_options = []
+    for index in range(solutions if slices else 0):
+        template_option = template_options[index % len(template_options)]
+        cycle = index // len(template_options)
+        base_cents, currency = price_to_cents(template_option['saleTotal'])
+        option = {
+            'kind': template_option['kind'],
+            'id': '{0}-{1}'.format(template_option['id'], index),
+            'slice': [],
+            'pricing': copy.deepcopy(template_option.get('pricing', []))
+        }
+        price_cents = 0
+        for qpx_slice in slices:
+            new_slice, shift = _retarget_slice(template_option['slice'][0], qpx_slice)
+            option['slice'].append(new_slice)
+            price_cents += int(base_cents * _route_factor(qpx_slice)) + cycle * 100
+        if len(slices) > 1:
+            price_cents = int(price_cents * ROUND_TRIP_DISCOUNT)
+        for pricing in option['pricing']:
+            if pricing.get('latestTicketingTime'):
+                pricing['latestTicketingTime'] = _shift_time(pricing['latestTicketingTime'], shift)
+        option['saleTotal'] = cents_to_price(price_cents, currency)
+        trip_options.append((price_cents, index, option))
+
+    trip_options.sort(key=lambda item: item[:2])    #QPX answers cheapest first
+    data = copy.deepcopy(template['trips'].get('data', {}))
+    if pad_bytes:
+        data['padding'] = 'x' * pad_bytes
+    return {
+        'kind': template.get('kind', 'qpxExpress#tripsSearch'),
+        'trips': {
+            'kind': template['trips'].get('kind', 'qpxexpress#tripOptions'),
+            'requestId': '{0:016x}'.format(random.getrandbits(64)),
+            'data': data,
+            'tripOption': [option for _, _, option in trip_options]
+        }
+    }
+
+def error_body(code, reason, message):
+    """Google API style error payload"""
+    return json.dumps({
+        'error': {
+            'errors': [{'domain': 'usageLimits' if code == 429 else 'global', 'reason': reason, 'message': message}],
+            'code': code,
+            'message': message
+        }
+    }).encode('utf-8')
+
+class StubQPXHandler(BaseHTTPRequestHandler):
+    """answers `POST .../search` like QPX, `GET /stats` with counters"""
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status, body, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.split('?')[0].rstrip('/') != '/stats':
+            self._reply(404, error_body(404, 'notFound', 'Not Found'))
+            return
+        self._reply(200, json.dumps(self.server.get_stats()).encode('utf-8'))
+
+    def do_POST(self):
+        server = self.server
+        raw_request = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        server.count('requests')
+        if not self.path.split('?')[0].endswith('/search'):
+            self._reply(404, error_body(404, 'notFound', 'Not Found'))
+            return
+        if not server.take_token():
+            server.count('throttled')
+            self._reply(
+                429,
+                error_body(429, 'rateLimitExceeded', 'Rate Limit Exceeded'),
+                headers={'Retry-After': '1'}
+            )
+            return
+
+        delay, fail = server.roll()
+        if delay:
+            time.sleep(delay)
+        if fail:
+            server.count('errors')
+            self._reply(503, error_body(503, 'backendError', 'Backend Error'))
+            return
+
+        try:
+            body = server.response_for(raw_request)
+        except (ValueError, KeyError, TypeError):
+            server.count('bad_requests')
+            self._reply(400, error_body(400, 'badRequest', 'Invalid Value'))
+            return
+        server.count('ok')
+        self._reply(200, body)
+
+class StubQPXServer(ThreadingMixIn, HTTPServer):
+    """threaded QPX stand-in
+
+    Args:
+        address (:obj:`tuple`): (host, port); port 0 picks a free one
+        template_path (str, optional): single-slice QPX response to synthesize from
+        latency (float, optional): seconds added to every answer
+        jitter (float, optional): up to this many extra seconds, at random
+        error_rate (float, optional): fraction of requests answered 503
+        rate_limit (float, optional): requests per second before 429s (0: unlimited)
+        burst (int, optional): requests allowed at once under `rate_limit`
+        max_solutions (int, optional): cap on trip options per response
+        pad_bytes (int, optional): filler bytes per response
+        seed (int, optional): seed for latency/error randomness
+
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(
+            self,
+            address=('127.0.0.1', 0),
+            template_path=TEMPLATE_PATH,
+            latency=0.0,
+            jitter=0.0,
+            error_rate=0.0,
+            rate_limit=0.0,
+            burst=1,
+            max_solutions=MAX_SOLUTIONS,
+            pad_bytes=0,
+            seed=None
+    ):
+        HTTPServer.__init__(self, address, StubQPXHandler)
+        with open(template_path, 'r') as template_fh:
+            self.template = json.load(template_fh)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.burst = max(1, burst)
+        self.max_solutions = max_solutions
+        self.pad_bytes = pad_bytes
+
+        self._lock = threading.Lock()
+        self._random = random.Random(seed)
+        self._tokens = float(self.burst)
+        self._refilled = time.monotonic()
+        self._responses = OrderedDict()     #raw request: body, LRU
+        self.stats = {'requests': 0, 'ok': 0, 'errors': 0, 'throttled': 0, 'bad_requests': 0}
+
+    @property
+    def base_url(self):
+        """value for `[QPX] base_url`"""
+        return 'http://{0}:{1}/qpxExpress/v1/trips'.format(*self.server_address[:2])
+
+    def count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self.stats)
+
+    def take_token(self):
+        """token bucket for 429 throttling"""
+        if not self.rate_limit:
+            return True
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._refilled) * self.rate_limit)
+            self._refilled = now
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+    def roll(self):
+        """(delay seconds, fail?) for one request"""
+        with self._lock:
+            delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0)
+            fail = self.error_rate and self._random.random() < self.error_rate
+        return delay, fail
+
+    def response_for(self, raw_request):
+        """synthesized response body, memoized per identical request"""
+        with self._lock:
+            body = self._responses.get(raw_request)
+            if body is not None:
+                self._responses.move_to_end(raw_request)
+                return body
+        body = json.dumps(synthesize_response(
+            json.loads(raw_request.decode('utf-8')),
+            self.template,
+            max_solutions=self.max_solutions,
+            pad_bytes=self.pad_bytes
+        )).encode('utf-8')
+        with self._lock:
+            self._responses[raw_request] = body
+            while len(self._responses) > RESPONSE_CACHE_SIZE:
+                self._responses.popitem(last=False)
+        return body
+
+def start_server(host='127.0.0.1', port=0, **settings):
+    """run a `StubQPXServer` on a daemon thread
+
+    Args:
+        host (str, optional): interface to bind
+        port (int, optional): port, 0 picks a free one
+        settings: see `StubQPXServer`
+
+    Returns:
+        (:obj:`StubQPXServer`): running server (`.shutdown()` to stop)
+
+    """
+    server = StubQPXServer((host, port), **settings)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+class StubServer(cli.Application):
+    """Serve fake QPX `trips/search` responses for load testing"""
+    host = cli.SwitchAttr(['--host'], str, default='127.0.0.1', help='Interface to bind')
+    port = cli.SwitchAttr(['-p', '--port'], int, default=8765, help='Port to listen on')
+    template = cli.SwitchAttr(
+        ['--template'],
+        str,
+        default=TEMPLATE_PATH,
+        help='QPX response to synthesize from'
+    )
+    latency = cli.SwitchAttr(['--latency'], float, default=0.0, help='Seconds added to every answer')
+    jitter = cli.SwitchAttr(['--jitter'], float, default=0.0, help='Up to this many extra seconds')
+    error_rate = cli.SwitchAttr(['--error-rate'], float, default=0.0, help='Fraction answered 503')
+    rate_limit = cli.SwitchAttr(
+        ['--rate-limit'],
+        float,
+        default=0.0,
+        help='Requests per second before answering 429 (0: unlimited)'
+    )
+    burst = cli.SwitchAttr(['--burst'], int, default=5, help='Requests allowed at once under --rate-limit')
+    max_solutions = cli.SwitchAttr(
+        ['--max-solutions'],
+        int,
+        default=MAX_SOLUTIONS,
+        help='Cap on trip options per response'
+    )
+    pad_bytes = cli.SwitchAttr(['--pad-bytes'], int, default=0, help='Filler bytes per response')
+    seed = cli.SwitchAttr(['--seed'], int, help='Seed for latency/error randomness')
+
+    def main(self):
+        """serve until interrupted"""
+        server = StubQPXServer(
+            (self.host, self.port),
+            template_path=self.template,
+            latency=self.latency,
+            jitter=self.jitter,
+            error_rate=self.error_rate,
+            rate_limit=self.rate_limit,
+            burst=self.burst,
+            max_solutions=self.max_solutions,
+            pad_bytes=self.pad_bytes,
+            seed=self.seed
+        )
+        print('stub QPX at ' + server.base_url)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            print(json.dumps(server.get_stats()))
+
+if __name__ == '__main__':
+    StubServer.run()
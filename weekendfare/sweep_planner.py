@@ -0,0 +1,144 @@
+"""sweep_planner.py
+
+Branch-and-bound search for the cheapest fares across many route/dates
+
+-- Candidates ranked by a lower bound (cached price, or history estimate)
+-- Fetch the most promising candidates first, in small batches
+-- Stop once no remaining bound can beat the current best N or the price cap
+
+"""
+import logging
+import heapq
+
+import weekendfare.utilities as wf_utils
+
+DEFAULT_MARGIN = 0.15   #history estimates are discounted this much to act as lower bounds
+
+class Candidate(object):
+    """one route/date the sweep could query
+
+    Args:
+        key (:obj:`tuple`): identity, like `('SEA', 'DEN', '2017-01-13')`
+        query (:obj:`dict`): QPX query answering it
+        bound (int, optional): lower bound on its price, cents (0: nothing known)
+        price (int, optional): known price, cents (e.g. from a fresh cache entry)
+
+    """
+    __slots__ = ('key', 'query', 'bound', 'price')
+
+    def __init__(self, key, query, bound=0, price=None):
+        self.key = key
+        self.query = query
+        self.bound = bound
+        self.price = price
+
+    def __repr__(self):
+        return '<Candidate {0} bound={1} price={2}>'.format(
+            '/'.join(self.key), self.bound, self.price
+        )
+
+def estimate_bound(estimates, margin=DEFAULT_MARGIN):
+    """discounted lowest estimate, in cents (0 when nothing is known)
+
+    Note:
+        past fares are not a true lower bound, `margin` leaves room for
+        prices to drop before a candidate is written off
+
+    Args:
+        estimates (:obj:`list` int): prices seen for the candidate (None ignored)
+        margin (float, optional): fraction taken off the lowest estimate
+
+    Returns:
+        (int): lower bound, cents
+
+    """
+    estimates = [estimate for estimate in estimates if estimate is not None]
+    if not estimates:
+        return 0
+    return int(min(estimates) * (1 - margin))
+
+class SweepResult(object):
+    """outcome of `branch_and_bound()`
+
+    Args:
+        best (:obj:`list` :obj:`Candidate`): cheapest candidates with a price, best first
+        fetched (int): candidates queried
+        pruned (int): candidates never queried because they could not win
+        known (int): candidates answered without a query
+
+    """
+    __slots__ = ('best', 'fetched', 'pruned', 'known')
+
+    def __init__(self, best, fetched, pruned, known):
+        self.best = best
+        self.fetched = fetched
+        self.pruned = pruned
+        self.known = known
+
+def branch_and_bound(
+        candidates,
+        fetch_prices,
+        best_count=1,
+        price_cap=None,
+        batch_size=1,
+        logger=wf_utils.DEFAULT_LOGGER
+):
+    """find the `best_count` cheapest candidates with as few fetches as possible
+
+    Args:
+        candidates (:obj:`list` :obj:`Candidate`): everything the sweep could query
+        fetch_prices (callable): `fetch_prices(candidates)` yields
+            `(candidate, price_cents or None)` for each candidate given
+        best_count (int, optional): how many winners to keep
+        price_cap (int, optional): most a winner may cost, cents
+        batch_size (int, optional): candidates fetched together (concurrency)
+        logger (:obj:`logging.Logger`, optional): logger for tracking search
+
+    Returns:
+        (:obj:`SweepResult`): winners and call accounting
+
+    """
+    priced = []
+    queue = []
+    for sequence, candidate in enumerate(candidates):
+        if candidate.price is not None:
+            priced.append(candidate)
+        else:
+            queue.append((candidate.bound, sequence, candidate))
+    heapq.heapify(queue)
+    known = len(priced)
+
+    def threshold():
+        """a candidate must cost less than this to matter"""
+        limit = float('inf') if price_cap is None else price_cap + 1
+        prices = heapq.nsmallest(
+            best_count,
+            (candidate.price for candidate in priced if candidate.price < limit)
+        )
+        if len(prices) == best_count:
+            limit = min(limit, prices[-1])
+        return limit
+
+    fetched = 0
+    while queue and queue[0][0] < threshold():
+        limit = threshold()
+        batch = []
+        while queue and len(batch) < batch_size and queue[0][0] < limit:
+            batch.append(heapq.heappop(queue)[2])
+        for candidate, price in fetch_prices(batch):
+            fetched += 1
+            if price is not None:
+                candidate.price = price
+                priced.append(candidate)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('--fetched %s, best so far %s', fetched, threshold())
+
+    best = heapq.nsmallest(
+        best_count,
+        (
+            candidate for candidate in priced
+            if price_cap is None or candidate.price <= price_cap
+        ),
+        key=lambda candidate: candidate.price
+    )
+    return SweepResult(best, fetched, len(queue), known)
@@ -0,0 +1,92 @@
+"""trip_planner.py
+
+Answer multi-slice (round-trip) queries from one-way results
+
+-- Split a multi-slice query into one single-slice query per slice
+-- Combine cheapest one-way options into whole itineraries
+-- Combinations are flagged `TripOption.composed`: separate tickets, not QPX pricing
+
+"""
+from itertools import product
+import heapq
+
+from weekendfare.models import TripOption
+
+PER_SLICE = 10          #cheapest one-ways per slice considered for combinations
+MIN_CONNECTION = 60     #minutes between arriving on one ticket and departing on the next
+
+def slice_queries(qpx_query):
+    """one single-slice query per slice, sharing every other request field
+
+    Args:
+        qpx_query (:obj:`dict`): QPX query (`{'request': {...}}`)
+
+    Returns:
+        (:obj:`list` :obj:`dict`): QPX queries, in slice order
+
+    """
+    request = qpx_query.get('request', qpx_query)
+    slice_list = []
+    for qpx_slice in request.get('slice', []):
+        slice_request = dict(request)
+        slice_request['slice'] = [qpx_slice]
+        slice_list.append({'request': slice_request})
+    return slice_list
+
+def _connects(trip_options, min_connection):
+    """each ticket departs after the previous one lands"""
+    for previous, following in zip(trip_options, trip_options[1:]):
+        if following.slices[0].departure < previous.slices[-1].arrival + min_connection * 60:
+            return False
+    return True
+
+def compose_trip_options(
+        per_slice_options,
+        limit=None,
+        per_slice=PER_SLICE,
+        min_connection=MIN_CONNECTION
+):
+    """cheapest combinations of separate one-way options
+
+    Note:
+        only the `per_slice` cheapest options of each slice are combined, and
+        every option of a combination must share a currency
+
+    Args:
+        per_slice_options (:obj:`list` :obj:`list` :obj:`weekendfare.models.TripOption`):
+            one-way options for each slice, cheapest first
+        limit (int, optional): combinations to return (default all)
+        per_slice (int, optional): options per slice to consider
+        min_connection (int, optional): minutes between consecutive tickets
+
+    Returns:
+        (:obj:`list` :obj:`weekendfare.models.TripOption`): composed options, cheapest first
+
+    """
+    if not per_slice_options or not all(per_slice_options):
+        return []
+
+    candidates = [trip_options[:per_slice] for trip_options in per_slice_options]
+    composed = []
+    for combination in product(*candidates):
+        if len(set(trip_option.currency for trip_option in combination)) != 1:
+            continue
+        if not _connects(combination, min_connection):
+            continue
+        ticketing_times = [
+            trip_option.latest_ticketing for trip_option in combination
+            if trip_option.latest_ticketing is not None
+        ]
+        composed.append(TripOption(
+            '+'.join(str(trip_option.id) for trip_option in combination),
+            sum(trip_option.price_cents for trip_option in combination),
+            combination[0].currency,
+            [qpx_slice for trip_option in combination for qpx_slice in trip_option.slices],
+            refundable=all(trip_option.refundable for trip_option in combination),
+            latest_ticketing=min(ticketing_times) if ticketing_times else None,
+            composed=True
+        ))
+
+    if limit is None:
+        return sorted(composed)
+    return heapq.nsmallest(limit, composed)
@@ -2,9 +2,10 @@
 
 Helper functions for WeekendFare project
 
--- Logger
+-- Logger (optionally queue-based: writes off the calling thread)
 -- Config parser
 -- Requests helper
+-- Cross-process file lock
 
 """
 from os import path, makedirs, access, W_OK#, R_OK
@@ -12,9 +13,16 @@ import configparser
 from configparser import ExtendedInterpolation
 import warnings
 import logging
-from logging.handlers import TimedRotatingFileHandler
-
-import requests
+from logging.handlers import TimedRotatingFileHandler, QueueHandler, QueueListener
+import atexit
+import queue
+import copy
+import time
+try:
+    import fcntl
+except ImportError:     #windows
+    fcntl = None
+    import msvcrt
 
 HERE = path.abspath(path.dirname(__file__))
 
@@ -80,12 +88,54 @@ def get_local_config_filepath(
 DEFAULT_LOG_PATH = path.join(path.dirname(HERE), 'logs')
 LOG_FORMAT_DEFAULT = '[%(asctime)s;%(levelname)s;%(filename)s;%(funcName)s;%(lineno)s] %(message)s'
 LOG_FORMAT_STDOUT = '[%(levelname)s:%(filename)s--%(funcName)s:%(lineno)s] %(message)s'
+class DeferredQueueHandler(QueueHandler):
+    """enqueue records for a `QueueListener`, formatting nothing but the message
+
+    Note:
+        the calling thread only merges `%` args into the message (so later
+        changes to args cannot leak in) and enqueues; timestamps,
+        tracebacks, rotation and file writes happen on the listener thread.
+        Closing the handler stops its listener, flushing queued records
+
+    Args:
+        log_queue (:obj:`queue.Queue`): queue shared with `listener`
+        listener (:obj:`logging.handlers.QueueListener`): writer thread
+
+    """
+    def __init__(self, log_queue, listener):
+        QueueHandler.__init__(self, log_queue)
+        self.listener = listener
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def close(self):
+        if self.listener is not None:
+            self.listener.stop()
+            for handler in self.listener.handlers:
+                handler.close()
+            self.listener = None
+        if self in QUEUE_HANDLERS:
+            QUEUE_HANDLERS.remove(self)
+        QueueHandler.close(self)
+
+QUEUE_HANDLERS = []     #flushed at exit, see `stop_log_queues()`
+def stop_log_queues():
+    """stop every queue listener, writing out whatever is still queued"""
+    while QUEUE_HANDLERS:
+        QUEUE_HANDLERS[-1].close()
+atexit.register(stop_log_queues)
+
 def create_logger(
         log_name,
         config=configparser.ConfigParser(), #default null ConfigParser
         log_path=DEFAULT_LOG_PATH,
         log_to_stdout=False,
-        log_level_override='INFO'
+        log_level_override='INFO',
+        log_queue=None
 ):
     """creates logging handle for easy logging commands
 
@@ -95,6 +145,8 @@ def create_logger(
         log_path (str): path to logfile abspath > relpath
         log_to_stdout (bool, optional): enable std_out logging
         log_level_override (str): log level override setting (for debug printing)
+        log_queue (bool, optional): hand records to a background writer thread
+            (default `[LOGGING] log_queue`, else off)
 
     Returns:
         (:obj:`logging.logger`): logging object for print() replacement
@@ -109,6 +161,8 @@ def create_logger(
         log_path  = logging_cfg.get('log_path', log_path)
     log_freq  = logging_cfg.get('log_freq', 'midnight')
     log_total = int(logging_cfg.get('log_total', 30))
+    if log_queue is None:
+        log_queue = str(logging_cfg.get('log_queue', 'false')).lower() == 'true'
 
     logger = logging.getLogger(log_name)
     log_path = test_logpath(log_path)
@@ -123,7 +177,7 @@ def create_logger(
     general_formatter = logging.Formatter(LOG_FORMAT_DEFAULT)
     general_handler.setFormatter(general_formatter)
     logger.setLevel(log_level)
-    logger.addHandler(general_handler)
+    handlers = [general_handler]
 
     if log_to_stdout:
         #Replaces print() functionality
@@ -132,8 +186,23 @@ def create_logger(
         debug_handler = logging.StreamHandler()
         debug_handler.setFormatter(debug_formatter)
         debug_handler.setLevel(logging.getLevelName('DEBUG'))
-
-        logger.addHandler(debug_handler)
+        handlers.append(debug_handler)
+
+    if not log_queue:
+        for handler in handlers:
+            logger.addHandler(handler)
+        return logger
+
+    for handler in logger.handlers[:]:  #rebuilding: retire the old writer thread
+        if isinstance(handler, DeferredQueueHandler):
+            logger.removeHandler(handler)
+            handler.close()
+    record_queue = queue.Queue(-1)
+    listener = QueueListener(record_queue, *handlers, respect_handler_level=True)
+    queue_handler = DeferredQueueHandler(record_queue, listener)
+    listener.start()
+    QUEUE_HANDLERS.append(queue_handler)
+    logger.addHandler(queue_handler)
 
     return logger
 
@@ -195,10 +264,115 @@ def test_logpath(log_path, debug_mode=False):
     return log_path
 
 USER_AGENT = 'WeekendFare https://github.com/ToraWah/WeekendFare'
+DEFAULT_POOL_SIZE = 10
+DEFAULT_TIMEOUT = 30            #seconds
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF = 0.5           #seconds, doubles each retry
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+RETRY_METHODS = ('GET', 'POST')
+def build_session(
+        pool_size=DEFAULT_POOL_SIZE,
+        retries=DEFAULT_RETRIES,
+        backoff=DEFAULT_BACKOFF,
+        retry_methods=RETRY_METHODS
+):
+    """build keep-alive session with a connection pool and retry/backoff
+
+    Note:
+        retries cover connection errors and RETRY_STATUS_CODES (5xx/429),
+        honoring `Retry-After` headers.  Status and read retries only apply
+        to `retry_methods`: leave POST out when every send has to be counted
+        against a quota (see `WeekendFare.fetch_query()`)
+
+    Args:
+        pool_size (int, optional): connections kept alive per host
+        retries (int, optional): max retries per request
+        backoff (float, optional): backoff factor between retries
+        retry_methods (:obj:`tuple` str, optional): HTTP methods retried on a bad status
+
+    Returns:
+        (:obj:`requests.Session`): session to pass to fetch helpers
+
+    """
+    import requests
+    from requests.adapters import HTTPAdapter
+    from requests.packages.urllib3.util.retry import Retry
+
+    retry_kwargs = dict(
+        total=retries,
+        backoff_factor=backoff,
+        status_forcelist=RETRY_STATUS_CODES,
+        raise_on_status=False
+    )
+    try:
+        retry = Retry(allowed_methods=frozenset(retry_methods), **retry_kwargs)
+    except TypeError:   #urllib3<1.26
+        retry = Retry(method_whitelist=frozenset(retry_methods), **retry_kwargs)
+
+    adapter = HTTPAdapter(
+        pool_connections=pool_size,
+        pool_maxsize=pool_size,
+        max_retries=retry
+    )
+    session = requests.Session()
+    session.headers['User-Agent'] = USER_AGENT
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+DEFAULT_SESSION = None
+def get_default_session():
+    """shared session for callers that do not pass their own
+
+    Returns:
+        (:obj:`requests.Session`): module-level session
+
+    """
+    global DEFAULT_SESSION
+    if DEFAULT_SESSION is None:
+        DEFAULT_SESSION = build_session()
+    return DEFAULT_SESSION
+
+class BadStatusCode(Exception):
+    """non-200 reply from `fetch_GET_request()`/`fetch_POST_request()`
+
+    Args:
+        status_code (int): HTTP status of the reply
+        retry_after (float, optional): seconds asked for by a `Retry-After` header
+
+    """
+    def __init__(self, status_code, retry_after=None):
+        super(BadStatusCode, self).__init__('BAD STATUS CODE ' + str(status_code))
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+def retry_after(request):
+    """seconds in a reply's `Retry-After` header, None if absent or a date"""
+    try:
+        return max(float(request.headers.get('Retry-After')), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+def record_transfer(request):
+    """count one HTTP exchange and its bytes in `weekendfare.metrics`
+
+    Args:
+        request (:obj:`requests.Response`): completed response
+
+    """
+    import weekendfare.metrics as wf_metrics
+    method = request.request.method if request.request is not None else 'GET'
+    body = request.request.body if request.request is not None else None
+    wf_metrics.incr('http_requests', method=method, status=request.status_code)
+    wf_metrics.incr('http_bytes_sent', len(body or b''), method=method)
+    wf_metrics.incr('http_bytes_received', len(request.content or b''), method=method)
+
 def fetch_GET_request(
         url: str,
         params=None,
-        logger=DEFAULT_LOGGER
+        logger=DEFAULT_LOGGER,
+        session=None,
+        timeout=DEFAULT_TIMEOUT
 ):
     """helper for generic GET requests
 
@@ -206,48 +380,61 @@ def fetch_GET_request(
         url (str): full URL of desired endpoint
         params (dict): key/value param pairs
         logger (:obj:`logging.Logger`, optional): logger for tracking requests
+        session (:obj:`requests.Session`, optional): pooled session (see `build_session()`)
+        timeout (float, optional): seconds to wait on connect/read
 
     Returns:
         (:obj:`requests.request`): if good, returns request object
 
     """
-    logger.debug('fetching: ' + url)
+    import requests #deferred: only pay import cost when fetching
+    import weekendfare.metrics as wf_metrics
+    logger.debug('fetching: %s', url)
+    session = session or get_default_session()
     request = None
     header = {
         'User-Agent': USER_AGENT
     }
 
     try:
-        request = requests.get(
-            url,
-            params=params,
-            headers=header
-        )
+        with wf_metrics.span('http_request', method='GET'):
+            request = session.get(
+                url,
+                params=params,
+                headers=header,
+                timeout=timeout
+            )
     except Exception as err_msg:
+        wf_metrics.incr('http_requests', method='GET', status='error')
         logger.error(
             'EXCEPTION: unable to parse payload' +
-            '\r\turl={0}'.format(url),
+            '\r\turl=%s',
+            url,
             exc_info=True
         )
-        logger.debug(request.text)
         raise err_msg
 
+    record_transfer(request)
     if request.status_code == requests.codes.ok:
         return request
     else:
         logger.error(
             'EXCEPTION: bad status code' +
-            '\r\texception={0}'.format(request.status_code) +
-            '\r\turl={0}'.format(url)
+            '\r\texception=%s' +
+            '\r\turl=%s',
+            request.status_code, url
         )
-        logger.debug(request.text)
-        raise Exception('BAD STATUS CODE ' + str(request.status_code))
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(request.text)
+        raise BadStatusCode(request.status_code, retry_after(request))
 
 def fetch_POST_request(
         url: str,
         payload: dict,
         params=None,
-        logger=DEFAULT_LOGGER
+        logger=DEFAULT_LOGGER,
+        session=None,
+        timeout=DEFAULT_TIMEOUT
 ):
     """helper for generic POST requests
 
@@ -256,43 +443,122 @@ def fetch_POST_request(
         payload (:obj:`dict`): JSON-serializable payload for POST request
         params (dict): key/value param pairs
         logger (:obj:`logging.Logger`, optional): logger for tracking requests
+        session (:obj:`requests.Session`, optional): pooled session (see `build_session()`)
+        timeout (float, optional): seconds to wait on connect/read
 
     Returns:
         (:obj:`requests.request`): if good, returns request object
 
     """
-    logger.debug('fetching: ' + url)
+    import requests #deferred: only pay import cost when fetching
+    import weekendfare.metrics as wf_metrics
+    logger.debug('fetching: %s', url)
+    session = session or get_default_session()
     request = None
     header = {
         'User-Agent': USER_AGENT
     }
 
     try:
-        request = requests.post(
-            url,
-            params=params,
-            json=payload,
-            headers=header
-        )
+        with wf_metrics.span('http_request', method='POST'):
+            request = session.post(
+                url,
+                params=params,
+                json=payload,
+                headers=header,
+                timeout=timeout
+            )
     except Exception as err_msg:
+        wf_metrics.incr('http_requests', method='POST', status='error')
         logger.error(
             'EXCEPTION: unable to parse payload' +
-            '\r\turl={0}'.format(url) +
-            '\r\tpayload={0}'.format(payload),
+            '\r\turl=%s' +
+            '\r\tpayload=%s',
+            url, payload,
             exc_info=True
         )
-        logger.debug(request.text)
         raise err_msg
 
+    record_transfer(request)
     if request.status_code == requests.codes.ok:
         return request
     else:
         logger.error(
             'EXCEPTION: bad status code' +
-            '\r\texception={0}'.format(request.status_code) +
-            '\r\turl={0}'.format(url) +
-            '\r\tpayload={0}'.format(payload)
+            '\r\texception=%s' +
+            '\r\turl=%s' +
+            '\r\tpayload=%s',
+            request.status_code, url, payload
         )
-        logger.debug(request.text)
-        raise Exception('BAD STATUS CODE ' + str(request.status_code))
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(request.text)
+        raise BadStatusCode(request.status_code, retry_after(request))
+
+
+class FileLock(object):
+    """advisory cross-process lock on a sidecar file
+
+    Note:
+        `fcntl.flock` on POSIX, `msvcrt.locking` on windows.  Each instance
+        opens its own handle, so threads in one process also exclude each other
+
+    Args:
+        lock_path (str): path to lock file abspath > relpath (created if missing)
+        poll_interval (float, optional): seconds between retries on windows
+
+    """
+    def __init__(self, lock_path, poll_interval=0.05):
+        self.lock_path = lock_path
+        self.poll_interval = poll_interval
+        self._filehandle = None
+
+    def acquire(self, blocking=True):
+        """take the lock
 
+        Args:
+            blocking (bool, optional): wait for lock instead of failing
+
+        Returns:
+            (bool): lock acquired
+
+        """
+        filehandle = open(self.lock_path, 'a+')
+        try:
+            if fcntl:
+                flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+                fcntl.flock(filehandle.fileno(), flags)
+            else:
+                filehandle.seek(0)
+                while True:
+                    try:
+                        msvcrt.locking(filehandle.fileno(), msvcrt.LK_NBLCK, 1)
+                        break
+                    except OSError:
+                        if not blocking:
+                            raise
+                        time.sleep(self.poll_interval)
+        except OSError:
+            filehandle.close()
+            return False
+
+        self._filehandle = filehandle
+        return True
+
+    def release(self):
+        """drop the lock"""
+        if self._filehandle is None:
+            return
+        if fcntl:
+            fcntl.flock(self._filehandle.fileno(), fcntl.LOCK_UN)
+        else:
+            self._filehandle.seek(0)
+            msvcrt.locking(self._filehandle.fileno(), msvcrt.LK_UNLCK, 1)
+        self._filehandle.close()
+        self._filehandle = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
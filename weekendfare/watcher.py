@@ -0,0 +1,323 @@
+"""watcher.py
+
+Long-running watch daemon: keeps routes fresh, answers queries over a socket
+
+-- Watchlist of routes and date windows (JSON file)
+-- Hashed timer wheel schedules each entry's next refresh
+-- Local TCP socket, one JSON request/response per line
+-- Fetching/answering is passed in: the daemon only schedules and serves
+
+"""
+from socketserver import ThreadingMixIn, TCPServer, StreamRequestHandler
+import threading
+import socket
+import json
+import math
+import time
+
+import weekendfare.utilities as wf_utils
+
+DEFAULT_TICK = 1.0      #seconds per timer wheel slot
+DEFAULT_SLOTS = 512     #one revolution: ~8.5 minutes at 1s ticks
+DEFAULT_PORT = 8766
+RETRY_DELAY = 60        #seconds before retrying a refresh that raised
+
+class TimerWheel(object):
+    """hashed timing wheel: O(1) schedule, O(due) per tick
+
+    Note:
+        delays longer than one revolution stay in their slot until the
+        wheel comes round to their due tick
+
+    Args:
+        tick (float, optional): seconds per slot
+        slots (int, optional): slots per revolution
+        now (float, optional): start time override (for testing)
+
+    """
+    def __init__(self, tick=DEFAULT_TICK, slots=DEFAULT_SLOTS, now=None):
+        self.tick = tick
+        self._slots = [[] for _ in range(slots)]
+        self._current = int((time.time() if now is None else now) / tick)
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._count
+
+    def schedule(self, delay, item, now=None):
+        """run `item` `delay` seconds from now (next tick at the soonest)
+
+        Args:
+            delay (float): seconds from `now`
+            item: anything; handed back by `advance()`
+            now (float, optional): timestamp override (for testing)
+
+        """
+        now = time.time() if now is None else now
+        due = int(math.ceil((now + delay) / self.tick))
+        with self._lock:
+            due = max(due, self._current + 1)
+            self._slots[due % len(self._slots)].append((due, item))
+            self._count += 1
+
+    def advance(self, now=None):
+        """move the wheel up to `now`
+
+        Args:
+            now (float, optional): timestamp override (for testing)
+
+        Returns:
+            (:obj:`list`): items now due, in due order
+
+        """
+        now = time.time() if now is None else now
+        target = int(now / self.tick)
+        due_items = []
+        with self._lock:
+            if target <= self._current:
+                return due_items
+            passed = min(target - self._current, len(self._slots))   #a full turn visits every slot
+            for tick in range(self._current + 1, self._current + 1 + passed):
+                slot = self._slots[tick % len(self._slots)]
+                if not slot:
+                    continue
+                waiting = []
+                for entry in slot:
+                    (due_items if entry[0] <= target else waiting).append(entry)
+                slot[:] = waiting
+            self._current = target
+            self._count -= len(due_items)
+        due_items.sort(key=lambda entry: entry[0])
+        return [item for _, item in due_items]
+
+class WatchEntry(object):
+    """one watchlist line: routes from `origin` over a date window
+
+    Args:
+        origin (str): origin airport code
+        destinations (:obj:`list` str): destination airport codes
+        weeks (int, optional): Fri/Sat/Sun departures this many weeks ahead
+        date_from (str, optional): YYYY-MM-DD first departure (with `date_until`)
+        date_until (str, optional): YYYY-MM-DD last departure
+        every (int, optional): seconds between refreshes, at least (default: config)
+
+    """
+    __slots__ = ('origin', 'destinations', 'weeks', 'date_from', 'date_until', 'every')
+
+    def __init__(
+            self,
+            origin,
+            destinations,
+            weeks=None,
+            date_from=None,
+            date_until=None,
+            every=None
+    ):
+        self.origin = origin
+        self.destinations = destinations
+        self.weeks = weeks
+        self.date_from = date_from
+        self.date_until = date_until
+        self.every = every
+
+    def __repr__(self):
+        window = '{0}w'.format(self.weeks) if self.weeks else '{0}..{1}'.format(
+            self.date_from, self.date_until
+        )
+        return '<WatchEntry {0}->{1} {2}>'.format(self.origin, ','.join(self.destinations), window)
+
+def load_watchlist(watchlist_path):
+    """read watch entries from a JSON list
+
+    Note:
+        each item is `{"origin": "SEA", "to": ["DEN", "LAX"], "weeks": 4}` or
+        `{"origin": "SEA", "to": "DEN", "from": "2017-01-13", "until": "2017-01-15"}`,
+        plus an optional `"every"` (seconds)
+
+    Args:
+        watchlist_path (str): path to watchlist abspath > relpath
+
+    Returns:
+        (:obj:`list` :obj:`WatchEntry`): entries in file order
+
+    Raises:
+        (:obj:`ValueError`): malformed entry (which, and why)
+
+    """
+    with open(watchlist_path, 'r') as watchlist_fh:
+        items = json.load(watchlist_fh)
+
+    entries = []
+    for index, item in enumerate(items):
+        destinations = item.get('to')
+        if isinstance(destinations, str):
+            destinations = destinations.split(',')
+        if not item.get('origin') or not destinations:
+            raise ValueError('watchlist[{0}]: "origin" and "to" are required'.format(index))
+        if not item.get('weeks') and not (item.get('from') and item.get('until')):
+            raise ValueError('watchlist[{0}]: needs "weeks" or "from"/"until"'.format(index))
+        entries.append(WatchEntry(
+            item['origin'].strip().upper(),
+            [destination.strip().upper() for destination in destinations],
+            weeks=item.get('weeks'),
+            date_from=item.get('from'),
+            date_until=item.get('until'),
+            every=item.get('every')
+        ))
+    return entries
+
+class WatchRequestHandler(StreamRequestHandler):
+    """one JSON request per line in, one JSON response per line out"""
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            response = self.server.watch_daemon.dispatch(line)
+            self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+            self.wfile.flush()
+
+class WatchServer(ThreadingMixIn, TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class WatchDaemon(object):
+    """refresh watch entries on a timer wheel, answer socket queries meanwhile
+
+    Note:
+        refreshes run one entry at a time on the `run()` thread (each
+        refresh may fan out, e.g. `fetch_batch()`); socket queries are
+        answered on their own threads against the same warm cache/session.
+        Socket commands: `{"cmd": "status"}`, `{"cmd": "stop"}`, anything
+        else goes to `answer`
+
+    Args:
+        refresh (callable): `refresh(entry)` fetches an entry, returns seconds until the next one
+        answer (callable): `answer(request)` returns a JSON-ready dict for a socket query
+        address (:obj:`tuple`, optional): (host, port) to listen on; port 0 picks one
+        tick (float, optional): timer wheel resolution, seconds
+        logger (:obj:`logging.Logger`, optional): logger for tracking daemon
+
+    """
+    def __init__(
+            self,
+            refresh,
+            answer,
+            address=('127.0.0.1', DEFAULT_PORT),
+            tick=DEFAULT_TICK,
+            logger=wf_utils.DEFAULT_LOGGER
+    ):
+        self.refresh = refresh
+        self.answer = answer
+        self.address = address
+        self.logger = logger
+        self.wheel = TimerWheel(tick)
+        self.server = None
+        self.started = time.time()
+        self.stats = {'refreshes': 0, 'refresh_errors': 0, 'queries': 0, 'query_errors': 0}
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    def watch(self, entry, delay=0):
+        """schedule `entry`'s first refresh"""
+        self.wheel.schedule(delay, entry)
+
+    def start(self):
+        """open the socket (serving on a background thread)
+
+        Returns:
+            (:obj:`tuple`): (host, port) actually bound
+
+        """
+        self.server = WatchServer(self.address, WatchRequestHandler)
+        self.server.watch_daemon = self
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.address = self.server.server_address[:2]
+        self.logger.info('watch: listening on %s:%s', *self.address)
+        return self.address
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def dispatch(self, line):
+        """answer one raw request line"""
+        try:
+            request = json.loads(line.decode('utf-8'))
+            command = request.get('cmd')
+            if command == 'status':
+                return dict(self.status(), ok=True)
+            if command == 'stop':
+                self.stop()
+                return {'ok': True}
+            self._count('queries')
+            return dict(self.answer(request), ok=True)
+        except Exception as err_msg:
+            self._count('query_errors')
+            self.logger.warning('watch: bad query %r', line, exc_info=True)
+            return {'ok': False, 'error': str(err_msg)}
+
+    def status(self):
+        """uptime, scheduled entries and counters"""
+        with self._lock:
+            stats = dict(self.stats)
+        stats['uptime'] = round(time.time() - self.started, 1)
+        stats['scheduled'] = len(self.wheel)
+        return stats
+
+    def run_due(self, now=None):
+        """refresh every entry now due and reschedule it
+
+        Returns:
+            (int): entries refreshed
+
+        """
+        due = self.wheel.advance(now)
+        for entry in due:
+            try:
+                delay = self.refresh(entry)
+                self._count('refreshes')
+            except Exception:
+                self.logger.error(
+                    'EXCEPTION: watch refresh failed' +
+                    '\r\tentry=%s',
+                    entry,
+                    exc_info=True
+                )
+                self._count('refresh_errors')
+                delay = RETRY_DELAY
+            self.wheel.schedule(delay, entry, now)
+        return len(due)
+
+    def run(self):
+        """refresh due entries every tick until `stop()`"""
+        while not self._stop.is_set():
+            self.run_due()
+            self._stop.wait(self.wheel.tick)
+
+    def stop(self):
+        """end `run()` and close the socket"""
+        self._stop.set()
+        if self.server is not None:
+            threading.Thread(target=self.server.shutdown, daemon=True).start()
+
+    def close(self):
+        if self.server is not None:
+            self.server.server_close()
+
+def ask_daemon(address, request, timeout=30):
+    """send one request to a running watch daemon
+
+    Args:
+        address (:obj:`tuple`): (host, port) of the daemon
+        request (:obj:`dict`): query, or `{"cmd": "status"}`
+        timeout (float, optional): seconds to wait for the answer
+
+    Returns:
+        (:obj:`dict`): daemon response (`ok` False with `error` on failure)
+
+    """
+    with socket.create_connection(address, timeout=timeout) as connection:
+        connection.sendall(json.dumps(request).encode('utf-8') + b'\n')
+        with connection.makefile('rb') as reader:
+            return json.loads(reader.readline().decode('utf-8'))